@@ -0,0 +1,187 @@
+"""Benchmark convert-index and cogify-assets on synthetic data, served from
+local stand-ins for the Geobase FTP and S3.
+
+    python -m benchmarks.run --features 1000 --features 10000 -o results.json
+
+Each command is run in its own process, and its wall time and peak RSS are
+recorded along with the per-stage totals and throughput of the command (see
+stactools.nrcan_spot_ortho.metrics). The results are written as JSON, so that
+runs of different versions can be compared.
+"""
+import json
+import os
+import platform
+from subprocess import DEVNULL
+import subprocess
+import sys
+from tempfile import TemporaryDirectory
+from time import perf_counter, time
+
+import boto3
+import click
+
+from benchmarks.servers import ftp_server, s3_server
+from benchmarks.synthetic import write_ftp_tree, write_index, write_listing
+from stactools.nrcan_spot_ortho import __version__
+from stactools.nrcan_spot_ortho.metrics import Metrics
+
+bucket = "benchmark"
+
+
+def run_command(args, env, verbose=False):
+    """Run a nrcan-spot-ortho command in a new process.
+
+    Returns:
+        dict: The "seconds" the command took and the "peak_rss_mb" of its
+        process.
+    """
+    command = [sys.executable, "-m", "stactools.cli", "nrcan-spot-ortho"]
+    output = None if verbose else DEVNULL
+    start = perf_counter()
+    proc = subprocess.Popen(command + args,
+                            env=env,
+                            stdout=output,
+                            stderr=output)
+    # Wait with wait4 rather than proc.wait, for the resource use of the process
+    _, status, usage = os.wait4(proc.pid, 0)
+    seconds = perf_counter() - start
+    if not os.WIFEXITED(status) or os.WEXITSTATUS(status) != 0:
+        raise Exception(f"{args[0]} failed with status {status}")
+    # ru_maxrss is in KB on Linux
+    return {"seconds": seconds, "peak_rss_mb": usage.ru_maxrss / 1024}
+
+
+def stage_totals(metrics_path):
+    """Per-stage totals of a metrics file written by cogify-assets."""
+    metrics = Metrics()
+    with open(metrics_path) as f:
+        for line in f:
+            metrics.emit(json.loads(line))
+    return metrics.summary()
+
+
+def _run_benchmarks(tmp_dir, ftp_root, endpoint, ftp_address, features,
+                    cogify_items, image_size, workers, verbose):
+    host, port = ftp_address
+    env = dict(os.environ,
+               AWS_ACCESS_KEY_ID="benchmark",
+               AWS_SECRET_ACCESS_KEY="benchmark",
+               AWS_DEFAULT_REGION="us-east-1",
+               AWS_ENDPOINT_URL=endpoint,
+               AWS_S3_ENDPOINT=endpoint.split("//")[1],
+               AWS_HTTPS="NO",
+               AWS_VIRTUAL_HOSTING="FALSE",
+               GEOBASE_FTP_HOST=host,
+               GEOBASE_FTP_PORT=str(port))
+    boto3.client("s3",
+                 endpoint_url=endpoint,
+                 aws_access_key_id="benchmark",
+                 aws_secret_access_key="benchmark",
+                 region_name="us-east-1").create_bucket(Bucket=bucket)
+
+    results = []
+    for num_features in features:
+        print(f"convert-index, {num_features} features...")
+        index_path = os.path.join(tmp_dir, f"index_{num_features}.shp")
+        listing_path = os.path.join(tmp_dir, f"listing_{num_features}.json")
+        write_index(index_path, num_features)
+        write_listing(listing_path, num_features)
+
+        metrics_path = os.path.join(tmp_dir, f"convert_{num_features}.jsonl")
+        result = run_command([
+            "convert-index", index_path,
+            f"s3://{bucket}/convert_{num_features}", "--listing-cache",
+            listing_path, "--workers",
+            str(workers), "--metrics", metrics_path
+        ], env, verbose)
+        result.update(command="convert-index",
+                      features=num_features,
+                      items_per_s=num_features / result["seconds"],
+                      stages=stage_totals(metrics_path))
+        results.append(result)
+        print(json.dumps(result))
+
+    if cogify_items:
+        print(f"cogify-assets, {cogify_items} items...")
+        index_path = os.path.join(tmp_dir, "index_cogify.shp")
+        write_index(index_path, cogify_items)
+        write_ftp_tree(ftp_root, cogify_items, image_size)
+        # Without a listing cache, the items are listed on the FTP stand-in
+        root_href = f"s3://{bucket}/cogify"
+        run_command(["convert-index", index_path, root_href], env, verbose)
+
+        metrics_path = os.path.join(tmp_dir, "cogify.jsonl")
+        result = run_command([
+            "cogify-assets", f"{root_href}/catalog.json", "--cog-directory",
+            f"s3://{bucket}/cogs", "--workers",
+            str(workers), "--metrics", metrics_path
+        ], env, verbose)
+        result.update(command="cogify-assets",
+                      items=cogify_items,
+                      image_size=image_size,
+                      items_per_s=cogify_items / result["seconds"],
+                      stages=stage_totals(metrics_path))
+        results.append(result)
+        print(json.dumps(result))
+
+    return results
+
+
+@click.command()
+@click.option('-f',
+              '--features',
+              type=click.IntRange(min=1),
+              multiple=True,
+              default=[1000, 10000, 100000],
+              help="Number of index features to convert, once per value.")
+@click.option('-c',
+              '--cogify-items',
+              type=click.IntRange(min=0),
+              default=10,
+              help="Number of items to COGify, or 0 to skip cogify-assets.")
+@click.option('--image-size',
+              type=click.IntRange(min=64),
+              default=1024,
+              help="Width and height in pixels of the synthetic GeoTIFFs.")
+@click.option('-w',
+              '--workers',
+              type=click.IntRange(min=1),
+              default=1,
+              help="Number of worker processes of each command.")
+@click.option('-o',
+              '--output',
+              default="benchmark.json",
+              help="The JSON file to write the results to.")
+@click.option('-v',
+              '--verbose',
+              is_flag=True,
+              default=False,
+              help="Show the output of the commands.")
+def main(features, cogify_items, image_size, workers, output, verbose):
+    """Benchmark convert-index and cogify-assets."""
+    with TemporaryDirectory() as tmp_dir:
+        ftp_root = os.path.join(tmp_dir, "ftp")
+        os.makedirs(ftp_root)
+        with s3_server(verbose) as endpoint, \
+                ftp_server(ftp_root, verbose) as ftp_address:
+            results = _run_benchmarks(tmp_dir, ftp_root, endpoint, ftp_address,
+                                      features, cogify_items, image_size,
+                                      workers, verbose)
+
+    with open(output, "w") as f:
+        json.dump(
+            {
+                "version": __version__,
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "created": time(),
+                "workers": workers,
+                "results": results
+            },
+            f,
+            indent=2)
+    print(f"Wrote {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""Local stand-ins for the Geobase FTP and S3, run in background threads."""
+from contextlib import contextmanager
+import logging
+from threading import Event, Thread
+
+from moto.server import ThreadedMotoServer
+from pyftpdlib.authorizers import DummyAuthorizer
+from pyftpdlib.handlers import FTPHandler
+from pyftpdlib.servers import ThreadedFTPServer
+
+
+@contextmanager
+def ftp_server(root, verbose=False):
+    """Serve the directory root over anonymous, read-only FTP on a free local
+    port, logging each request if verbose.
+
+    Yields:
+        tuple: The host and port of the server.
+    """
+    if not verbose:
+        # pyftpdlib logs every request to stderr unless its logger already has
+        # a handler
+        logger = logging.getLogger("pyftpdlib")
+        logger.addHandler(logging.NullHandler())
+        logger.setLevel(logging.WARNING)
+    authorizer = DummyAuthorizer()
+    authorizer.add_anonymous(root)
+    handler = type("BenchmarkFTPHandler", (FTPHandler, ), {
+        "authorizer": authorizer,
+        "banner": "Geobase FTP stand-in"
+    })
+    server = ThreadedFTPServer(("127.0.0.1", 0), handler)
+    stopped = Event()
+
+    def serve():
+        # Poll, so that the server can be stopped from this thread
+        while not stopped.is_set():
+            server.serve_forever(timeout=0.1, blocking=False)
+
+    thread = Thread(target=serve, daemon=True)
+    thread.start()
+    try:
+        yield server.address
+    finally:
+        stopped.set()
+        thread.join()
+        server.close_all()
+
+
+@contextmanager
+def s3_server(verbose=False):
+    """Run a moto S3 server on a free local port, logging each request if
+    verbose.
+
+    Yields:
+        str: The endpoint URL of the server.
+    """
+    if not verbose:
+        logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    server = ThreadedMotoServer(ip_address="127.0.0.1",
+                                port=0,
+                                verbose=verbose)
+    server.start()
+    try:
+        host, port = server.get_host_and_port()
+        yield f"http://{host}:{port}"
+    finally:
+        server.stop()
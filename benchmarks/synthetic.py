@@ -0,0 +1,143 @@
+"""Synthetic SPOT index shapefiles, Geobase FTP listings and zipped imagery."""
+from collections import OrderedDict
+import json
+import os
+import posixpath
+from time import time
+from zipfile import ZIP_DEFLATED, ZipFile
+
+import fiona
+import numpy as np
+import rasterio
+from rasterio.transform import from_origin
+
+from stactools.nrcan_spot_ortho.geobase_ftp import GeobaseSpotFTP
+
+schema = {
+    'properties': OrderedDict([('NAME', 'str:50')]),
+    'geometry': 'Polygon'
+}
+
+# The Canada Atlas Lambert projection of the Geobase SPOT index
+crs = {
+    'proj': 'lcc',
+    'lat_0': 49,
+    'lon_0': -95,
+    'lat_1': 77,
+    'lat_2': 49,
+    'x_0': 0,
+    'y_0': 0,
+    'datum': 'NAD83',
+    'units': 'm',
+    'no_defs': True
+}
+
+# Scenes of about 60 km, in rows across southern Canada
+scene_size = 60000
+scenes_per_row = 80
+origin = (-2400000, 200000)
+
+
+def scene_names(num_features):
+    """Names of num_features SPOT 4 and 5 scenes, in the format of the index."""
+    return [
+        f"S{4 + i % 2}_{i // 100:05d}_{i % 100:02d}00_2007{1 + i % 12:02d}01"
+        for i in range(num_features)
+    ]
+
+
+def write_index(path, num_features):
+    """Write an index shapefile of num_features non-overlapping scenes."""
+    with fiona.open(path, 'w', driver='ESRI Shapefile', schema=schema,
+                    crs=crs) as dst:
+        for i, name in enumerate(scene_names(num_features)):
+            x = origin[0] + (i % scenes_per_row) * scene_size
+            y = origin[1] + (i // scenes_per_row % 50) * scene_size
+            dst.write({
+                'type': 'Feature',
+                'id': str(i),
+                'properties': OrderedDict([('NAME', name)]),
+                'geometry': {
+                    'type':
+                    'Polygon',
+                    'coordinates': [[(x, y), (x + scene_size, y),
+                                     (x + scene_size, y + scene_size),
+                                     (x, y + scene_size), (x, y)]]
+                }
+            })
+
+
+def scene_files(name):
+    """The file names of a scene's zipped lcc00 imagery."""
+    base = name.lower()
+    return [f"{base}_m20_lcc00.zip", f"{base}_p10_lcc00.zip"]
+
+
+def write_listing(path, num_features):
+    """Write a Geobase FTP listing cache (see geobase_ftp.get_listing) of the
+    first num_features scenes, so that convert-index doesn't list the FTP.
+    """
+    geobase = GeobaseSpotFTP(connect=False)
+    listing = {}
+    for name in scene_names(num_features):
+        directory = posixpath.join(geobase.spot_location, name.lower())
+        listing[name.lower()] = [
+            geobase.href(posixpath.join(directory, fname))
+            for fname in scene_files(name)
+        ]
+    with open(path, "w") as f:
+        json.dump({"created": time(), "listing": listing}, f)
+
+
+def _write_band(path, image_size, value):
+    # Noisy pixels, so the zip files and COGs compress like real imagery rather
+    # than to almost nothing
+    rng = np.random.default_rng(value)
+    pixels = rng.normal(100 + value * 20, 30, (1, image_size, image_size))
+    with rasterio.open(path,
+                       'w',
+                       driver='GTiff',
+                       width=image_size,
+                       height=image_size,
+                       count=1,
+                       dtype='uint8',
+                       crs='EPSG:3979',
+                       transform=from_origin(0, 0, 20, 20)) as dst:
+        dst.write(np.clip(pixels, 0, 255).astype('uint8'))
+
+
+def _write_zip(path, tif_names, image_size, tmp_dir):
+    with ZipFile(path, 'w', ZIP_DEFLATED) as zfile:
+        for value, tif_name in enumerate(tif_names):
+            tif_path = os.path.join(tmp_dir, tif_name)
+            _write_band(tif_path, image_size, value)
+            zfile.write(tif_path, f"{tif_name[:-4]}/{tif_name}")
+            os.remove(tif_path)
+
+
+def write_ftp_tree(root, num_features, image_size=1024):
+    """Write the zipped imagery and thumbnails of the first num_features scenes
+    under root, laid out as on the Geobase FTP. Every scene has a four-band m20
+    zip file and a single-band p10 zip file of image_size by image_size
+    GeoTIFFs.
+    """
+    geobase = GeobaseSpotFTP(connect=False)
+    spot_dir = os.path.join(root, geobase.spot_location.lstrip("/"))
+    os.makedirs(os.path.join(spot_dir, "images"), exist_ok=True)
+
+    for name in scene_names(num_features):
+        base = name.lower()
+        scene_dir = os.path.join(spot_dir, base)
+        os.makedirs(scene_dir, exist_ok=True)
+        m20_path, p10_path = [
+            os.path.join(scene_dir, fname) for fname in scene_files(name)
+        ]
+        _write_zip(m20_path,
+                   [f"{base}_m20_{i}_lcc00.tif" for i in range(1, 5)],
+                   image_size, scene_dir)
+        _write_zip(p10_path, [f"{base}_p10_1_lcc00.tif"], image_size,
+                   scene_dir)
+
+        with open(os.path.join(spot_dir, "images", f"{base}_tn.jpg"),
+                  "wb") as f:
+            f.write(b"\xff\xd8\xff\xd9")
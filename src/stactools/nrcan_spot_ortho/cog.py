@@ -1,58 +1,186 @@
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+import logging
+import multiprocessing
 import os
+import re
 from tempfile import TemporaryDirectory
+from threading import Lock
 import pystac
 from pystac.extensions.eo import EOExtension
 from pystac.extensions.projection import ProjectionExtension
-from stactools.nrcan_spot_ortho.stac_templates import image_types
-from stactools.nrcan_spot_ortho.geobase_ftp import GeobaseSpotFTP
+from stactools.nrcan_spot_ortho.stac_templates import (image_types,
+                                                       stacked_image_types)
+from stactools.nrcan_spot_ortho.crawler import crawl_items
+from stactools.nrcan_spot_ortho.journal import CogifyJournal
+from stactools.nrcan_spot_ortho.metrics import Metrics, get_metrics, set_metrics
+from stactools.nrcan_spot_ortho.pipeline import Stage, run_pipeline
+from stactools.nrcan_spot_ortho.sources import open_source
 from stactools.nrcan_spot_ortho.stac_templates import (spot_bands, spot_pan,
                                                        proj_epsg)
-from stactools.nrcan_spot_ortho.utils import (CustomStacIO, download_from_ftp,
-                                              call, get_existing_paths, unzip,
-                                              upload_to_s3)
+from stactools.nrcan_spot_ortho.utils import (CustomStacIO, DownloadCache,
+                                              PathIndex, RasterMetadataStore,
+                                              S3Uploader, build_stack_vrt,
+                                              call, get_uploader, unzip,
+                                              upload_to_s3, zip_members)
 from urllib.parse import urlparse
 import rasterio
+from rasterio._err import CPLE_BaseError
+from rasterio.errors import RasterioError
+import rasterio.shutil
+
+logger = logging.getLogger(__name__)
 
 pystac.StacIO.set_default(CustomStacIO)
 
+# GDAL COG driver creation options used unless overridden, see
+# https://gdal.org/drivers/raster/cog.html
+default_cog_options = {"compress": "deflate"}
+
+cog_engines = ["rasterio", "gdal_translate"]
+
+# Projection whose COGs are included under plain asset keys, such as "B1". The
+# COGs of other projections have the projection in their keys, such as
+# "B1_utm17".
+default_cog_proj = "lcc00"
+
+
+def cog_asset_key(title, cog_proj):
+    """Get the key of the asset of a COG with the given title and projection."""
+    return title if cog_proj == default_cog_proj else f"{title}_{cog_proj}"
 
-def cogify(input_path, output_path, overwrite, existing_cog_paths):
-    """COGify a geotiff at input_path to a cloud optimized geotiff at output_path.
+
+def zip_asset_projs(item):
+    """Get the projection of each zipped imagery asset of an item.
+
+    Returns:
+        dict: The key of each zipped imagery asset, such as "m20_utm17", to its
+        projection, such as "utm17".
     """
-    print(f"COGifying {os.path.basename(input_path)}")
-    failure = False
-    parsed = urlparse(output_path)
-
-    if (not overwrite) and (output_path in existing_cog_paths):
-        print(f"Skipping {os.path.basename(output_path)}, already COGified.")
-
-    elif parsed.scheme == "s3":
-        with TemporaryDirectory() as tmp_dir:
-            tmp_path = os.path.join(tmp_dir, os.path.basename(output_path))
-            failure = call([
-                'gdal_translate', '-of', 'COG', '-co', 'compress=deflate',
-                input_path, tmp_path
-            ])
-            upload_to_s3(parsed, tmp_path)
+    return {
+        k: k.lower().rsplit("_", 1)[-1]
+        for k, v in item.assets.items() if v.media_type == "application/zip"
+    }
 
-    else:
-        failure = call([
-            'gdal_translate', '-of', 'COG', '-co', 'compress=deflate',
-            input_path, output_path
-        ])
 
-    if failure:
-        print(f"Could not COGify to {output_path}")
-        raise
+def cog_layout(merge_bands):
+    """Get the name of the layout of the bands of COGs, as journaled."""
+    return "merged" if merge_bands else "bands"
+
 
+def item_cog_projs(item, cog_projs):
+    """Get the projections of cog_projs that an item has zipped imagery in.
 
-def include_cog_asset(item, cog_path, cog_proj):
+    Args:
+        item (pystac.Item): The item.
+        cog_projs (list): Projections, as keys of proj_epsg. "utm" stands for
+            the local UTM zone of the item, whichever it is. A single projection
+            can be passed as a string.
+
+    Returns:
+        list: The sorted projections.
+    """
+    if isinstance(cog_projs, str):
+        cog_projs = (cog_projs, )
+    return sorted(
+        set(proj for proj in zip_asset_projs(item).values()
+            if proj in cog_projs or (
+                "utm" in cog_projs and proj.startswith("utm"))))
+
+
+def translate(input_path, output_path, cog_options=None, engine="rasterio"):
+    """Convert a geotiff at input_path to a cloud optimized geotiff at the local
+    output_path.
+
+    Args:
+        input_path (str): Path of the geotiff, which can be a GDAL virtual file
+            system path such as /vsizip/.
+        output_path (str): Local path to write the COG to.
+        cog_options (dict): GDAL COG driver creation options, such as compress,
+            predictor, blocksize, overview_resampling and num_threads, that
+            override default_cog_options. num_threads also sets GDAL_NUM_THREADS.
+            Options set to None are left to GDAL.
+        engine (str): "rasterio" to write the COG within this process, or
+            "gdal_translate" to run the gdal_translate command.
+    """
+    options = {
+        k.upper(): str(v)
+        for k, v in {
+            **default_cog_options,
+            **(cog_options or {})
+        }.items() if v is not None
+    }
+    config = {}
+    if "NUM_THREADS" in options:
+        config["GDAL_NUM_THREADS"] = options["NUM_THREADS"]
+
+    with get_metrics().timer("translate", path=output_path) as event:
+        if engine == "rasterio":
+            try:
+                with rasterio.Env(**config):
+                    rasterio.shutil.copy(input_path,
+                                         output_path,
+                                         driver="COG",
+                                         **options)
+                failure = False
+            except (RasterioError, CPLE_BaseError) as e:
+                # GDAL errors, such as failing to write output_path, are raised
+                # as CPLE_* errors rather than RasterioError
+                logger.error(e)
+                failure = True
+
+        else:
+            command = ['gdal_translate', '-of', 'COG']
+            for k, v in options.items():
+                command += ['-co', f'{k}={v}']
+            for k, v in config.items():
+                command += ['--config', k, v]
+            failure = call(command + [input_path, output_path])
+
+        if failure:
+            print(f"Could not COGify to {output_path}")
+            raise Exception(f"{engine} failed on {input_path}")
+        event["bytes"] = os.path.getsize(output_path)
+
+
+def read_cog_metadata(cog_path):
+    """Read the raster metadata of a COG that describes it as an asset.
+
+    Args:
+        cog_path (str): A local path or URI of the COG.
+
+    Returns:
+        dict: The "transform", "bbox", "wkt2" and "gsd" of the COG.
+    """
+    with rasterio.open(cog_path) as src:
+        return {
+            "transform": list(src.transform),
+            "bbox": list(src.bounds),
+            # "projjson": src.crs.to_dict(proj_json=True),
+            "wkt2": src.crs.wkt,
+            "gsd": src.res[0]
+        }
+
+
+def include_cog_asset(item, cog_path, cog_proj, cog_metadata=None):
     """Mutate a STAC item to include a COG at cog_path with the
      projection cog_proj as an asset.
+
+    The raster metadata of the COG is taken from cog_metadata
+    (RasterMetadataStore) when it is known there. Otherwise the COG is opened
+    to read it, and it is added to cog_metadata.
     """
     # Include the COG as an asset
     cog_filename = os.path.basename(cog_path)
-    title = [v for k, v in image_types.items() if k in cog_filename][0]
+    stacked = [
+        v for k, v in stacked_image_types.items()
+        if f"{k}_{cog_proj}" in cog_filename
+    ]
+    if stacked:
+        title = stacked[0]
+    else:
+        title = [v for k, v in image_types.items() if k in cog_filename][0]
     asset = pystac.Asset(href=cog_path,
                          media_type=pystac.MediaType.COG,
                          roles=['data'],
@@ -60,20 +188,245 @@ def include_cog_asset(item, cog_path, cog_proj):
 
     # Provide band and projection information for the asset
     eo_ext = EOExtension.ext(asset)
-    if title == "pan":
+    if stacked:
+        eo_ext.apply(list(spot_bands.values()))
+    elif title == "pan":
         eo_ext.apply([spot_pan[cog_filename[:2].upper()]])
     else:
         eo_ext.apply([spot_bands[title]])
     proj_ext = ProjectionExtension.ext(asset)
     proj_ext.epsg = proj_epsg[cog_proj]
-    with rasterio.open(cog_path) as src:
-        proj_ext.transform = src.transform
-        proj_ext.bbox = src.bounds
-        # proj_ext.projjson = src.crs.to_dict(proj_json=True)
-        proj_ext.wkt2 = src.crs.wkt
-        asset.properties['gsd'] = src.res[0]
+    metadata = cog_metadata.get(cog_path) if cog_metadata else None
+    if metadata is None:
+        metadata = read_cog_metadata(cog_path)
+        if cog_metadata is not None:
+            cog_metadata.add(cog_path, metadata)
+    proj_ext.transform = metadata["transform"]
+    proj_ext.bbox = metadata["bbox"]
+    proj_ext.wkt2 = metadata["wkt2"]
+    asset.extra_fields['gsd'] = metadata["gsd"]
+
+    item.assets[cog_asset_key(title, cog_proj)] = asset
+
+
+def group_bands(non_cog_paths, merge_bands):
+    """Group GeoTIFFs by the COG they are converted into.
+
+    Args:
+        non_cog_paths (list): Paths of the GeoTIFFs.
+        merge_bands (bool): Whether to put the four single-band m20 GeoTIFFs of
+            an image into one four-band COG.
+
+    Returns:
+        dict: The file name of each COG's source, before the "_cog" suffix, to
+        the paths of the GeoTIFFs holding its bands, in band order.
+    """
+    groups = {}
+    for non_cog_path in sorted(non_cog_paths):
+        name = os.path.basename(non_cog_path)
+        if merge_bands:
+            name = re.sub(r"_m20_[1-4]_", "_m20_", name)
+        groups.setdefault(name, []).append(non_cog_path)
+    return groups
+
+
+# Default number of threads for each stage of the COGify pipeline
+default_stage_workers = {
+    "fetch": 1,
+    "extract": 1,
+    "translate": 1,
+    "publish": 1
+}
+
+
+def cogify_zips(zip_hrefs,
+                tmp_dir,
+                cog_directory,
+                overwrite,
+                existing_cog_paths,
+                source,
+                stage_workers=None,
+                queue_size=1,
+                stream_zips=True,
+                cog_options=None,
+                cog_engine="rasterio",
+                merge_bands=False,
+                uploader=None,
+                journal=None,
+                item_id=None,
+                cog_metadata=None):
+    """Download, unzip and COGify zipped imagery, with the download, unzip,
+    COGify and upload of different files happening at the same time.
 
-    item.assets[title] = asset
+    Args:
+        zip_hrefs (list): Geobase FTP hrefs of zipped imagery.
+        tmp_dir (str): Directory for intermediate files. Each intermediate file
+            is deleted as soon as the next stage is done with it.
+        cog_directory (str): A URI of a directory to store COGs.
+        overwrite (bool): Whether to overwrite existing COG files.
+        existing_cog_paths (PathIndex): Existing COG locations, to which new
+            COGs are added.
+        source (Source): Where to read the zip files from. Zip files the
+            source has locally are read in place rather than downloaded.
+        stage_workers (dict): Number of threads for each of the "fetch",
+            "extract", "translate" and "publish" stages. Missing stages use
+            default_stage_workers.
+        queue_size (int): Maximum number of files waiting between two stages,
+            which bounds the temporary disk use.
+        stream_zips (bool): Whether to COGify GeoTIFFs by reading them straight
+            out of the zip files. Otherwise the GeoTIFFs are extracted to tmp_dir
+            first.
+        cog_options (dict): GDAL COG driver creation options, see translate.
+        cog_engine (str): "rasterio" or "gdal_translate", see translate.
+        merge_bands (bool): Whether to write the four single-band m20 GeoTIFFs
+            of an image as one pixel-interleaved four-band COG.
+        uploader (S3Uploader): Uploads COGs to S3 in the background. If None is
+            passed then the process' default uploader is used.
+        journal (CogifyJournal): Journal to record the progress of each zip
+            file and COG in, under item_id.
+        item_id (str): ID of the item the zip files belong to.
+        cog_metadata (RasterMetadataStore): Store to which the raster metadata
+            of new COGs is added, read from the local COGs as they are written.
+
+    Returns:
+        list: The sorted locations of the COGs.
+    """
+    workers = {**default_stage_workers, **(stage_workers or {})}
+    uploader = uploader or get_uploader()
+    layout = cog_layout(merge_bands)
+
+    def record(path, state, source=None):
+        if journal is not None:
+            journal.set_asset(item_id, path, state, source, layout)
+
+    def fetch(zip_href):
+        local_path = source.local_path(zip_href)
+        if local_path is not None:
+            record(zip_href, "downloaded")
+            yield zip_href, local_path, False
+            return
+
+        zip_path = os.path.join(tmp_dir, os.path.basename(zip_href))
+        if source.fetch(zip_href, zip_path):
+            record(zip_href, "downloaded")
+            yield zip_href, zip_path, True
+
+    # Number of streamed COG sources not yet COGified, per downloaded zip file.
+    # A zip file is deleted once all of its GeoTIFFs have been read. Zip files
+    # read in place aren't tracked.
+    unread = {}
+    unread_lock = Lock()
+
+    def extract(zip_file):
+        zip_href, zip_path, downloaded = zip_file
+        if stream_zips:
+            groups = group_bands(zip_members(zip_path), merge_bands)
+            if downloaded:
+                with unread_lock:
+                    unread[zip_path] = len(groups)
+                if not groups:
+                    os.remove(zip_path)
+            return [(name, sources, zip_href, zip_path)
+                    for name, sources in groups.items()]
+
+        non_cog_paths = [
+            f for f in unzip(zip_path, tmp_dir) if '.tif' in f.lower()
+        ]
+        if downloaded:
+            os.remove(zip_path)
+        groups = group_bands(non_cog_paths, merge_bands)
+        return [(name, sources, zip_href, None)
+                for name, sources in groups.items()]
+
+    def release(sources, zip_path):
+        if zip_path is None:
+            for non_cog_path in sources:
+                os.remove(non_cog_path)
+            return
+        with unread_lock:
+            if zip_path not in unread:
+                return
+            unread[zip_path] -= 1
+            done = unread[zip_path] == 0
+        if done:
+            os.remove(zip_path)
+
+    def convert(group):
+        name, sources, zip_href, zip_path = group
+        cog_filename = name.replace('.tif', '_cog.tif')
+        cog_path = os.path.join(cog_directory, cog_filename)
+        print(f"COGifying {name}")
+        if (not overwrite) and (cog_path in existing_cog_paths):
+            print(f"Skipping {cog_filename}, already COGified.")
+            local_path = None
+        else:
+            if urlparse(cog_path).scheme == "s3":
+                local_path = os.path.join(tmp_dir, cog_filename)
+            else:
+                local_path = cog_path
+
+            # Stack the bands of a multi-band COG in a VRT
+            if len(sources) > 1:
+                input_path = os.path.join(tmp_dir,
+                                          name.replace('.tif', '.vrt'))
+                build_stack_vrt(sources, input_path)
+            else:
+                input_path = sources[0]
+
+            translate(input_path, local_path, cog_options, cog_engine)
+            if len(sources) > 1:
+                os.remove(input_path)
+            if cog_metadata is not None:
+                cog_metadata.add(cog_path, read_cog_metadata(local_path))
+            record(cog_path, "translated", zip_href)
+        release(sources, zip_path)
+        yield cog_path, local_path, zip_href
+
+    def publish(paths):
+        cog_path, local_path, zip_href = paths
+        if local_path not in (None, cog_path):
+            upload = uploader.submit(urlparse(cog_path),
+                                     local_path,
+                                     remove=True)
+        else:
+            upload = None
+        yield cog_path, local_path, zip_href, upload
+
+    stages = [
+        Stage("fetch", fetch, workers["fetch"]),
+        Stage("extract", extract, workers["extract"]),
+        Stage("translate", convert, workers["translate"]),
+        Stage("publish", publish, workers["publish"]),
+    ]
+    results, failures = run_pipeline(zip_hrefs, stages, queue_size,
+                                     get_metrics())
+
+    # Wait for the uploads started by the publish stage, and record new COGs
+    cog_paths = []
+    published_zips = set()
+    for cog_path, local_path, zip_href, upload in results:
+        try:
+            if upload is not None:
+                upload.result()
+            cog_paths.append(cog_path)
+            published_zips.add(zip_href)
+            if local_path is not None:
+                existing_cog_paths.add(cog_path)
+            record(cog_path, "uploaded", zip_href)
+        except Exception as e:
+            failures.append(("upload", cog_path, e))
+
+    for stage_name, value, e in failures:
+        print(f"Failed to {stage_name} {value}: {e}")
+    if failures:
+        raise Exception(f"Could not COGify {len(failures)} file(s)")
+
+    # Zip files that weren't found or held no GeoTIFFs are left unpublished,
+    # so that a restarted run tries them again
+    for zip_href in zip_hrefs:
+        if zip_href in published_zips:
+            record(zip_href, "published")
+    return sorted(cog_paths)
 
 
 def cogify_item(item,
@@ -81,7 +434,17 @@ def cogify_item(item,
                 overwrite,
                 existing_cog_paths,
                 existing_tn_paths,
-                cog_proj="lcc00"):
+                cog_projs=(default_cog_proj, ),
+                stage_workers=None,
+                queue_size=1,
+                source=None,
+                stream_zips=True,
+                cog_options=None,
+                cog_engine="rasterio",
+                merge_bands=False,
+                uploader=None,
+                journal=None,
+                cog_metadata=None):
     """Create COGs from the GeoTIFF asset contained in the passed in STAC item.
     Mutates the item to include assets for the new COGs.
 
@@ -93,31 +456,77 @@ def cogify_item(item,
             the COG data. If None is passed then store COGs in the location given
             by the self_href of the item.
         overwrite (bool): Whether to overwrite existing COG files.
-        existing_cog_paths (list): List of existing COG locations.
-        existing_tn_paths (List): List of existing thumbnail locations.
-        cog_proj (str): Imagery is stored in LCC projection as well as local UTM
-        projections. Choose which of these projections to convert to COG (LCC
-        recommended, as it covers all of Canada).
+        existing_cog_paths (PathIndex): Existing COG locations, to which new
+            COGs are added.
+        existing_tn_paths (PathIndex): Existing thumbnail locations, to which
+            new thumbnails are added.
+        cog_projs (list): Imagery is stored in LCC projection as well as local
+            UTM projections. Choose which of these projections to convert to COG
+            (LCC recommended, as it covers all of Canada), see item_cog_projs.
+            The imagery of every projection is COGified in one pipeline, and
+            the COGs of projections other than default_cog_proj are included
+            under keys such as "B1_utm17".
+        stage_workers (dict): Number of threads for each stage of the COGify
+            pipeline, see cogify_zips.
+        queue_size (int): Maximum number of files waiting between two pipeline
+            stages.
+        source (Source): Where to read zip files and thumbnails from, see
+            sources.open_source. If None is passed then the Geobase FTP is
+            opened for this item only.
+        stream_zips (bool): Whether to read GeoTIFFs straight out of the zip
+            files rather than extracting them first.
+        cog_options (dict): GDAL COG driver creation options, see translate.
+        cog_engine (str): "rasterio" or "gdal_translate", see translate.
+        merge_bands (bool): Whether to write the four m20 bands as one four-band
+            COG, included as a single asset.
+        uploader (S3Uploader): Uploads files to S3. If None is passed then the
+            process' default uploader is used.
+        journal (CogifyJournal): Journal of the run. Zip files it records as
+            published are not COGified again, and the progress of the rest is
+            recorded in it.
+        cog_metadata (RasterMetadataStore): Raster metadata of COGs, used to
+            describe existing COGs without opening them. The metadata of new
+            COGs is added to it.
     """
     if cog_directory is None:
         cog_directory = os.path.dirname(item.get_self_href())
 
-    with TemporaryDirectory() as tmp_dir:
-        # Get asset names associated with the chosen projection
-        asset_names = [k for k in item.assets.keys() if cog_proj in k.lower()]
-
-        for asset_name in asset_names:
+    source_context = open_source() if source is None else nullcontext(source)
+    with TemporaryDirectory() as tmp_dir, source_context as source:
+        # Get asset names associated with the chosen projections
+        projs = item_cog_projs(item, cog_projs)
+        asset_projs = {
+            k: proj
+            for k, proj in zip_asset_projs(item).items() if proj in projs
+        }
+
+        zip_hrefs = []
+        for asset_name, cog_proj in asset_projs.items():
             zip_href = item.assets[asset_name].href
 
+            if journal is not None and not overwrite:
+                cog_paths = journal.published_cogs(item.id, zip_href,
+                                                   cog_layout(merge_bands))
+                if cog_paths is not None:
+                    for cog_path in cog_paths:
+                        include_cog_asset(item, cog_path, cog_proj,
+                                          cog_metadata)
+                    print(f"Skipping {asset_name}, already COGified.")
+                    continue
+
             if not overwrite:
                 # predict cog file names
                 fname_base = os.path.basename(zip_href).replace(
                     f"_{cog_proj}.zip", "")
-                bands = range(1, 5) if fname_base[-3:] == "m20" else [1]
+                if merge_bands and fname_base[-3:] in stacked_image_types:
+                    bands = [""]
+                elif fname_base[-3:] == "m20":
+                    bands = [f"_{i}" for i in range(1, 5)]
+                else:
+                    bands = ["_1"]
                 cog_paths = [
-                    os.path.join(
-                        cog_directory,
-                        f"{s}{fname_base[1:]}_{i}_{cog_proj}_cog.tif")
+                    os.path.join(cog_directory,
+                                 f"{s}{fname_base[1:]}{i}_{cog_proj}_cog.tif")
                     for i in bands for s in ["s", "S"]
                 ]
 
@@ -125,7 +534,8 @@ def cogify_item(item,
                 exists = False
                 for cog_path in cog_paths:
                     if cog_path in existing_cog_paths:
-                        include_cog_asset(item, cog_path, cog_proj)
+                        include_cog_asset(item, cog_path, cog_proj,
+                                          cog_metadata)
                         exists = True
 
                 # skip download/unzip/cogify if any exist (assume all done)
@@ -133,25 +543,17 @@ def cogify_item(item,
                     print(f"Skipping {asset_name}, already COGified.")
                     continue
 
-            # Download zip file
-            zip_path = os.path.join(tmp_dir, os.path.basename(zip_href))
-            success = download_from_ftp(zip_href, zip_path, GeobaseSpotFTP())
-            if not success:
-                continue
-
-            # Unzip images
-            non_cog_paths = [
-                f for f in unzip(zip_path, tmp_dir) if '.tif' in f.lower()
-            ]
-
-            # For each image, COGify and include as an asset
-            for non_cog_path in non_cog_paths:
-                # COGify
-                cog_filename = (os.path.basename(non_cog_path).replace(
-                    '.tif', '_cog.tif'))
-                cog_path = os.path.join(cog_directory, cog_filename)
-                cogify(non_cog_path, cog_path, overwrite, existing_cog_paths)
-                include_cog_asset(item, cog_path, cog_proj)
+            zip_hrefs.append(zip_href)
+
+        # Download, unzip and COGify, then include each COG as an asset
+        for cog_path in cogify_zips(zip_hrefs, tmp_dir, cog_directory,
+                                    overwrite, existing_cog_paths, source,
+                                    stage_workers, queue_size, stream_zips,
+                                    cog_options, cog_engine, merge_bands,
+                                    uploader, journal, item.id, cog_metadata):
+            # COG file names end with the projection, as in _m20_1_lcc00_cog.tif
+            cog_proj = os.path.basename(cog_path).split("_")[-2].lower()
+            include_cog_asset(item, cog_path, cog_proj, cog_metadata)
 
         # Download the thumbnail to the same location as the COGs, checking
         # if already downloaded first
@@ -165,20 +567,105 @@ def cogify_item(item,
             if tn_path not in existing_tn_paths:
                 if (parsed.scheme == "s3"):
                     tmp_tn_path = os.path.join(tmp_dir, tn_fname)
-                    success = download_from_ftp(tn_href, tmp_tn_path,
-                                                GeobaseSpotFTP())
+                    success = source.fetch(tn_href, tmp_tn_path)
                     if success:
-                        upload_to_s3(parsed, tmp_tn_path)
+                        upload_to_s3(parsed, tmp_tn_path, uploader)
 
                 else:
-                    success = download_from_ftp(tn_href, tn_path,
-                                                GeobaseSpotFTP())
+                    success = source.fetch(tn_href, tn_path)
 
             if success:
+                existing_tn_paths.add(tn_path)
                 item.assets["thumbnail"].href = tn_path
 
 
-def cogify_catalog(catalog_path, cog_directory=None, overwrite=False):
+# Per-process arguments shared by every item a pool worker COGifies, set once
+# by _init_worker rather than pickled with each submitted item
+_worker_kwargs = {}
+# Metrics events of the item a pool worker is COGifying, which are sent back to
+# the parent process with the item
+_worker_events = []
+
+
+def _init_worker(item_kwargs, source, ftp_connections, cache, upload_options):
+    _worker_kwargs.update(item_kwargs,
+                          source=open_source(source, ftp_connections, cache),
+                          uploader=S3Uploader(**upload_options))
+    metrics = Metrics()
+    metrics.add_hook(_worker_events.append)
+    set_metrics(metrics)
+
+
+def _cogify_item_worker(item_dict, item_href):
+    """COGify a single item inside a pool worker. Items travel between processes
+    as dictionaries so that the rest of the catalog isn't pickled with them.
+
+    Returns:
+        tuple: The COGified item as a dictionary, or None if it failed, the
+        metrics events of the item, and the error it failed with, if any.
+    """
+    _worker_events.clear()
+    item = pystac.Item.from_dict(item_dict, href=item_href)
+    try:
+        cogify_item(item, **_worker_kwargs)
+    except Exception as e:
+        return None, list(_worker_events), str(e)
+    return item.to_dict(), list(_worker_events), None
+
+
+def _save_cogified_item(item,
+                        future,
+                        projs=(),
+                        journal=None,
+                        layout=None,
+                        metrics=None):
+    """Copy the assets produced by a pool worker onto the item and save it. A
+    failed item is reported and left unsaved so the rest of the run continues.
+    The item is journaled as saved with the COGs of projs in layout, and the
+    metrics events of the worker are recorded in metrics.
+    """
+    try:
+        item_dict, events, error = future.result()
+    except Exception as e:
+        item_dict, events, error = None, [], str(e)
+    if metrics is not None:
+        for event in events:
+            metrics.emit(event)
+    if error is not None:
+        print(f"Failed to COGify {item.id}: {error}")
+        if journal is not None:
+            journal.set_item(item.id, "failed", error)
+        return
+
+    cogified = pystac.Item.from_dict(item_dict, href=item.get_self_href())
+    for key, asset in cogified.assets.items():
+        item.add_asset(key, asset)
+    item.save_object()
+    if journal is not None:
+        journal.set_item(item.id, "saved", projs=projs, layout=layout)
+
+
+def cogify_catalog(catalog_path,
+                   cog_directory=None,
+                   overwrite=False,
+                   workers=1,
+                   stage_workers=None,
+                   queue_size=1,
+                   ftp_connections=4,
+                   stream_zips=True,
+                   cog_options=None,
+                   cog_engine="rasterio",
+                   merge_bands=False,
+                   upload_options=None,
+                   snapshot_dir=None,
+                   refresh_snapshots=False,
+                   journal_path=None,
+                   prefetch=32,
+                   metrics=None,
+                   source="ftp",
+                   cache_dir=None,
+                   cache_size=50 * 1024**3,
+                   cog_projs=(default_cog_proj, )):
     """Crawl a catalog, find zipped imagery hrefs within items, download/unzip/COGify
     these, include the results as new assets.
 
@@ -189,7 +676,63 @@ def cogify_catalog(catalog_path, cog_directory=None, overwrite=False):
             the COG data. If None is passed then store COGs in the location given
             by the self_href of the item.
         overwrite (bool): Whether to overwrite existing COG files.
+        workers (int): Number of items to COGify at once in a process pool. With
+            more than one worker, an item that fails is reported and skipped
+            rather than stopping the run, and items are saved in catalog order.
+        stage_workers (dict): Number of threads for each stage of the COGify
+            pipeline within an item, see cogify_zips.
+        queue_size (int): Maximum number of files waiting between two pipeline
+            stages.
+        ftp_connections (int): Maximum number of Geobase FTP sessions, or HTTP
+            connections, open at once in each process. They are reused from
+            item to item.
+        stream_zips (bool): Whether to read GeoTIFFs straight out of the zip
+            files rather than extracting them first.
+        cog_options (dict): GDAL COG driver creation options, see translate.
+        cog_engine (str): "rasterio" or "gdal_translate", see translate.
+        merge_bands (bool): Whether to write the four m20 bands as one four-band
+            COG, included as a single asset.
+        upload_options (dict): Keyword arguments of the S3Uploader used in each
+            process, such as chunk_size and max_concurrency.
+        snapshot_dir (str): A local directory to keep snapshots of the existing
+            COGs and thumbnails in, along with the raster metadata of new COGs
+            (see RasterMetadataStore). Later runs read these instead of listing
+            the COG directory again, or opening the COGs.
+        refresh_snapshots (bool): Whether to list the COG directory even if
+            there are snapshots of it.
+        journal_path (str): A local SQLite file recording the progress of the
+            run (see CogifyJournal). When a run is restarted with the same
+            journal, items saved with the COGs of every projection of cog_projs
+            and the same merge_bands, and published zip files, are skipped.
+            Failed or unfinished ones are tried again. Without a journal, items
+            are skipped if the COG directory has their COGs.
+        prefetch (int): Number of item files read ahead of the item being
+            COGified, see crawl_items.
+        metrics (Metrics): Where to record the timings, sizes and queue
+            depths of the downloads, conversions, uploads and item writes of
+            the run, including those of the pool workers. A summary is printed
+            at the end of the run. If None is passed then a Metrics that only
+            keeps the summary is used.
+        source (str): Where to read zip files and thumbnails from: "ftp",
+            "http" or the directory of a local mirror of the Geobase FTP, see
+            sources.open_source.
+        cache_dir (str): A local directory to keep downloaded zip files and
+            thumbnails in (see DownloadCache), so that later runs, such as ones
+            with other COG options, don't download them again.
+        cache_size (int): The size in bytes the download cache is kept under.
+        cog_projs (list): The projections to COGify the imagery of, see
+            cogify_item. All of them are COGified in one pass over the catalog,
+            and each item is saved once.
     """
+    upload_options = upload_options or {}
+    cache = DownloadCache(cache_dir, cache_size) if cache_dir else None
+    metrics = metrics or Metrics()
+    set_metrics(metrics)
+    journal = CogifyJournal(journal_path) if journal_path else None
+    layout = cog_layout(merge_bands)
+    saved_items = journal.items("saved") if journal else set()
+    saved_projs = journal.saved_projs(layout) if journal else {}
+
     # Open catalog
     spot_catalog = pystac.read_file(catalog_path)
 
@@ -197,29 +740,131 @@ def cogify_catalog(catalog_path, cog_directory=None, overwrite=False):
     check_dir = cog_directory if cog_directory else os.path.dirname(
         catalog_path)
     print(f"Getting contents of {check_dir}...")
-    existing_cog_paths = get_existing_paths(check_dir, ending="_cog.tif")
-    existing_tn_paths = get_existing_paths(check_dir, ending="_tn.jpg")
 
-    count = 0
-    for _, _, items in spot_catalog.walk():
+    def existing_paths(ending):
+        snapshot_path = None
+        if snapshot_dir:
+            snapshot_path = os.path.join(snapshot_dir, f"existing{ending}.txt")
+        return PathIndex(check_dir, ending, snapshot_path, refresh_snapshots)
+
+    existing_cog_paths = existing_paths("_cog.tif")
+    existing_tn_paths = existing_paths("_tn.jpg")
+    metadata_path = None
+    if snapshot_dir:
+        metadata_path = os.path.join(snapshot_dir, "cog_metadata.jsonl")
+    cog_metadata = RasterMetadataStore(metadata_path)
+
+    # Arguments of cogify_item shared by every item. The FTP pool and S3
+    # uploader are added per process.
+    item_kwargs = dict(cog_directory=cog_directory,
+                       overwrite=overwrite,
+                       existing_cog_paths=existing_cog_paths,
+                       existing_tn_paths=existing_tn_paths,
+                       stage_workers=stage_workers,
+                       queue_size=queue_size,
+                       stream_zips=stream_zips,
+                       cog_options=cog_options,
+                       cog_engine=cog_engine,
+                       merge_bands=merge_bands,
+                       journal=journal,
+                       cog_metadata=cog_metadata,
+                       cog_projs=cog_projs)
+
+    if workers > 1:
+        # Workers are spawned rather than forked, as a fork can copy a lock held
+        # by one of the item prefetch, S3 client or upload threads already
+        # running, which the worker would then wait on forever
+        pool = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(item_kwargs, source, ftp_connections, cache,
+                      upload_options))
+    else:
+        pool = None
+    item_source = open_source(source, ftp_connections, cache)
+    uploader = S3Uploader(**upload_options)
+
+    # Submitted items awaiting their save, oldest first. Bounded so that a large
+    # catalog isn't queued up in memory all at once.
+    pending = deque()
+    max_pending = workers * 2
+
+    # An asset present on every COGified item, per projection
+    cog_key = stacked_image_types["m20"] if merge_bands else "B1"
+
+    def has_cog(item, cog_proj):
+        key = cog_asset_key(cog_key, cog_proj)
+        return (key in item.assets.keys()
+                and item.assets[key].href in existing_cog_paths)
 
+    count = 0
+    items = crawl_items(spot_catalog, prefetch)
+    try:
         for item in items:
             count += 1
             print(f"\n{item.id}... {count}")
 
             # Skip if COGified already and overwrite==False
-            cogified = ("B1" in item.assets.keys()) and (item.assets["B1"].href
-                                                         in existing_cog_paths)
+            # The journal only skips an item saved with the COGs this run asks
+            # for, as an earlier run may have been for other projections or
+            # layouts
+            projs = item_cog_projs(item, cog_projs)
+            if journal is None:
+                cogified = bool(projs) and all(
+                    has_cog(item, proj) for proj in projs)
+            elif projs:
+                cogified = set(projs) <= saved_projs.get(item.id, set())
+            else:
+                cogified = item.id in saved_items
 
             # cogified = "B1" in item.assets.keys()
-            if (not cogified) or (cogified and overwrite):
+            if cogified and not overwrite:
+                print(f"Skipping {item.id}, already COGified.")
 
+            elif pool is None:
+                if journal is not None:
+                    journal.set_item(item.id, "started")
                 # COGify item's assets and save item
-                cogify_item(item, cog_directory, overwrite, existing_cog_paths,
-                            existing_tn_paths)
+                try:
+                    cogify_item(item,
+                                source=item_source,
+                                uploader=uploader,
+                                **item_kwargs)
+                except Exception as e:
+                    if journal is not None:
+                        journal.set_item(item.id, "failed", str(e))
+                    raise
                 # spot_catalog.normalize_and_save(os.path.dirname(catalog_path),
                 #                                 spot_catalog.catalog_type)
                 item.save_object()
+                if journal is not None:
+                    journal.set_item(item.id,
+                                     "saved",
+                                     projs=projs,
+                                     layout=layout)
 
             else:
-                print(f"Skipping {item.id}, already COGified.")
+                if journal is not None:
+                    journal.set_item(item.id, "started")
+                future = pool.submit(_cogify_item_worker, item.to_dict(),
+                                     item.get_self_href())
+                pending.append((item, future, projs))
+                if len(pending) >= max_pending:
+                    _save_cogified_item(*pending.popleft(), journal, layout,
+                                        metrics)
+
+        while pending:
+            _save_cogified_item(*pending.popleft(), journal, layout, metrics)
+    finally:
+        items.close()
+        # Items still pending when the run stops are abandoned
+        for _, future, _ in pending:
+            future.cancel()
+        if pool is not None:
+            pool.shutdown()
+        item_source.close()
+        uploader.close()
+        if journal is not None:
+            journal.close()
+    metrics.print_summary()
@@ -1,11 +1,17 @@
 import logging
+import os
 
 import click
 import pystac
 
 from stactools.nrcan_spot_ortho.stac import build_items
-from stactools.nrcan_spot_ortho.stac_templates import build_root_catalog
-from stactools.nrcan_spot_ortho.cog import cogify_catalog
+from stactools.nrcan_spot_ortho.stac_templates import (build_root_catalog,
+                                                       proj_epsg)
+from stactools.nrcan_spot_ortho.cog import cog_engines, cogify_catalog
+from stactools.nrcan_spot_ortho.geobase_ftp import get_listing
+from stactools.nrcan_spot_ortho.metrics import Metrics, set_metrics
+from stactools.nrcan_spot_ortho.utils import (CustomStacIO, WriteManifest,
+                                              batch_writes, path_exists)
 
 logger = logging.getLogger(__name__)
 
@@ -34,17 +40,115 @@ def create_spot_command(cli):
                   ],
                                     case_sensitive=False),
                   default=pystac.CatalogType.ABSOLUTE_PUBLISHED)
-    def convert_command(index, root_href, catalog_type):
+    @click.option('-b',
+                  '--bulk-listing',
+                  is_flag=True,
+                  default=False,
+                  help="""List the whole Geobase FTP once instead of once per
+                  image.""")
+    @click.option('-l',
+                  '--listing-cache',
+                  default=None,
+                  help="""A JSON file to keep the bulk Geobase FTP listing in,
+                  reused by later runs. Implies --bulk-listing.""")
+    @click.option('--listing-ttl',
+                  type=float,
+                  default=24,
+                  help="Hours before the cached FTP listing is refreshed.")
+    @click.option('-w',
+                  '--workers',
+                  type=click.IntRange(min=1),
+                  default=1,
+                  help="""Number of processes building items, each from its
+                  own shard of the index.""")
+    @click.option('--stream',
+                  is_flag=True,
+                  default=False,
+                  help="""Save each item as soon as it is built instead of
+                  holding the whole catalog in memory.""")
+    @click.option('-m',
+                  '--manifest',
+                  default=None,
+                  help="""A local JSON file of hashes of the STAC objects
+                  written, so later runs only rewrite objects that changed.""")
+    @click.option('-i',
+                  '--incremental',
+                  is_flag=True,
+                  default=False,
+                  help="""Update the catalog at root_href, only creating,
+                  updating or deleting the items whose index features or FTP
+                  files changed. Requires --manifest.""")
+    @click.option('--write-concurrency',
+                  type=click.IntRange(min=1),
+                  default=16,
+                  help="Number of STAC objects written to S3 at once.")
+    @click.option(
+        '--source',
+        default="ftp",
+        help="""Where to list each image's files from without a bulk listing:
+                  "ftp" (the default), "http", or the directory of a local
+                  mirror of the Geobase FTP.""")
+    @click.option('--metrics',
+                  'metrics_path',
+                  default=None,
+                  help="""A local JSON lines file to append the timing of each
+                  step of the run to.""")
+    def convert_command(index, root_href, catalog_type, bulk_listing,
+                        listing_cache, listing_ttl, workers, stream, manifest,
+                        incremental, write_concurrency, source, metrics_path):
         """Converts the SPOT Index shapefile to a STAC Catalog.
         """
-        # Create a catalog root and collections for each sensor
-        spot_catalog = build_root_catalog()
-        spot_catalog.normalize_hrefs(root_href)
+        if incremental and not manifest:
+            raise click.UsageError("--incremental requires --manifest")
+
+        # Read the existing catalog, or create a catalog root and collections
+        # for each sensor
+        catalog_path = os.path.join(root_href, "catalog.json")
+        if incremental and path_exists(catalog_path):
+            spot_catalog = pystac.read_file(catalog_path)
+        else:
+            incremental = False
+            spot_catalog = build_root_catalog()
+            spot_catalog.normalize_hrefs(root_href)
 
-        # Populate the catalog with items
+        # List the Geobase FTP up front if requested
         test = 'spot_index_test.shp' in index
-        build_items(index, spot_catalog, test, root_href, catalog_type)
-        spot_catalog.normalize_and_save(root_href, catalog_type)
+        listing = None
+        if (bulk_listing or listing_cache) and not test:
+            listing = get_listing(listing_cache, listing_ttl * 60 * 60)
+
+        # Skip writing objects that are unchanged since the last run
+        write_manifest = WriteManifest(manifest) if manifest else None
+        CustomStacIO.manifest = write_manifest
+
+        # Record the index reprojection, FTP listing, item building and
+        # writing steps, including those of the pool workers
+        metrics = Metrics(metrics_path)
+        set_metrics(metrics)
+
+        # Populate the catalog with items, saving them
+        try:
+            with batch_writes(write_concurrency):
+                build_items(index,
+                            spot_catalog,
+                            test,
+                            root_href,
+                            catalog_type,
+                            listing,
+                            workers=workers,
+                            stream=stream,
+                            manifest=write_manifest,
+                            incremental=incremental,
+                            source=source)
+        finally:
+            CustomStacIO.manifest = None
+            if write_manifest is not None:
+                write_manifest.save()
+                print(f"Wrote {write_manifest.written} STAC objects, "
+                      f"{write_manifest.unchanged} were unchanged")
+            metrics.close()
+
+        metrics.print_summary()
 
         print("Finished!")
 
@@ -63,10 +167,174 @@ def create_spot_command(cli):
                   is_flag=True,
                   default=False,
                   help="Overwrite existing COGs.")
-    def cogify_command(catalog_path, cog_directory, overwrite):
+    @click.option('-w',
+                  '--workers',
+                  type=click.IntRange(min=1),
+                  default=1,
+                  help="Number of items to COGify in parallel processes.")
+    @click.option('--fetch-workers',
+                  type=click.IntRange(min=1),
+                  default=1,
+                  help="Number of threads downloading zipped imagery.")
+    @click.option('--extract-workers',
+                  type=click.IntRange(min=1),
+                  default=1,
+                  help="Number of threads unzipping imagery.")
+    @click.option('--translate-workers',
+                  type=click.IntRange(min=1),
+                  default=1,
+                  help="Number of threads converting imagery to COG.")
+    @click.option('--publish-workers',
+                  type=click.IntRange(min=1),
+                  default=1,
+                  help="Number of threads uploading COGs.")
+    @click.option('--queue-size',
+                  type=click.IntRange(min=1),
+                  default=1,
+                  help="Maximum number of files waiting between two steps.")
+    @click.option(
+        '--ftp-connections',
+        type=click.IntRange(min=1),
+        default=4,
+        help="Maximum number of Geobase FTP connections per process.")
+    @click.option(
+        '--stream-zips/--extract-zips',
+        default=True,
+        help="""Read GeoTIFFs straight out of the downloaded zip files
+                  (the default), or extract them to disk first.""")
+    @click.option('--cog-engine',
+                  type=click.Choice(cog_engines),
+                  default="rasterio",
+                  help="""Write COGs within this process with rasterio, or by
+                  running gdal_translate.""")
+    @click.option('--compress',
+                  type=click.Choice(["deflate", "zstd", "lzw"],
+                                    case_sensitive=False),
+                  default="deflate",
+                  help="COG compression.")
+    @click.option('--predictor',
+                  type=click.Choice(
+                      ["YES", "NO", "STANDARD", "FLOATING_POINT"],
+                      case_sensitive=False),
+                  default=None,
+                  help="COG compression predictor.")
+    @click.option('--blocksize',
+                  type=click.IntRange(min=1),
+                  default=None,
+                  help="COG tile size in pixels.")
+    @click.option('--overview-resampling',
+                  type=click.Choice([
+                      "NEAREST", "AVERAGE", "BILINEAR", "CUBIC", "CUBICSPLINE",
+                      "LANCZOS", "MODE", "RMS"
+                  ],
+                                    case_sensitive=False),
+                  default=None,
+                  help="Resampling method for COG overviews.")
+    @click.option('--num-threads',
+                  default=None,
+                  help="""Number of threads GDAL uses per COG, or ALL_CPUS.""")
+    @click.option('-m',
+                  '--merge-bands',
+                  is_flag=True,
+                  default=False,
+                  help="""Write the four multispectral bands of an image as one
+                  four-band COG.""")
+    @click.option('--upload-chunk-size',
+                  type=click.IntRange(min=5),
+                  default=64,
+                  help="Size in MB of the parts of multipart S3 uploads.")
+    @click.option('--upload-concurrency',
+                  type=click.IntRange(min=1),
+                  default=10,
+                  help="Number of parts of a file uploaded to S3 at once.")
+    @click.option(
+        '-s',
+        '--snapshot-dir',
+        default=None,
+        help="""A local directory to keep the listing of existing COGs
+                  in, so later runs don't list the COG directory again.""")
+    @click.option('--refresh-snapshots',
+                  is_flag=True,
+                  default=False,
+                  help="List the COG directory even if there is a snapshot.")
+    @click.option(
+        '-j',
+        '--journal',
+        default=None,
+        help="""A local SQLite file to record the run's progress in. A run
+                  restarted with the same journal skips finished items.""")
+    @click.option('--prefetch',
+                  type=click.IntRange(min=1),
+                  default=32,
+                  help="Number of item files read ahead of the COG workers.")
+    @click.option('--metrics',
+                  'metrics_path',
+                  default=None,
+                  help="""A local JSON lines file to append the timing, size
+                  and queue depth of each step of the run to.""")
+    @click.option(
+        '--source',
+        default="ftp",
+        help="""Where to read zipped imagery and thumbnails from: "ftp" (the
+                  default), "http", or the directory of a local mirror of the
+                  Geobase FTP, whose zip files are read in place.""")
+    @click.option(
+        '--download-cache',
+        default=None,
+        help="""A local directory to keep downloaded zip files in, so later
+                  runs don't download them again.""")
+    @click.option('--download-cache-size',
+                  type=click.IntRange(min=1),
+                  default=50,
+                  help="Size in GB the download cache is kept under.")
+    @click.option(
+        '-p',
+        '--cog-proj',
+        'cog_projs',
+        type=click.Choice(["utm"] + sorted(proj_epsg), case_sensitive=False),
+        multiple=True,
+        default=["lcc00"],
+        help="""Projection of the imagery to COGify, lcc00 by default.
+                  Repeat to COGify several projections in one pass. "utm" is
+                  the local UTM zone of each image.""")
+    def cogify_command(catalog_path, cog_directory, overwrite, workers,
+                       fetch_workers, extract_workers, translate_workers,
+                       publish_workers, queue_size, ftp_connections,
+                       stream_zips, cog_engine, compress, predictor, blocksize,
+                       overview_resampling, num_threads, merge_bands,
+                       upload_chunk_size, upload_concurrency, snapshot_dir,
+                       refresh_snapshots, journal, prefetch, metrics_path,
+                       source, download_cache, download_cache_size, cog_projs):
         """Convert geotiff assets into cloud optimized geotiffs.
         """
-        cogify_catalog(catalog_path, cog_directory, overwrite)
+        stage_workers = {
+            "fetch": fetch_workers,
+            "extract": extract_workers,
+            "translate": translate_workers,
+            "publish": publish_workers
+        }
+        cog_options = {
+            "compress": compress,
+            "predictor": predictor,
+            "blocksize": blocksize,
+            "overview_resampling": overview_resampling,
+            "num_threads": num_threads
+        }
+        upload_options = {
+            "chunk_size": upload_chunk_size * 1024 * 1024,
+            "max_concurrency": upload_concurrency,
+            "max_pending": publish_workers
+        }
+        metrics = Metrics(metrics_path)
+        try:
+            cogify_catalog(catalog_path, cog_directory, overwrite, workers,
+                           stage_workers, queue_size, ftp_connections,
+                           stream_zips, cog_options, cog_engine, merge_bands,
+                           upload_options, snapshot_dir, refresh_snapshots,
+                           journal, prefetch, metrics, source, download_cache,
+                           download_cache_size * 1024**3, list(cog_projs))
+        finally:
+            metrics.close()
 
         print("Finished!")
 
@@ -0,0 +1,53 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from stactools.nrcan_spot_ortho.utils import CustomStacIO
+
+
+def crawl_items(catalog, prefetch=32):
+    """Yield the items of a catalog and its descendants, in the same order as
+    catalog.walk(), reading item files concurrently ahead of the caller.
+
+    The catalogs are read first, one at a time, to find every item link. The
+    files of the next prefetch items are then kept being read in a thread pool
+    while the caller works on the current item, so that the caller only waits
+    for a read when it gets ahead of the pool.
+
+    Args:
+        catalog (pystac.Catalog): The root catalog, read with CustomStacIO.
+        prefetch (int): Number of item files read ahead of the caller, and so
+            the number of threads reading them.
+
+    Yields:
+        pystac.Item: Each item, resolved within the catalog as walk() does.
+    """
+    links = []
+    catalogs = deque([catalog])
+    while catalogs:
+        parent = catalogs.popleft()
+        links += [(parent, link) for link in parent.get_item_links()]
+        # Depth first, as walk() does
+        catalogs.extendleft(reversed(list(parent.get_children())))
+
+    reader = CustomStacIO()
+    window = deque()
+    with ThreadPoolExecutor(max_workers=prefetch) as pool:
+        try:
+            for i, (parent, link) in enumerate(links):
+                # Keep the next prefetch item files being read
+                while len(window) < prefetch and i + len(window) < len(links):
+                    _, ahead = links[i + len(window)]
+                    href = ahead.get_absolute_href()
+                    if not ahead.is_resolved():
+                        CustomStacIO.prefetched[href] = pool.submit(
+                            reader.read_text_now, href)
+                    window.append(href)
+
+                # Resolves through CustomStacIO.read_text, which takes the
+                # prefetched text
+                link.resolve_stac_object(root=parent.get_root())
+                window.popleft()
+                yield link.target
+        finally:
+            for href in window:
+                CustomStacIO.prefetched.pop(href, None)
@@ -1,5 +1,10 @@
-from ftplib import FTP
-from time import sleep
+from contextlib import contextmanager
+from ftplib import FTP, all_errors, error_perm
+import json
+import os
+import posixpath
+from threading import BoundedSemaphore, Lock
+from time import sleep, time
 
 
 class GeobaseSpotFTP:
@@ -7,37 +12,214 @@ class GeobaseSpotFTP:
     Get a listing of files from Geobase FTP
     geobase = GeobaseSpotFTP()
     files = geobase.list_contents('s5_14121_6904_20080820')
+
+    The GEOBASE_FTP_HOST and GEOBASE_FTP_PORT environment variables connect to
+    another server, such as a local stand-in, while hrefs keep naming the
+    Geobase FTP.
     """
-    def __init__(self):
+    def __init__(self, connect=True):
         self.spot_location = "/pub/nrcan_rncan/image/spot/geobase_orthoimages"
         self.ftp_site = "ftp.geogratis.gc.ca"
+        self.host = os.environ.get("GEOBASE_FTP_HOST", self.ftp_site)
+        self.port = int(os.environ.get("GEOBASE_FTP_PORT", 21))
+        if connect:
+            self.connect()
 
-        num_retries = 10
+    def connect(self, num_retries=10, max_wait=60):
+        """
+        Connect and log in to the FTP, retrying with exponential backoff
+        """
         for i in range(num_retries):
             print(f"Connecting to Geobase FTP, attempt {i+1}/{num_retries}")
             try:
-                self.ftp = FTP(self.ftp_site, timeout=30)
+                self.ftp = FTP(timeout=30)
+                self.ftp.connect(self.host, self.port)
                 self.ftp.login()
                 err = False
                 break
             except Exception:
                 err = True
-                sleep(10)
+                sleep(min(2**i, max_wait))
         if err:
             raise Exception("Couldn't connect to Geobase FTP")
+        self.last_used = time()
+
+    def is_alive(self):
+        """
+        Check whether the FTP session is still usable
+        """
+        try:
+            self.ftp.voidcmd("NOOP")
+            return True
+        except all_errors:
+            return False
+
+    def close(self):
+        """
+        Close the FTP session, ignoring errors from sessions that have dropped
+        """
+        try:
+            self.ftp.quit()
+        except all_errors:
+            self.ftp.close()
+
+    def href(self, path):
+        """
+        Get the href of an absolute path on the FTP
+        """
+        return f"{self.ftp_site}{path}"
 
     def list_contents(self, spot_id=""):
         """
         Get a listing of the children in a given path
         returns a list of absolute file paths
         """
-        files = []
-        for f in self.ftp.nlst(f"{self.spot_location}{spot_id.lower()}"):
-            files.append(f"{self.ftp_site}{self.ftp_site}/{f}")
-        return files
+        path = posixpath.join(self.spot_location, spot_id.lower())
+        return [
+            self.href(posixpath.join(path, f)) for f in self.ftp.nlst(path)
+        ]
+
+    def list_all(self):
+        """
+        Get a listing of the files of every SPOT image, in as few requests as
+        possible. A single recursive LIST is used where the server supports it,
+        otherwise each image directory is listed with MLSD.
+        returns a dict of lowercase SPOT ID to list of absolute file paths
+        """
+        listing = {}
+        lines = []
+        try:
+            self.ftp.retrlines(f"LIST -R {self.spot_location}", lines.append)
+        except error_perm:
+            lines = []
+
+        # Parse the recursive listing: a "<directory>:" line is followed by
+        # "ls -l" style lines for its contents
+        directory = None
+        for line in lines:
+            if line.endswith(":"):
+                directory = line[:-1]
+                if not directory.startswith("/"):
+                    directory = posixpath.join(self.spot_location, directory)
+            elif directory and line.startswith("-"):
+                spot_id = posixpath.basename(directory)
+                fname = line.split()[-1]
+                listing.setdefault(spot_id, []).append(
+                    self.href(posixpath.join(directory, fname)))
+
+        if not listing:
+            for spot_id, facts in self.ftp.mlsd(self.spot_location):
+                if facts.get("type") != "dir":
+                    continue
+                path = posixpath.join(self.spot_location, spot_id)
+                listing[spot_id] = [
+                    self.href(posixpath.join(path, fname))
+                    for fname, file_facts in self.ftp.mlsd(path)
+                    if file_facts.get("type") == "file"
+                ]
+
+        return {
+            spot_id.lower(): sorted(hrefs)
+            for spot_id, hrefs in listing.items()
+            if spot_id.lower().startswith(("s4_", "s5_"))
+        }
 
     def get_thumbnail(self, spot_id=""):
         """
         Get the thumbnail image associated with the SPOT data
         """
         return f"{self.ftp_site}{self.spot_location}/images/{spot_id.lower()}_tn.jpg"
+
+
+class GeobaseFTPPool:
+    """
+    A thread-safe pool of logged in Geobase FTP sessions, reused between
+    downloads instead of connecting and logging in for each file
+    pool = GeobaseFTPPool(max_connections=4)
+    with pool.connection() as geobase:
+        download_from_ftp(href, out_path, geobase)
+    """
+    def __init__(self, max_connections=4, max_idle=30):
+        """
+        max_connections: most sessions open at once, callers wait for a free one
+        max_idle: seconds a session can sit unused before it is checked with a
+        NOOP (and reconnected if stale) on its next use
+        """
+        self.max_connections = max_connections
+        self.max_idle = max_idle
+        self._slots = BoundedSemaphore(max_connections)
+        self._lock = Lock()
+        self._idle = []
+
+    @contextmanager
+    def connection(self):
+        """
+        Borrow a logged in GeobaseSpotFTP, returning it to the pool afterwards.
+        Sessions that raise an error are closed rather than reused.
+        """
+        with self._slots:
+            geobase = self._checkout()
+            try:
+                yield geobase
+            except Exception:
+                geobase.close()
+                raise
+            geobase.last_used = time()
+            with self._lock:
+                self._idle.append(geobase)
+
+    def _checkout(self):
+        with self._lock:
+            geobase = self._idle.pop() if self._idle else None
+
+        if geobase is None:
+            return GeobaseSpotFTP()
+        idle_time = time() - geobase.last_used
+        if idle_time > self.max_idle and not geobase.is_alive():
+            print("Reconnecting stale Geobase FTP session")
+            geobase.close()
+            geobase.connect()
+        return geobase
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        """
+        Close all idle sessions
+        """
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for geobase in idle:
+            geobase.close()
+
+
+def get_listing(cache_path=None, ttl=24 * 60 * 60):
+    """
+    Get the listing of every SPOT image's files on the Geobase FTP (see
+    GeobaseSpotFTP.list_all), reading it from the JSON file at cache_path when
+    that is less than ttl seconds old, and otherwise writing a fresh listing to
+    cache_path
+    """
+    if cache_path and os.path.exists(cache_path):
+        with open(cache_path, "r") as f:
+            cache = json.load(f)
+        if time() - cache["created"] < ttl:
+            print(f"Using Geobase FTP listing from {cache_path}")
+            return cache["listing"]
+
+    print("Listing Geobase FTP contents...")
+    geobase = GeobaseSpotFTP()
+    listing = geobase.list_all()
+    geobase.close()
+
+    if cache_path:
+        tmp_path = f"{cache_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"created": time(), "listing": listing}, f)
+        os.replace(tmp_path, cache_path)
+
+    return listing
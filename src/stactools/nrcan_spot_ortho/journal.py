@@ -0,0 +1,146 @@
+import os
+import sqlite3
+from threading import Lock
+from time import time
+
+
+class CogifyJournal:
+    """A local SQLite record of the progress of cogify-assets runs, used to skip
+    finished work when a run is restarted.
+
+    Items are "started", then "saved" or "failed". A saved item records the
+    projections it has COGs of, and the layout of its bands ("bands" for one
+    COG per band, "merged" for a single multi-band COG). The zip files of an
+    item are "downloaded", then "published" once all of their COGs in a layout
+    are. COGs are "translated", then "uploaded" once in the COG directory.
+    Every update is committed in its own transaction, so the journal is
+    consistent at whatever point a run stops.
+
+    journal = CogifyJournal("cogify.sqlite")
+    saved = journal.saved_projs("bands")
+    journal.set_item(item.id, "saved", projs=["lcc00"], layout="bands")
+
+    The journal can be passed to other processes, which open their own
+    connections to the same file.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._conn = None
+        self._pid = None
+        self._lock = Lock()
+        with self._connect() as conn:
+            conn.execute("""CREATE TABLE IF NOT EXISTS items (
+                id TEXT PRIMARY KEY,
+                state TEXT NOT NULL,
+                error TEXT,
+                updated REAL NOT NULL)""")
+            conn.execute("""CREATE TABLE IF NOT EXISTS assets (
+                item_id TEXT NOT NULL,
+                path TEXT NOT NULL,
+                source TEXT,
+                layout TEXT,
+                state TEXT NOT NULL,
+                updated REAL NOT NULL,
+                PRIMARY KEY (item_id, path))""")
+            conn.execute("""CREATE TABLE IF NOT EXISTS item_projs (
+                item_id TEXT NOT NULL,
+                proj TEXT NOT NULL,
+                layout TEXT NOT NULL,
+                updated REAL NOT NULL,
+                PRIMARY KEY (item_id, proj, layout))""")
+
+    def __getstate__(self):
+        return {"path": self.path}
+
+    def __setstate__(self, state):
+        self.path = state["path"]
+        self._conn = None
+        self._pid = None
+        self._lock = Lock()
+
+    def _connect(self):
+        # Connections can't be shared between processes
+        if self._pid != os.getpid():
+            self._conn = sqlite3.connect(self.path,
+                                         timeout=60,
+                                         check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._pid = os.getpid()
+        return self._conn
+
+    def _write(self, sql, args, many_sql=None, many_args=()):
+        # many_sql is run for each of many_args in the same transaction
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                conn.execute(sql, args)
+                if many_sql is not None:
+                    conn.executemany(many_sql, many_args)
+
+    def _read(self, sql, args):
+        with self._lock:
+            return self._connect().execute(sql, args).fetchall()
+
+    def set_item(self, item_id, state, error=None, projs=(), layout=None):
+        """Record the state of an item, and the error it failed with if any.
+        projs are the projections a saved item has COGs of in layout.
+        """
+        updated = time()
+        self._write(
+            "INSERT OR REPLACE INTO items (id, state, error, updated) "
+            "VALUES (?, ?, ?, ?)", (item_id, state, error, updated),
+            "INSERT OR REPLACE INTO item_projs (item_id, proj, layout, "
+            "updated) VALUES (?, ?, ?, ?)",
+            [(item_id, proj, layout, updated) for proj in projs])
+
+    def items(self, state):
+        """Get the set of IDs of the items in a state."""
+        rows = self._read("SELECT id FROM items WHERE state = ?", (state, ))
+        return set(row[0] for row in rows)
+
+    def saved_projs(self, layout):
+        """Get the projections that each item has been saved with COGs of in a
+        layout.
+
+        Returns:
+            dict: The ID of each item to the set of its projections.
+        """
+        rows = self._read(
+            "SELECT item_id, proj FROM item_projs WHERE layout = ?",
+            (layout, ))
+        projs = {}
+        for item_id, proj in rows:
+            projs.setdefault(item_id, set()).add(proj)
+        return projs
+
+    def set_asset(self, item_id, path, state, source=None, layout=None):
+        """Record the state of a zip file or COG of an item. source is the href
+        of the zip file a COG was made from, and layout the layout of the bands
+        it was COGified in.
+        """
+        self._write(
+            "INSERT OR REPLACE INTO assets "
+            "(item_id, path, source, layout, state, updated) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (item_id, path, source, layout, state, time()))
+
+    def published_cogs(self, item_id, zip_href, layout=None):
+        """Get the COGs made from a zip file of an item in a layout, or None if
+        they are not all published yet.
+        """
+        rows = self._read(
+            "SELECT state, layout FROM assets WHERE item_id = ? AND path = ?",
+            (item_id, zip_href))
+        if not rows or rows[0] != ("published", layout):
+            return None
+        rows = self._read(
+            "SELECT path FROM assets WHERE item_id = ? AND source = ? "
+            "AND layout IS ? AND state = 'uploaded' ORDER BY path",
+            (item_id, zip_href, layout))
+        return [row[0] for row in rows]
+
+    def close(self):
+        if self._conn is not None and self._pid == os.getpid():
+            self._conn.close()
+        self._conn = None
+        self._pid = None
@@ -0,0 +1,179 @@
+from contextlib import contextmanager
+import json
+import os
+from threading import Lock
+from time import perf_counter, time
+
+
+class Metrics:
+    """Timings, sizes and queue depths of the steps of a run, reported as
+    events.
+
+    An event is a dictionary. Timed events have the "stage" (e.g. "download",
+    "translate" or "upload") and "seconds" they took, and where known the
+    "path" and "bytes" of the file, its "mb_per_s" and any "error". A timed
+    event that covers several things, such as a batch of index features, has
+    their number as "items". Gauge events
+    have the "gauge" measured, such as the "queue" of a stage, and its "value".
+    Every event also has the "time" and "pid" it was recorded at.
+
+    Each event is appended to a JSON lines file, if one is given, and passed to
+    every hook, which is how other metrics backends are plugged in:
+
+    metrics = Metrics("metrics.jsonl")
+    metrics.add_hook(lambda event: statsd.timing(event["stage"], ...))
+    with metrics.timer("download", path=href) as event:
+        ...
+        event["bytes"] = os.path.getsize(out_path)
+    metrics.print_summary()
+
+    Args:
+        path (str): A local JSON lines file to append events to, or None.
+    """
+    def __init__(self, path=None):
+        self.path = path
+        self.hooks = []
+        # Totals of the timed events and maximum of the gauges, by stage
+        self.stages = {}
+        self.gauges = {}
+        self._lock = Lock()
+        self._file = open(path, "a") if path else None
+
+    def add_hook(self, hook):
+        """Call hook(event) for every event recorded from now on."""
+        self.hooks.append(hook)
+
+    def emit(self, event):
+        """Record an event, including one recorded by another process."""
+        event.setdefault("time", time())
+        event.setdefault("pid", os.getpid())
+        with self._lock:
+            if "gauge" in event:
+                key = (event["gauge"], event.get("stage"))
+                self.gauges[key] = max(self.gauges.get(key, 0), event["value"])
+            else:
+                totals = self.stages.setdefault(
+                    event["stage"], {
+                        "count": 0,
+                        "failed": 0,
+                        "seconds": 0.0,
+                        "bytes": 0,
+                        "items": 0
+                    })
+                totals["count"] += 1
+                totals["items"] += event.get("items", 1)
+                totals["failed"] += "error" in event
+                totals["seconds"] += event["seconds"]
+                totals["bytes"] += event.get("bytes", 0)
+            if self._file is not None:
+                self._file.write(json.dumps(event) + "\n")
+                self._file.flush()
+        for hook in self.hooks:
+            hook(event)
+
+    @contextmanager
+    def timer(self, stage, **fields):
+        """Time the body of a with statement as a step of stage.
+
+        Yields:
+            dict: The event, to which the body can add fields such as "bytes"
+            or "error". An exception raised by the body is also recorded as the
+            event's error.
+        """
+        event = {"stage": stage, **fields}
+        start = perf_counter()
+        try:
+            yield event
+        except Exception as e:
+            event["error"] = str(e)
+            raise
+        finally:
+            event["seconds"] = perf_counter() - start
+            if event.get("bytes") and event["seconds"] > 0:
+                event["mb_per_s"] = event["bytes"] / 1e6 / event["seconds"]
+            self.emit(event)
+
+    def gauge(self, name, value, stage=None):
+        """Record a measurement, such as the number of files waiting for a
+        stage.
+        """
+        event = {"gauge": name, "value": value}
+        if stage is not None:
+            event["stage"] = stage
+        self.emit(event)
+
+    def summary(self):
+        """Totals of the events recorded so far.
+
+        Returns:
+            dict: The "count", "failed", "seconds", "bytes", "items",
+            "mb_per_s" and "items_per_s" of each stage, where the rates are
+            those of a single worker of the stage, and its "max_queue" if its
+            queue was measured.
+        """
+        with self._lock:
+            summary = {
+                stage: dict(totals)
+                for stage, totals in self.stages.items()
+            }
+            gauges = dict(self.gauges)
+        for totals in summary.values():
+            if totals["seconds"] > 0:
+                totals["mb_per_s"] = totals["bytes"] / 1e6 / totals["seconds"]
+                totals["items_per_s"] = totals["items"] / totals["seconds"]
+            else:
+                totals["mb_per_s"] = totals["items_per_s"] = 0.0
+        for (name, stage), value in gauges.items():
+            if name == "queue":
+                summary.setdefault(stage, {})["max_queue"] = value
+        return summary
+
+    def print_summary(self):
+        """Print the totals of the timed stages, then the deepest queue of the
+        stages whose queues alone were measured, such as the pipeline stages
+        that aren't timed themselves.
+        """
+        summary = self.summary()
+        timed = {
+            stage: totals
+            for stage, totals in summary.items() if "count" in totals
+        }
+        queued = {
+            stage: totals["max_queue"]
+            for stage, totals in summary.items() if "count" not in totals
+        }
+        if timed:
+            print(f"\n{'stage':<12}{'count':>8}{'failed':>8}{'seconds':>10}"
+                  f"{'MB':>10}{'MB/s':>8}{'items/s':>9}{'queue':>7}")
+            for stage, totals in timed.items():
+                print(f"{stage:<12}{totals['count']:>8}{totals['failed']:>8}"
+                      f"{totals['seconds']:>10.1f}"
+                      f"{totals['bytes'] / 1e6:>10.1f}"
+                      f"{totals['mb_per_s']:>8.1f}"
+                      f"{totals['items_per_s']:>9.1f}"
+                      f"{totals.get('max_queue', ''):>7}")
+        if queued:
+            print(f"\n{'queue':<12}{'max waiting':>12}")
+            for stage, max_queue in queued.items():
+                print(f"{stage:<12}{max_queue:>12}")
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+# The Metrics of each process, see get_metrics
+_metrics = {}
+
+
+def get_metrics():
+    """Get the Metrics that the steps of this process record events in."""
+    if _metrics.get("pid") != os.getpid():
+        _metrics.update(pid=os.getpid(), metrics=Metrics())
+    return _metrics["metrics"]
+
+
+def set_metrics(metrics):
+    """Record the events of this process in metrics from now on."""
+    _metrics.update(pid=os.getpid(), metrics=metrics)
@@ -0,0 +1,98 @@
+from queue import Queue
+from threading import Lock, Thread
+
+# Marks the end of a stage's input
+_DONE = object()
+
+
+class Stage:
+    """A step of a pipeline, run by a fixed number of threads.
+
+    Args:
+        name (str): Name of the stage, used when reporting failures.
+        func (callable): Called once per input of the stage. Returns an iterable
+            of outputs, each of which becomes an input of the next stage. An
+            empty iterable drops the input.
+        workers (int): Number of threads calling func concurrently.
+    """
+    def __init__(self, name, func, workers=1):
+        self.name = name
+        self.func = func
+        self.workers = workers
+
+
+def run_pipeline(inputs, stages, queue_size=1, metrics=None):
+    """Pass inputs through a series of stages, with every stage running at the
+    same time as the others.
+
+    Stages are connected by queues that hold at most queue_size values, so a
+    stage that gets ahead of the next one blocks until there is room. This
+    bounds the number of values (e.g. temporary files) in flight at once.
+
+    Args:
+        inputs (iterable): The inputs of the first stage.
+        stages (list): The pipeline's Stage objects, in order.
+        queue_size (int): Maximum number of values waiting between two stages.
+        metrics (Metrics): Where to record the number of values waiting for
+            each stage whenever one of its workers takes a value, if anywhere.
+
+    Returns:
+        tuple: The outputs of the last stage in the order they were produced, and
+        a list of (stage name, input, exception) for every input a stage failed
+        on. Failed inputs are not passed on to later stages.
+    """
+    queues = [Queue(maxsize=queue_size) for _ in stages]
+    outputs = []
+    failures = []
+    lock = Lock()
+    # Running workers per stage. The last worker of a stage to finish tells the
+    # workers of the next stage that no more input is coming.
+    remaining = [stage.workers for stage in stages]
+
+    def feed():
+        for value in inputs:
+            queues[0].put(value)
+        for _ in range(stages[0].workers):
+            queues[0].put(_DONE)
+
+    def work(i):
+        stage = stages[i]
+        last = i == len(stages) - 1
+        while True:
+            value = queues[i].get()
+            if value is _DONE:
+                break
+            if metrics is not None:
+                metrics.gauge("queue", queues[i].qsize(), stage.name)
+            try:
+                results = list(stage.func(value))
+            except Exception as e:
+                with lock:
+                    failures.append((stage.name, value, e))
+                continue
+            for result in results:
+                if last:
+                    with lock:
+                        outputs.append(result)
+                else:
+                    queues[i + 1].put(result)
+
+        with lock:
+            remaining[i] -= 1
+            finished = remaining[i] == 0
+        if finished and not last:
+            for _ in range(stages[i + 1].workers):
+                queues[i + 1].put(_DONE)
+
+    threads = [Thread(target=feed, daemon=True)]
+    for i, stage in enumerate(stages):
+        threads += [
+            Thread(target=work, args=(i, ), daemon=True)
+            for _ in range(stage.workers)
+        ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return outputs, failures
@@ -0,0 +1,282 @@
+from abc import ABC, abstractmethod
+import os
+import posixpath
+import re
+import shutil
+from urllib.parse import urlparse
+
+import urllib3
+
+from stactools.nrcan_spot_ortho.geobase_ftp import (GeobaseFTPPool,
+                                                    GeobaseSpotFTP)
+from stactools.nrcan_spot_ortho.metrics import get_metrics
+from stactools.nrcan_spot_ortho.utils import download_from_ftp
+
+
+def href_path(href):
+    """Get the path of a Geobase href, such as /pub/nrcan_rncan/..., whether
+    the href has a scheme (http://ftp.geogratis.gc.ca/...) or not
+    (ftp.geogratis.gc.ca/...).
+    """
+    if "://" not in href:
+        href = f"//{href}"
+    return urlparse(href).path
+
+
+def local_href_path(href):
+    """Get the path of the href of a local file, which is an absolute path or
+    a file:// URL, or None if the href isn't local.
+    """
+    parsed = urlparse(href)
+    if parsed.scheme == "file" or (not parsed.scheme and href.startswith("/")):
+        return parsed.path
+    return None
+
+
+class Source(ABC):
+    """Where the zipped imagery and thumbnails of items are read from.
+
+    Every source reads the hrefs of local files, which are absolute paths or
+    file:// URLs, in place. Other hrefs are read as the source sees fit.
+    """
+    def local_path(self, href):
+        """Get the local path of the file at href if it exists and can be read
+        in place, otherwise None.
+        """
+        local_path = local_href_path(href)
+        if local_path is not None and os.path.exists(local_path):
+            return local_path
+        return None
+
+    @abstractmethod
+    def fetch(self, href, out_path):
+        """Copy the file at href to the local out_path.
+
+        Returns:
+            bool: Whether the file was found.
+        """
+
+    @abstractmethod
+    def list_contents(self, spot_id):
+        """List the hrefs of the files of a SPOT image."""
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class FTPSource(Source):
+    """Reads files from the Geobase FTP, over a pool of sessions.
+
+    Args:
+        max_connections (int): Maximum number of FTP sessions open at once.
+        cache (DownloadCache): A cache of downloaded files to use, if any.
+    """
+    def __init__(self, max_connections=4, cache=None):
+        self.pool = GeobaseFTPPool(max_connections)
+        self.cache = cache
+
+    def fetch(self, href, out_path):
+        local_path = local_href_path(href)
+        if local_path is not None:
+            return _copy(local_path, out_path, href)
+        with self.pool.connection() as geobase:
+            return download_from_ftp(href, out_path, geobase, self.cache)
+
+    def list_contents(self, spot_id):
+        with self.pool.connection() as geobase:
+            return geobase.list_contents(spot_id)
+
+    def close(self):
+        self.pool.close()
+
+
+class HTTPSource(Source):
+    """Reads files from the HTTP server of the Geobase FTP, over a pool of
+    keep-alive connections. A download that drops is resumed from where it
+    stopped with a range request.
+
+    Args:
+        max_connections (int): Maximum number of connections open at once.
+        num_retries (int): Number of times a request is retried, and a dropped
+            download resumed.
+        chunk_size (int): Size in bytes of the parts of a file written at once.
+        cache (DownloadCache): A cache of downloaded files to use, if any.
+    """
+    def __init__(self,
+                 max_connections=4,
+                 num_retries=5,
+                 chunk_size=1024 * 1024,
+                 cache=None):
+        self.num_retries = num_retries
+        self.chunk_size = chunk_size
+        self.cache = cache
+        self.http = urllib3.PoolManager(
+            maxsize=max_connections,
+            block=True,
+            timeout=urllib3.Timeout(connect=30, read=60),
+            retries=urllib3.Retry(total=num_retries,
+                                  backoff_factor=1,
+                                  status_forcelist=[429, 500, 502, 503, 504]))
+
+    def url(self, href):
+        return href if "://" in href else f"http://{href}"
+
+    def fetch(self, href, out_path):
+        local_path = local_href_path(href)
+        if local_path is not None:
+            return _copy(local_path, out_path, href)
+
+        url = self.url(href)
+        key = self._cache_key(href, url)
+        if key is not None:
+            with get_metrics().timer("cache", path=href) as event:
+                event["hit"] = self.cache.get(key, out_path)
+            if event["hit"]:
+                print(f"Using cached {os.path.basename(url)}")
+                return True
+
+        print(f"Downloading {os.path.basename(url)}")
+        found = self._download(href, url, out_path)
+        if found and key is not None:
+            self.cache.put(key, out_path)
+        return found
+
+    def _cache_key(self, href, url):
+        if self.cache is None:
+            return None
+        response = self.http.request("HEAD", url)
+        size = response.headers.get("Content-Length")
+        version = response.headers.get("Last-Modified",
+                                       response.headers.get("ETag"))
+        if response.status >= 400 or size is None or version is None:
+            return None
+        return self.cache.key(href_path(href), size, version)
+
+    def _download(self, href, url, out_path):
+        with get_metrics().timer("download", path=href) as event, \
+                open(out_path, "wb") as f:
+            for attempt in range(self.num_retries + 1):
+                headers = {"Range": f"bytes={f.tell()}-"} if f.tell() else {}
+                try:
+                    response = self.http.request("GET",
+                                                 url,
+                                                 headers=headers,
+                                                 preload_content=False)
+                    try:
+                        if response.status == 404:
+                            print(f"Failed to find {url}")
+                            event["error"] = "not found"
+                            return False
+                        if response.status >= 400:
+                            raise Exception(
+                                f"HTTP {response.status} from {url}")
+                        if headers and response.status != 206:
+                            # The server sent the whole file
+                            f.seek(0)
+                            f.truncate()
+                        for chunk in response.stream(self.chunk_size):
+                            f.write(chunk)
+                    finally:
+                        response.release_conn()
+                    event["bytes"] = f.tell()
+                    return True
+                except (urllib3.exceptions.ProtocolError,
+                        urllib3.exceptions.ReadTimeoutError) as e:
+                    if attempt == self.num_retries:
+                        raise
+                    print(f"Resuming {os.path.basename(url)} after: {e}")
+
+    def list_contents(self, spot_id):
+        # The server gives an HTML index of each directory
+        geobase = GeobaseSpotFTP(connect=False)
+        path = posixpath.join(geobase.spot_location, spot_id.lower())
+        response = self.http.request("GET", self.url(geobase.href(path + "/")))
+        if response.status == 404:
+            return []
+        if response.status >= 400:
+            raise Exception(f"HTTP {response.status} listing {spot_id}")
+        names = set(
+            re.findall(r'href="([^"/?]+)"', response.data.decode("utf-8")))
+        return [
+            geobase.href(posixpath.join(path, name)) for name in sorted(names)
+        ]
+
+    def close(self):
+        self.http.clear()
+
+
+class MirrorSource(Source):
+    """Reads files from a local copy of the Geobase FTP, such as an NFS mount,
+    laid out as on the FTP. Zip files are read in place rather than copied.
+
+    Args:
+        root (str): The local directory that mirrors the root of the FTP.
+    """
+    def __init__(self, root):
+        self.root = root
+
+    def local_path(self, href):
+        local_path = local_href_path(href)
+        if local_path is None:
+            local_path = os.path.join(self.root, href_path(href).lstrip("/"))
+        return local_path if os.path.exists(local_path) else None
+
+    def fetch(self, href, out_path):
+        local_path = self.local_path(href)
+        if local_path is None:
+            print(f"Failed to find {href} in {self.root}")
+            return False
+        return _copy(local_path, out_path, href)
+
+    def list_contents(self, spot_id):
+        geobase = GeobaseSpotFTP(connect=False)
+        path = posixpath.join(geobase.spot_location, spot_id.lower())
+        directory = os.path.join(self.root, path.lstrip("/"))
+        if not os.path.isdir(directory):
+            return []
+        return [
+            geobase.href(posixpath.join(path, name))
+            for name in sorted(os.listdir(directory))
+        ]
+
+
+def _copy(local_path, out_path, href):
+    if not os.path.exists(local_path):
+        print(f"Failed to find {local_path}")
+        return False
+    with get_metrics().timer("download", path=href) as event:
+        shutil.copyfile(local_path, out_path)
+        event["bytes"] = os.path.getsize(out_path)
+    return True
+
+
+def open_source(source="ftp", max_connections=4, cache=None):
+    """Open a Source by name.
+
+    Args:
+        source (str): "ftp" for the Geobase FTP, "http" for its HTTP server, or
+            the directory or file:// URL of a local mirror of it.
+        max_connections (int): Maximum number of connections the FTP or HTTP
+            source opens at once.
+        cache (DownloadCache): A cache of the files the FTP or HTTP source
+            downloads, if any. A mirror is read without one.
+
+    Returns:
+        Source: The source, which is closed with close().
+    """
+    if source == "ftp":
+        return FTPSource(max_connections, cache)
+    if source in ("http", "https"):
+        return HTTPSource(max_connections, cache=cache)
+    parsed = urlparse(source)
+    root = parsed.path if parsed.scheme == "file" else source
+    if os.path.isdir(root):
+        return MirrorSource(root)
+    raise Exception(
+        f"Unknown source {source}, expected ftp, http or a mirror directory")
@@ -1,4 +1,9 @@
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
+import hashlib
+from itertools import islice
+import math
 import os
 import fiona
 import json
@@ -15,18 +20,23 @@ from pystac.extensions.projection import ProjectionExtension
 from shapely.geometry import box
 from shapely.ops import transform as shapely_transform
 from stactools.nrcan_spot_ortho.geobase_ftp import GeobaseSpotFTP
-from stactools.nrcan_spot_ortho.utils import (bbox, transform_geom,
-                                              CustomStacIO)
+from stactools.nrcan_spot_ortho.metrics import (Metrics, get_metrics,
+                                                set_metrics)
+from stactools.nrcan_spot_ortho.sources import open_source
+from stactools.nrcan_spot_ortho.utils import (bbox, transform_geoms,
+                                              CustomStacIO, delete_file)
 from stactools.nrcan_spot_ortho.stac_templates import (spot_sensor, proj_epsg)
+from stactools.nrcan_spot_ortho.writer import ItemWriter
 
 StacIO.set_default(CustomStacIO)
 null = None
 
 
-def create_year_catalog(sensor, year, ortho_collection):
+def create_year_catalog(sensor, year, ortho_collection, year_catalogs=None):
     """
     sensor: "S4" or "S5"
     year: image acquisition year
+    year_catalogs: a dict of year catalogs by ID to add the new catalog to
     """
     spot_catalog = Catalog(
         id=f"{sensor}_{year}",
@@ -34,16 +44,19 @@ def create_year_catalog(sensor, year, ortho_collection):
         title=f"{sensor}_{year}",
         stac_extensions=None)
     ortho_collection.add_child(spot_catalog)
+    if year_catalogs is not None:
+        year_catalogs[spot_catalog.id] = spot_catalog
     return spot_catalog
 
 
-def create_item(name, feature, collection):
+def create_item(name, feature, collection, item_bbox=None):
     """Create a STAC item for SPOT
 
     Args:
         name (str): SPOT ID.
         feature (dict): geojson feature.
         collection (pystac.Collection): pySTAC collection object.
+        item_bbox (list): The feature's bbox, if already known.
 
     Returns:
         item (pystac.Item): The created STAC item for the given feature.
@@ -51,7 +64,7 @@ def create_item(name, feature, collection):
     item = Item(
         id=name,
         geometry=feature["geometry"],
-        bbox=list(bbox(feature)),
+        bbox=list(item_bbox if item_bbox is not None else bbox(feature)),
         properties={},
         datetime=datetime.strptime(name[14:22], "%Y%m%d"),
         collection=collection,
@@ -66,7 +79,218 @@ def create_item(name, feature, collection):
     return item
 
 
-def build_items(index_geom, spot_catalog, test, root_href, catalog_type):
+def _transform_features(features, transformer, batch_size):
+    """Reproject features in batches, yielding each feature with its
+    transformed coordinates and bbox.
+    """
+    features = iter(features)
+    while True:
+        batch = list(islice(features, batch_size))
+        if not batch:
+            break
+        with get_metrics().timer("transform", items=len(batch)):
+            new_coords, bboxes = transform_geoms(
+                transformer, [f["geometry"] for f in batch])
+        yield from zip(batch, new_coords, bboxes.tolist())
+
+
+def add_image_assets(item, fnames, href_tn):
+    """Add the Geobase zipped imagery and thumbnail of a SPOT image as assets.
+
+    Args:
+        item (pystac.Item): The SPOT image's item.
+        fnames (list): Geobase FTP hrefs of the image's zip files.
+        href_tn (str): Geobase FTP href of the image's thumbnail.
+    """
+    for fname in fnames:
+        # Include asset information for Geobase zipped imagery
+        # STAC parses hrefs starting with "ftp." as relative
+        title = fname[-13:-4]
+        # gsd = float(title.split("_")[0][1:])
+        contents = {"m": "Multi-band", "p": "Panchromatic"}.get(title[0])
+        spot_file = Asset(href=fname.replace("ftp.", "http://ftp."),
+                          title=title,
+                          media_type="application/zip",
+                          roles=['data'])
+
+        # Include projection information
+        proj_ext = ProjectionExtension.ext(spot_file)
+        proj = [p for p in proj_epsg.keys() if p in fname.lower()][0]
+        proj_ext.epsg = proj_epsg[proj]
+        spot_file.description = f"{contents} imagery in EPSG:{proj_epsg[proj]}"
+
+        item.add_asset(title, spot_file)
+
+    # Add the thumbnail asset
+    item.add_asset(
+        key="thumbnail",
+        asset=Asset(
+            href=href_tn.replace("ftp.", "http://ftp."),
+            title=None,
+            media_type=MediaType.JPEG,
+            roles=['thumbnail'],
+        ),
+    )
+
+
+def _index_transformer(src):
+    # Create a transformer for shapefile proj --> WGS84
+    src_crs = crs.CRS(src.crs)  # ['init']
+    dest_crs = crs.CRS("WGS84")
+    return Transformer.from_crs(src_crs, dest_crs)
+
+
+def _iter_items(index_geom,
+                start,
+                stop,
+                test,
+                listing,
+                batch_size,
+                source="ftp"):
+    """Create the items of the features of index_geom from start to stop, without
+    their collections or catalogs.
+    """
+    # Open the source the files of each image are listed from
+    if test:
+        hrefs_path = os.path.join(os.path.dirname(index_geom),
+                                  'spot_hrefs_test.json')
+        with open(hrefs_path, 'r') as f:
+            hrefs = json.load(f)
+    else:
+        geobase = GeobaseSpotFTP(connect=False)
+        image_source = open_source(source, 1) if listing is None else None
+
+    with fiona.open(index_geom) as src:
+        transformer = _index_transformer(src)
+        for f, new_coords, item_bbox in _transform_features(
+                src.filter(start, stop), transformer, batch_size):
+
+            # Get the WGS84 bbox for the item polygon
+            feature_out = f.copy()
+            feature_out["geometry"]["coordinates"] = new_coords
+            name = feature_out["properties"]["NAME"]
+
+            if test:
+                fnames = hrefs["hrefs"]
+            elif listing is not None:
+                fnames = listing.get(name.lower(), [])
+            else:
+                with get_metrics().timer("list", path=name):
+                    fnames = image_source.list_contents(name)
+            href_tn = geobase.get_thumbnail(name) if not test else hrefs["tn"]
+
+            with get_metrics().timer("build", path=name):
+                item = create_item(name, feature_out, None, item_bbox)
+                add_image_assets(item, fnames, href_tn)
+
+            yield item
+
+    if not test and listing is None:
+        image_source.close()
+
+
+# Arguments of _iter_items shared by every shard a pool worker builds, set once
+# by _init_shard_worker rather than pickled with each shard
+_shard_kwargs = {}
+# Metrics events of the shard a pool worker is building, which are sent back to
+# the parent process with its items
+_shard_events = []
+
+
+def _init_shard_worker(shard_kwargs):
+    _shard_kwargs.update(shard_kwargs)
+    metrics = Metrics()
+    metrics.add_hook(_shard_events.append)
+    set_metrics(metrics)
+
+
+def _build_shard(start, stop):
+    """Build the items of a range of features inside a pool worker.
+
+    Returns:
+        tuple: The items as dictionaries, and the metrics events of the shard.
+    """
+    _shard_events.clear()
+    item_dicts = [
+        item.to_dict(include_self_link=False)
+        for item in _iter_items(start=start, stop=stop, **_shard_kwargs)
+    ]
+    return item_dicts, list(_shard_events)
+
+
+def _iter_sharded_items(index_geom, num_features, workers, shard_kwargs):
+    """Build the items of index_geom in a process pool, yielding them in index
+    order.
+    """
+    # More shards than workers, so that a slow shard doesn't hold up the rest
+    shard_size = max(1, math.ceil(num_features / (workers * 4)))
+    shards = [(start, min(start + shard_size, num_features))
+              for start in range(0, num_features, shard_size)]
+
+    # Submitted shards, oldest first. Bounded so that finished shards don't
+    # pile up in memory while earlier ones are still being added.
+    pending = deque()
+    max_pending = workers * 2
+    metrics = get_metrics()
+
+    def shard_items(future):
+        item_dicts, events = future.result()
+        for event in events:
+            metrics.emit(event)
+        return (Item.from_dict(item_dict) for item_dict in item_dicts)
+
+    with ProcessPoolExecutor(max_workers=workers,
+                             initializer=_init_shard_worker,
+                             initargs=(shard_kwargs, )) as pool:
+        for shard in shards:
+            pending.append(pool.submit(_build_shard, *shard))
+            if len(pending) >= max_pending:
+                yield from shard_items(pending.popleft())
+        while pending:
+            yield from shard_items(pending.popleft())
+
+
+def _source_hash(item):
+    """Hash the parts of a new item that come from its index feature and Geobase
+    FTP files.
+    """
+    item_dict = item.to_dict(include_self_link=False)
+    item_dict.pop("links")
+    return hashlib.sha256(
+        json.dumps(item_dict, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def _item_links(spot_catalog):
+    """Find the links to the items of a catalog read from a file, without
+    reading the items.
+
+    Returns:
+        dict: Item ID to the catalog holding the item and the link to it.
+    """
+    item_links = {}
+    catalogs = [spot_catalog]
+    while catalogs:
+        catalog = catalogs.pop()
+        for link in catalog.get_item_links():
+            href = link.get_absolute_href()
+            name = os.path.splitext(os.path.basename(href))[0]
+            item_links[name] = (catalog, link)
+        catalogs.extend(catalog.get_children())
+    return item_links
+
+
+def build_items(index_geom,
+                spot_catalog,
+                test,
+                root_href,
+                catalog_type,
+                listing=None,
+                batch_size=1000,
+                workers=1,
+                stream=False,
+                manifest=None,
+                incremental=False,
+                source="ftp"):
     """Build the STAC items for orthorectified SPOT 4 and 5 over Canada.
 
     Args:
@@ -77,106 +301,140 @@ def build_items(index_geom, spot_catalog, test, root_href, catalog_type):
         template and doesn't require a connection to the Geobase FTP server.
         root_href (str): The root href and output location of the catalog.
         catalog_type (pystac.CatalogType): The type of catalog.
+        listing (dict): A listing of every SPOT image's files on the Geobase
+        FTP, see geobase_ftp.get_listing. If given, the Geobase FTP isn't listed
+        once per image.
+        batch_size (int): Number of features whose geometries are reprojected
+        together.
+        workers (int): Number of processes building items. With more than one,
+        the index is split into shards of features, each built by a worker, and
+        the items are then added to the catalog in index order.
+        stream (bool): Whether to save each item as soon as it is built, keeping
+        only links to the items in memory (see ItemWriter). Otherwise the whole
+        catalog is built in memory and saved at the end.
+        manifest (WriteManifest): Manifest to record a hash of each item's
+        source, its index feature and Geobase FTP files, in.
+        incremental (bool): Whether spot_catalog is an existing catalog read
+        from root_href to update, rather than a new one. Only the items whose
+        source hash differs from the one in manifest are created or updated,
+        and items no longer in the index are deleted. Assets added to an
+        updated item since it was created (e.g. COGs) are kept. Items are
+        streamed, as with stream.
+        source (str): Where to list the files of each image from without a
+        listing: "ftp", "http" or a local mirror directory, see
+        sources.open_source.
 
     Returns:
         spot_catalog (pystac.Catalog): A catalog that includes all items listed
         within the index_geom.
     """
     with fiona.open(index_geom) as src:
-        # Create a transformer for shapefile proj --> WGS84
-        src_crs = crs.CRS(src.crs)  # ['init']
-        dest_crs = crs.CRS("WGS84")
-        transformer = Transformer.from_crs(src_crs, dest_crs)
+        transformer = _index_transformer(src)
 
         # Transform the shapefile extent to WGS84 for the collection bbox
         extent = box(*src.bounds)
         collection_bbox = shapely_transform(transformer.transform, extent)
+        num_features = len(src)
 
-        # Set spatial extent for collections
-        for sensor in ["spot4", "spot5"]:
-            ortho_collection = spot_catalog.get_child(
-                "canada-spot-orthoimages").get_child(
-                    f"canada-{sensor}-orthoimages")
-            ortho_collection.extent.spatial = SpatialExtent(
-                [list(collection_bbox.bounds)])
-
-        # Open a Geobase FTP connection
-        if test:
-            hrefs_path = os.path.join(os.path.dirname(index_geom),
-                                      'spot_hrefs_test.json')
-            with open(hrefs_path, 'r') as f:
-                hrefs = json.load(f)
-        else:
-            geobase = GeobaseSpotFTP()
+    # Look up the collections and year catalogs once, rather than scanning
+    # their parents' links for every item
+    ortho_catalog = spot_catalog.get_child("canada-spot-orthoimages")
+    collections = {}
+    for sensor, sensor_full in spot_sensor.items():
+        sensor_id = sensor_full.lower().replace(" ", "")
+        collections[sensor] = ortho_catalog.get_child(
+            f"canada-{sensor_id}-orthoimages")
+    year_catalogs = {
+        child.id: child
+        for collection in collections.values()
+        for child in collection.get_children()
+    }
 
-        count = 0
-        for f in src:
+    # Set spatial extent for collections
+    for ortho_collection in collections.values():
+        ortho_collection.extent.spatial = SpatialExtent(
+            [list(collection_bbox.bounds)])
 
-            # Get the WGS84 bbox for the item polygon
-            feature_out = f.copy()
-            new_coords = transform_geom(transformer,
-                                        f["geometry"]["coordinates"])
-            feature_out["geometry"]["coordinates"] = new_coords
+    shard_kwargs = dict(index_geom=index_geom,
+                        test=test,
+                        listing=listing,
+                        batch_size=batch_size,
+                        source=source)
+    if workers > 1:
+        items = _iter_sharded_items(index_geom, num_features, workers,
+                                    shard_kwargs)
+    else:
+        items = _iter_items(start=0, stop=num_features, **shard_kwargs)
 
-            # Get the collection for the item's sensor
-            name = feature_out["properties"]["NAME"]
-            sensor = name[:2]
-            sensor_full = spot_sensor[sensor].lower().replace(" ", "")
-            year = name.split("_")[3][:4]
-            ortho_collection = spot_catalog.get_child(
-                "canada-spot-orthoimages").get_child(
-                    f"canada-{sensor_full}-orthoimages")
-
-            # Get/create the catalog for the item's year
-            if not ortho_collection.get_child(f"{sensor}_{year}"):
-                year_catalog = create_year_catalog(sensor, year,
-                                                   ortho_collection)
-            else:
-                year_catalog = ortho_collection.get_child(f"{sensor}_{year}")
+    writer = ItemWriter(spot_catalog, root_href,
+                        catalog_type) if stream or incremental else None
+
+    # Links to the existing items, by ID
+    existing = _item_links(spot_catalog) if incremental else {}
+    sources = manifest.sources if manifest is not None else {}
+
+    count = 0
+    unchanged = 0
+    for new_item in items:
+        name = new_item.id
+        source_hash = _source_hash(new_item)
+        old = existing.pop(name, None)
+        if old is not None:
+            if sources.get(name) == source_hash:
+                unchanged += 1
+                continue
+            # Replace the existing item, keeping the assets added to it
+            parent, link = old
+            parent.links.remove(link)
+            old_item = Item.from_file(link.get_absolute_href())
+            for key, asset in old_item.assets.items():
+                if key not in new_item.assets:
+                    new_item.add_asset(key, asset)
+        sources[name] = source_hash
+
+        # Get the collection for the item's sensor
+        sensor = name[:2]
+        year = name.split("_")[3][:4]
+        ortho_collection = collections[sensor]
 
-            # Create item and add to catalog
-            new_item = create_item(name, feature_out, ortho_collection)
+        # Get/create the catalog for the item's year
+        year_catalog = year_catalogs.get(f"{sensor}_{year}")
+        if year_catalog is None:
+            year_catalog = create_year_catalog(sensor, year, ortho_collection,
+                                               year_catalogs)
+
+        # Add item to catalog
+        new_item.set_collection(ortho_collection)
+        if writer is not None:
+            writer.add_item(new_item, year_catalog)
+        else:
             year_catalog.add_item(new_item)
 
-            fnames = geobase.list_contents(
-                name) if not test else hrefs["hrefs"]
-            for i, fname in enumerate(fnames):
-                # Include asset information for Geobase zipped imagery
-                # STAC parses hrefs starting with "ftp." as relative
-                title = fname[-13:-4]
-                # gsd = float(title.split("_")[0][1:])
-                contents = {
-                    "m": "Multi-band",
-                    "p": "Panchromatic"
-                }.get(title[0])
-                spot_file = Asset(href=fname.replace("ftp.", "http://ftp."),
-                                  title=title,
-                                  media_type="application/zip",
-                                  roles=['data'])
-
-                # Include projection information
-                proj_ext = ProjectionExtension.ext(spot_file)
-                proj = [p for p in proj_epsg.keys() if p in fname.lower()][0]
-                proj_ext.epsg = proj_epsg[proj]
-                spot_file.description = f"{contents} imagery in EPSG:{proj_epsg[proj]}"
-
-                new_item.add_asset(title, spot_file)
-
-            # Add the thumbnail asset
-            href_tn = geobase.get_thumbnail(name) if not test else hrefs["tn"]
-            new_item.add_asset(
-                key="thumbnail",
-                asset=Asset(
-                    href=href_tn.replace("ftp.", "http://ftp."),
-                    title=None,
-                    media_type=MediaType.JPEG,
-                    roles=['thumbnail'],
-                ),
-            )
-
-            count += 1
-            print(f"{count}... {new_item.id}")
+        count += 1
+        print(f"{count}... {new_item.id}")
+
+    # Delete the items that are no longer in the index, and the year catalogs
+    # left empty
+    deleted_hrefs = []
+    for name, (parent, link) in existing.items():
+        print(f"Deleting {name}")
+        parent.links.remove(link)
+        deleted_hrefs.append(link.get_absolute_href())
+        sources.pop(name, None)
+        if not parent.get_item_links() and not parent.get_child_links():
+            parent.get_parent().remove_child(parent.id)
+            deleted_hrefs.append(parent.get_self_href())
+    for href in deleted_hrefs:
+        delete_file(href)
+        if manifest is not None:
+            manifest.forget(href)
+    if incremental:
+        print(f"{count} items created or updated, {unchanged} unchanged, "
+              f"{len(existing)} deleted")
 
+    if writer is not None:
+        writer.finish()
+    else:
         spot_catalog.normalize_and_save(root_href, catalog_type)
 
     return spot_catalog
@@ -15,6 +15,9 @@ image_types = {
     "p10_1": "pan"
 }
 
+# Images whose bands can be merged into one COG
+stacked_image_types = {"m20": "multispectral"}
+
 proj_epsg = {f"utm{str(i).zfill(2)}": 26900 + i for i in range(1, 25)}
 proj_epsg["lcc00"] = 3979
 
@@ -159,9 +162,12 @@ proj_ext.epsg = list(proj_epsg.values())
 
 
 def build_root_catalog():
-    spot4_collection.add_link(geobase_license)
-    spot5_collection.add_link(geobase_license)
-    spot_catalog.add_child(spot45_catalog)
-    spot45_catalog.add_child(spot4_collection)
-    spot45_catalog.add_child(spot5_collection)
-    return spot_catalog
+    # Build from copies of the templates, so that each catalog starts empty
+    root_catalog = spot_catalog.clone()
+    ortho_catalog = spot45_catalog.clone()
+    root_catalog.add_child(ortho_catalog)
+    for collection in [spot4_collection, spot5_collection]:
+        collection = collection.clone()
+        collection.add_link(geobase_license.clone())
+        ortho_catalog.add_child(collection)
+    return root_catalog
@@ -1,45 +1,267 @@
-from ftplib import error_perm
+from concurrent.futures import ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from ftplib import all_errors, error_perm
+import hashlib
+import json
 import os
+from threading import BoundedSemaphore, Lock, get_ident
 from urllib.parse import urlparse
 from pystac import Link
 from pystac.stac_io import DefaultStacIO
 from typing import Union, Any
 import zipfile
 import logging
+import numpy as np
+from stactools.nrcan_spot_ortho.metrics import get_metrics
 from subprocess import Popen, PIPE, STDOUT
 import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
 # from botocore.errorfactory import ClientError
 import glob
+import shutil
+import rasterio
+from rasterio.dtypes import dtype_rev, typename_fwd
+from xml.etree import ElementTree
 
 logger = logging.getLogger(__name__)
 
 
+class WriteManifest:
+    """A local record of the content hash of the STAC object last written to
+    each href, used to skip writing objects that haven't changed since an
+    earlier run.
+
+    Objects whose files were changed or deleted by other means since they were
+    recorded aren't noticed, so the manifest should only be used with
+    catalogs it has seen every write of.
+
+    The manifest also keeps a hash of the source of each item, see
+    stac.build_items.
+
+    Args:
+        path (str): Local JSON file the manifest is kept in.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.hashes = {}
+        self.sources = {}
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                manifest = json.load(f)
+            self.hashes = manifest["objects"]
+            self.sources = manifest.get("sources", {})
+        self.written = 0
+        self.unchanged = 0
+        self._lock = Lock()
+
+    @staticmethod
+    def _hash(txt):
+        return hashlib.sha256(txt.encode("utf-8")).hexdigest()
+
+    def is_unchanged(self, href, txt):
+        """Check whether txt is what was last written to href."""
+        unchanged = self.hashes.get(href) == self._hash(txt)
+        if unchanged:
+            with self._lock:
+                self.unchanged += 1
+        return unchanged
+
+    def record(self, href, txt):
+        """Record that txt was written to href."""
+        with self._lock:
+            self.hashes[href] = self._hash(txt)
+            self.written += 1
+
+    def forget(self, href):
+        """Forget the object at a deleted href."""
+        with self._lock:
+            self.hashes.pop(href, None)
+
+    def save(self):
+        """Write the manifest to its file."""
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"objects": self.hashes, "sources": self.sources}, f)
+        os.replace(tmp_path, self.path)
+
+
+# Retry throttled and failed S3 requests, backing off and limiting the request
+# rate on the client side
+s3_retries = {"max_attempts": 10, "mode": "adaptive"}
+
+# Size of the connection pool of each process' S3 client, see get_s3_client
+s3_max_connections = 32
+
+# The S3 client of each process, see get_s3_client
+_s3_client = {}
+_s3_client_lock = Lock()
+
+
+def get_s3_client():
+    """Get the S3 client of this process, creating it on first use. The client
+    is thread-safe and keeps a pool of connections to reuse between requests.
+    """
+    with _s3_client_lock:
+        if _s3_client.get("pid") != os.getpid():
+            config = Config(max_pool_connections=s3_max_connections,
+                            retries=s3_retries)
+            _s3_client.update(pid=os.getpid(),
+                              client=boto3.client("s3", config=config))
+        return _s3_client["client"]
+
+
+class BoundedExecutor:
+    """A thread pool that runs at most max_pending tasks at once. Submitting
+    more blocks until a task finishes, so that a fast producer doesn't queue
+    up unbounded work.
+    """
+    def __init__(self, max_pending):
+        self._executor = ThreadPoolExecutor(max_workers=max_pending)
+        self._slots = BoundedSemaphore(max_pending)
+        self._lock = Lock()
+        self._pending = set()
+
+    def submit(self, fn, *args):
+        """Run fn(*args) in the background.
+
+        Returns:
+            concurrent.futures.Future: The task.
+        """
+        self._slots.acquire()
+        future = self._executor.submit(fn, *args)
+        with self._lock:
+            self._pending.add(future)
+        future.add_done_callback(self._done)
+        return future
+
+    def __len__(self):
+        """The number of unfinished tasks."""
+        with self._lock:
+            return len(self._pending)
+
+    def _done(self, future):
+        with self._lock:
+            self._pending.discard(future)
+        self._slots.release()
+
+    def wait(self):
+        """Wait for all unfinished tasks, raising the first of their errors."""
+        with self._lock:
+            pending = list(self._pending)
+        for future in wait(pending).done:
+            future.result()
+
+    def shutdown(self):
+        self._executor.shutdown()
+
+
+class S3WriteBatch:
+    """Writes text to S3 objects from a pool of threads, so that saving many
+    STAC objects isn't bound by the latency of each request.
+
+    Args:
+        max_pending (int): Number of objects written at once.
+    """
+    def __init__(self, max_pending=16):
+        self._tasks = BoundedExecutor(max_pending)
+
+    def submit(self, parsed, txt):
+        """Write txt to the parsed S3 URL in the background.
+
+        Returns:
+            concurrent.futures.Future: The write.
+        """
+        return self._tasks.submit(_put_text, parsed, txt)
+
+    def wait(self):
+        """Wait for all unfinished writes, raising the first of their errors."""
+        self._tasks.wait()
+
+    def close(self):
+        self.wait()
+        self._tasks.shutdown()
+
+
+def _put_text(parsed, txt):
+    body = txt.encode("utf-8")
+    with get_metrics().timer("write", path=parsed.geturl(), bytes=len(body)):
+        get_s3_client().put_object(Bucket=parsed.netloc,
+                                   Key=parsed.path[1:],
+                                   Body=body,
+                                   ContentEncoding="utf-8")
+
+
 class CustomStacIO(DefaultStacIO):
-    def __init__(self):
-        self.s3 = boto3.resource("s3")
+    # WriteManifest that writes are checked against and recorded in, if any
+    manifest = None
+    # S3WriteBatch that S3 writes are submitted to, if any, see batch_writes
+    batch = None
+    # Futures of the text of files being read ahead of time, by href, see
+    # crawler.crawl_items. Reading a prefetched href waits for its future.
+    prefetched = {}
 
     def read_text(self, source: Union[str, Link], *args: Any,
                   **kwargs: Any) -> str:
+        future = CustomStacIO.prefetched.pop(source, None)
+        if future is not None:
+            return future.result()
+        return self.read_text_now(source, *args, **kwargs)
+
+    def read_text_now(self, source: Union[str, Link], *args: Any,
+                      **kwargs: Any) -> str:
+        """Read text without checking for a prefetched copy."""
         parsed = urlparse(source)
         if parsed.scheme == "s3":
-            bucket = parsed.netloc
-            key = parsed.path[1:]
-
-            obj = self.s3.Object(bucket, key)
-            return obj.get()["Body"].read().decode("utf-8")
+            obj = get_s3_client().get_object(Bucket=parsed.netloc,
+                                             Key=parsed.path[1:])
+            return obj["Body"].read().decode("utf-8")
         else:
             return super().read_text(source, *args, **kwargs)
 
     def write_text(self, dest: Union[str, Link], txt: str, *args: Any,
                    **kwargs: Any) -> None:
+        manifest = CustomStacIO.manifest
+        if manifest is not None and manifest.is_unchanged(dest, txt):
+            return
+
         parsed = urlparse(dest)
+        batch = CustomStacIO.batch
+        if parsed.scheme == "s3" and batch is not None:
+            future = batch.submit(parsed, txt)
+            if manifest is not None:
+
+                def record(future):
+                    # Only record writes that succeed
+                    if future.exception() is None:
+                        manifest.record(dest, txt)
+
+                future.add_done_callback(record)
+            return
+
         if parsed.scheme == "s3":
-            bucket = parsed.netloc
-            key = parsed.path[1:]
-            s3 = boto3.resource("s3")
-            s3.Object(bucket, key).put(Body=txt, ContentEncoding="utf-8")
+            _put_text(parsed, txt)
         else:
-            super().write_text(dest, txt, *args, **kwargs)
+            with get_metrics().timer("write", path=dest, bytes=len(txt)):
+                super().write_text(dest, txt, *args, **kwargs)
+
+        if manifest is not None:
+            manifest.record(dest, txt)
+
+
+@contextmanager
+def batch_writes(max_pending=16):
+    """Write STAC objects to S3 concurrently within the context, see
+    S3WriteBatch. Leaving the context waits for all of the writes, raising the
+    first of their errors.
+    """
+    batch = S3WriteBatch(max_pending)
+    CustomStacIO.batch = batch
+    try:
+        yield batch
+    finally:
+        CustomStacIO.batch = None
+        batch.close()
 
 
 def call(command):
@@ -53,34 +275,252 @@ def call(command):
     return process.wait()  # 0 means success
 
 
-def upload_to_s3(parsed, local_path):
-    bucket = parsed.netloc
-    key = parsed.path[1:]
-    s3 = boto3.resource("s3")
-    print(f"Uploading {os.path.basename(local_path)}")
-    s3.Bucket(bucket).upload_file(local_path, key)
+class S3Uploader:
+    """Uploads local files to S3 through a single thread-safe client, with
+    multipart transfers and a bounded queue of background uploads.
+
+    Args:
+        chunk_size (int): Size in bytes of the parts of multipart uploads. Files
+            larger than this are uploaded in parts.
+        max_concurrency (int): Number of parts of a file uploaded at once.
+        max_pending (int): Number of files uploaded at once. Submitting more
+            blocks until an upload finishes.
+    """
+    def __init__(self,
+                 chunk_size=64 * 1024 * 1024,
+                 max_concurrency=10,
+                 max_pending=4):
+        self.client = boto3.client(
+            "s3",
+            config=Config(max_pool_connections=max_concurrency * max_pending,
+                          retries=s3_retries))
+        self.transfer_config = TransferConfig(multipart_threshold=chunk_size,
+                                              multipart_chunksize=chunk_size,
+                                              max_concurrency=max_concurrency)
+        self._tasks = BoundedExecutor(max_pending)
+
+    def upload(self, parsed, local_path):
+        """Upload the file at local_path to the parsed S3 URL, waiting for it to
+        finish.
+        """
+        print(f"Uploading {os.path.basename(local_path)}")
+        with get_metrics().timer("upload", path=parsed.geturl()) as event:
+            event["bytes"] = os.path.getsize(local_path)
+            self.client.upload_file(local_path,
+                                    parsed.netloc,
+                                    parsed.path[1:],
+                                    Config=self.transfer_config)
+
+    def submit(self, parsed, local_path, remove=False):
+        """Upload the file at local_path to the parsed S3 URL in the background,
+        deleting the local file afterwards if remove is True.
+
+        Returns:
+            concurrent.futures.Future: The upload, which raises any upload error
+            from its result().
+        """
+        def upload():
+            try:
+                self.upload(parsed, local_path)
+            finally:
+                if remove:
+                    os.remove(local_path)
+
+        future = self._tasks.submit(upload)
+        get_metrics().gauge("queue", len(self._tasks), "upload")
+        return future
+
+    def wait(self):
+        """Wait for all unfinished uploads, raising the first of their errors."""
+        self._tasks.wait()
+
+    def close(self):
+        self.wait()
+        self._tasks.shutdown()
+
+
+# The S3Uploader of each process, see get_uploader
+_uploader = {}
+_uploader_lock = Lock()
+
+
+def get_uploader():
+    """Get the default S3Uploader of this process, creating it on first use.
+    Processes forked from one that already has an uploader get their own, as
+    boto3 clients can't be shared between processes.
+    """
+    with _uploader_lock:
+        if _uploader.get("pid") != os.getpid():
+            _uploader.update(pid=os.getpid(), uploader=S3Uploader())
+        return _uploader["uploader"]
+
+
+def upload_to_s3(parsed, local_path, uploader=None):
+    (uploader or get_uploader()).upload(parsed, local_path)
+
+
+def path_exists(path):
+    """Check whether a local or S3 file exists."""
+    parsed = urlparse(path)
+    if parsed.scheme == "s3":
+        response = get_s3_client().list_objects_v2(Bucket=parsed.netloc,
+                                                   Prefix=parsed.path[1:],
+                                                   MaxKeys=1)
+        return any(obj["Key"] == parsed.path[1:]
+                   for obj in response.get("Contents", []))
+    return os.path.exists(path)
+
+
+def delete_file(path):
+    """Delete a local or S3 file."""
+    parsed = urlparse(path)
+    if parsed.scheme == "s3":
+        get_s3_client().delete_object(Bucket=parsed.netloc,
+                                      Key=parsed.path[1:])
+    elif os.path.exists(path):
+        os.remove(path)
 
 
 def get_existing_paths(directory, ending):
+    """List the files within a local or S3 directory whose names end with
+    ending. S3 listings only cover the directory's prefix.
+
+    Returns:
+        set: The paths of the files.
+    """
     parsed = urlparse(directory)
 
     if parsed.scheme == "s3":
         bucket = parsed.netloc
-        s3 = boto3.client('s3')
-        paginator = s3.get_paginator('list_objects_v2')
-        pages = paginator.paginate(Bucket=bucket)
-        paths = []
+        prefix = parsed.path[1:].rstrip("/")
+        paginator = get_s3_client().get_paginator('list_objects_v2')
+        pages = paginator.paginate(Bucket=bucket,
+                                   Prefix=f"{prefix}/" if prefix else "")
+        paths = set()
         for i, page in enumerate(pages):
             print(f"S3 page {i+1}/?")
-            paths += [
-                f"{directory}/{d['Key']}" for d in page['Contents']
-                if d['Key'][-len(ending):] == ending
-            ]
+            paths.update(f"s3://{bucket}/{d['Key']}"
+                         for d in page.get('Contents', [])
+                         if d['Key'].endswith(ending))
         return paths
 
     else:
-        return glob.glob(f"{directory}{os.sep}**{os.sep}*{ending}",
-                         recursive=True)
+        return set(
+            glob.glob(f"{directory}{os.sep}**{os.sep}*{ending}",
+                      recursive=True))
+
+
+class PathIndex:
+    """The files within a directory whose names end with a given ending, for
+    constant time checks of whether a file exists.
+
+    The listing can be kept in a local snapshot file that later runs read
+    instead of listing the directory again. Files recorded with add() are
+    appended to the snapshot as they are written.
+
+    Args:
+        directory (str): The local or S3 directory to list.
+        ending (str): The ending of the file names to include.
+        snapshot_path (str): A local file to keep the listing in, or None.
+        refresh (bool): Whether to list the directory even if there's a
+            snapshot of it.
+    """
+    def __init__(self, directory, ending, snapshot_path=None, refresh=False):
+        self.snapshot_path = snapshot_path
+        header = f"# {directory} {ending}\n"
+
+        if snapshot_path and os.path.exists(snapshot_path) and not refresh:
+            with open(snapshot_path, "r") as f:
+                lines = f.readlines()
+            if lines and lines[0] == header:
+                print(f"Reading the {ending} files in {directory} from "
+                      f"{snapshot_path}")
+                self.paths = set(line.rstrip("\n") for line in lines[1:])
+                return
+
+        self.paths = get_existing_paths(directory, ending)
+        if snapshot_path:
+            os.makedirs(os.path.dirname(os.path.abspath(snapshot_path)),
+                        exist_ok=True)
+            tmp_path = f"{snapshot_path}.tmp"
+            with open(tmp_path, "w") as f:
+                f.write(header)
+                f.writelines(f"{path}\n" for path in sorted(self.paths))
+            os.replace(tmp_path, snapshot_path)
+
+    def __contains__(self, path):
+        return path in self.paths
+
+    def __iter__(self):
+        return iter(self.paths)
+
+    def __len__(self):
+        return len(self.paths)
+
+    def add(self, path):
+        """Record a newly written file."""
+        if path in self.paths:
+            return
+        self.paths.add(path)
+        if self.snapshot_path:
+            # Single short appends, so processes sharing the snapshot don't
+            # interleave their lines
+            with open(self.snapshot_path, "a") as f:
+                f.write(f"{path}\n")
+
+
+class RasterMetadataStore:
+    """The raster metadata of COGs by path, so that COG assets can be described
+    without opening the COGs again.
+
+    The metadata is kept in memory, and appended to a local JSON lines file
+    that later runs read, if one is given. A COG written again replaces its
+    earlier metadata.
+
+    Args:
+        path (str): A local file to keep the metadata in, or None.
+    """
+    def __init__(self, path=None):
+        self.path = path
+        self.metadata = {}
+        self._wkts = {}
+        self._lock = Lock()
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        if path and os.path.exists(path):
+            with open(path, "r") as f:
+                for line in f:
+                    entry = json.loads(line)
+                    self._remember(entry.pop("path"), entry)
+
+    def _remember(self, cog_path, metadata):
+        # Many COGs share a CRS, so keep one copy of each WKT
+        wkt2 = metadata.get("wkt2")
+        metadata["wkt2"] = self._wkts.setdefault(wkt2, wkt2)
+        self.metadata[cog_path] = metadata
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = Lock()
+
+    def get(self, cog_path):
+        """Get the metadata of a COG, or None if it isn't known."""
+        return self.metadata.get(cog_path)
+
+    def add(self, cog_path, metadata):
+        """Record the metadata of a newly written COG."""
+        with self._lock:
+            self._remember(cog_path, metadata)
+            if self.path:
+                # Single appends, so processes sharing the file don't
+                # interleave their lines
+                with open(self.path, "a") as f:
+                    f.write(json.dumps({"path": cog_path, **metadata}) + "\n")
 
 
 # def file_exists(path, paths_s3):
@@ -101,19 +541,202 @@ def get_existing_paths(directory, ending):
 #         return os.path.exists(path)
 
 
-def download_from_ftp(href, out_path, ftp):
+class DownloadCache:
+    """A local cache of downloaded files with a size cap, so that runs that
+    process the same files again don't download them again.
+
+    Files are keyed by their remote path, size and modification time, so a
+    file that changes on the server is downloaded again. When the cache grows
+    past max_bytes, the least recently used files are deleted. Files are
+    hard linked in and out of the cache where possible, rather than copied.
+    Several processes can share a cache directory.
+
+    Args:
+        directory (str): The local directory to keep the files in.
+        max_bytes (int): The size the cache is kept under.
+    """
+    def __init__(self, directory, max_bytes=50 * 1024**3):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, path, size, mtime):
+        """Get the key of the version of the remote file at path with the given
+        size and modification time.
+        """
+        digest = hashlib.sha256(f"{path}\n{size}\n{mtime}".encode("utf-8"))
+        return f"{digest.hexdigest()[:32]}_{os.path.basename(path)}"
+
+    def get(self, key, out_path):
+        """Copy the cached file with key to out_path.
+
+        Returns:
+            bool: Whether the file was cached.
+        """
+        cache_path = os.path.join(self.directory, key)
+        try:
+            # Mark the file as the most recently used
+            os.utime(cache_path)
+            _link_or_copy(cache_path, out_path)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def put(self, key, local_path):
+        """Add a downloaded file to the cache, then evict files until the cache
+        is under max_bytes.
+        """
+        cache_path = os.path.join(self.directory, key)
+        tmp_path = f"{cache_path}.{os.getpid()}.{get_ident()}.tmp"
+        _link_or_copy(local_path, tmp_path)
+        os.replace(tmp_path, cache_path)
+        self.evict()
+
+    def evict(self):
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".tmp"):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+
+def _link_or_copy(src, dst):
+    try:
+        os.link(src, dst)
+    except OSError as e:
+        if isinstance(e, FileNotFoundError):
+            raise
+        shutil.copyfile(src, dst)
+
+
+def _ftp_retry(ftp, command, num_retries):
+    """Run command(), reconnecting ftp and running it again when it fails with
+    a connection error, up to num_retries times. Permanent errors are raised
+    straight away.
+    """
+    for attempt in range(num_retries + 1):
+        try:
+            return command()
+        except error_perm:
+            raise
+        except all_errors as e:
+            if attempt == num_retries:
+                raise
+            print(f"Reconnecting to the FTP after: {e}")
+            ftp.close()
+            ftp.connect()
+
+
+def _ftp_size(ftp, path, num_retries):
+    def size():
+        # Sizes are only given in binary mode
+        ftp.ftp.voidcmd("TYPE I")
+        return ftp.ftp.size(path)
+
+    try:
+        return _ftp_retry(ftp, size, num_retries)
+    except error_perm:
+        return None
+
+
+def download_from_ftp(href, out_path, ftp, cache=None, num_retries=5):
+    """Download the file at a Geobase href over a logged in GeobaseSpotFTP.
+
+    A transfer that fails partway through is resumed from the last byte
+    received, with an FTP REST offset, after reconnecting. The size and
+    modification time queries are also run again after reconnecting. The
+    downloaded file is checked against the size the server gives for it.
+
+    Args:
+        href (str): The href of the file.
+        out_path (str): The local path to write the file to.
+        ftp (GeobaseSpotFTP): The FTP session to download with.
+        cache (DownloadCache): A cache to copy the file from if it has the
+            version on the server, and to add the file to otherwise.
+        num_retries (int): Number of times a failed transfer is resumed, or a
+            failed query run again, before its error is raised.
+
+    Returns:
+        bool: Whether the file was found on the FTP.
+    """
     path = href.split(ftp.ftp_site)[-1]
-    print(f"Downloading {os.path.basename(path)}")
-    with open(out_path, 'wb') as f:
+    name = os.path.basename(path)
+    size = _ftp_size(ftp, path, num_retries)
+    key = None
+    if cache is not None and size is not None:
         try:
-            ftp.ftp.retrbinary(f"RETR {path}", f.write)
-            return True
+            mtime = _ftp_retry(ftp, lambda: ftp.ftp.voidcmd(f"MDTM {path}"),
+                               num_retries)[4:].strip()
+            key = cache.key(path, size, mtime)
         except error_perm:
-            print(f"Failed to open {path} on FTP")
-            return False
+            # The server doesn't give modification times
+            pass
+        if key is not None:
+            with get_metrics().timer("cache", path=href) as event:
+                event["hit"] = cache.get(key, out_path)
+                if event["hit"]:
+                    event["bytes"] = size
+            if event["hit"]:
+                print(f"Using cached {name}")
+                return True
+
+    print(f"Downloading {name}")
+    with get_metrics().timer("download", path=href) as event, \
+            open(out_path, 'wb') as f:
+        for attempt in range(num_retries + 1):
+            try:
+                ftp.ftp.retrbinary(f"RETR {path}",
+                                   f.write,
+                                   rest=f.tell() or None)
+            except error_perm as e:
+                if f.tell():
+                    # The server may not resume transfers, so start again
+                    print(f"Could not resume {name}, restarting: {e}")
+                    f.seek(0)
+                    f.truncate()
+                    continue
+                print(f"Failed to open {path} on FTP")
+                event["error"] = str(e)
+                return False
+            except all_errors as e:
+                if attempt == num_retries:
+                    raise
+                print(f"Resuming {name} from byte {f.tell()} after: {e}")
+                ftp.close()
+                ftp.connect()
+                continue
+
+            if size is None or f.tell() == size:
+                break
+            print(f"Received {f.tell()} of {size} bytes of {name}, resuming")
+            if f.tell() > size:
+                f.seek(0)
+                f.truncate()
+        else:
+            raise Exception(
+                f"Could not download {path} in {num_retries + 1} attempts")
+        event["bytes"] = f.tell()
+
+    if key is not None:
+        cache.put(key, out_path)
+    return True
 
 
-def unzip(zip_path, out_folder):
+def unzip(zip_path, out_folder, chunk_size=16 * 1024 * 1024):
     zfile = zipfile.ZipFile(zip_path, 'r')
     out_paths = []
 
@@ -122,13 +745,63 @@ def unzip(zip_path, out_folder):
         out_path = os.path.join(out_folder, filename)
         out_paths.append(out_path)
 
+        # Copy in chunks so the member is never held in memory whole
         print(f"Decompressing {folder}{filename}")
-        with open(out_path, 'wb') as f:
-            f.write(zfile.read(zip_file))
+        with get_metrics().timer("extract", path=out_path) as event, \
+                zfile.open(zip_file) as src, open(out_path, 'wb') as f:
+            shutil.copyfileobj(src, f, chunk_size)
+            event["bytes"] = f.tell()
 
     return out_paths
 
 
+def zip_members(zip_path):
+    """List the GeoTIFFs in a zip file as GDAL /vsizip/ paths, which GDAL
+    reads straight out of the zip without extracting them.
+    """
+    with zipfile.ZipFile(zip_path, 'r') as zfile:
+        return [
+            f"/vsizip/{zip_path}/{f}" for f in zfile.namelist()
+            if '.tif' in f.lower()
+        ]
+
+
+def build_stack_vrt(input_paths, vrt_path):
+    """Write a VRT at vrt_path that stacks the first band of each of the rasters
+    at input_paths, which must share a grid, as its bands.
+    """
+    with rasterio.open(input_paths[0]) as src:
+        width, height = src.width, src.height
+        transform, crs = src.transform, src.crs
+
+    vrt = ElementTree.Element("VRTDataset",
+                              rasterXSize=str(width),
+                              rasterYSize=str(height))
+    ElementTree.SubElement(vrt, "SRS").text = crs.wkt
+    ElementTree.SubElement(vrt, "GeoTransform").text = ", ".join(
+        str(v) for v in transform.to_gdal())
+
+    for i, input_path in enumerate(input_paths):
+        with rasterio.open(input_path) as src:
+            if (src.width, src.height, src.transform) != (width, height,
+                                                          transform):
+                raise Exception(f"{input_path} doesn't match {input_paths[0]}")
+            dtype, nodata = src.dtypes[0], src.nodata
+
+        band = ElementTree.SubElement(vrt,
+                                      "VRTRasterBand",
+                                      dataType=typename_fwd[dtype_rev[dtype]],
+                                      band=str(i + 1))
+        if nodata is not None:
+            ElementTree.SubElement(band, "NoDataValue").text = str(nodata)
+        source = ElementTree.SubElement(band, "SimpleSource")
+        ElementTree.SubElement(source, "SourceFilename",
+                               relativeToVRT="0").text = input_path
+        ElementTree.SubElement(source, "SourceBand").text = "1"
+
+    ElementTree.ElementTree(vrt).write(vrt_path)
+
+
 def bbox(f):
     x, y = zip(*list(explode(f["geometry"]["coordinates"])))
     return min(x), min(y), max(x), max(y)
@@ -147,6 +820,66 @@ def transform_geom(transformer, geom):
     return new_coords
 
 
+def transform_geoms(transformer, geoms):
+    """
+    Transform many feature geometries with a single transformer call, as
+    transform_geom does for one polygon, and get their bboxes
+    geoms: the GeoJSON geometry of each feature, a Polygon or MultiPolygon
+    returns a list of transformed coordinates, nested as in each geometry,
+    and an (n, 4) array of min x, min y, max x, max y per feature
+    """
+    if not geoms:
+        return [], np.empty((0, 4))
+
+    # A Polygon is a list of rings and a MultiPolygon a list of them, so both
+    # are handled as a list of polygons
+    polygons = []
+    for geom in geoms:
+        if geom["type"] == "Polygon":
+            polygons.append([geom["coordinates"]])
+        elif geom["type"] == "MultiPolygon":
+            polygons.append(geom["coordinates"])
+        else:
+            raise ValueError(f"Unsupported geometry type {geom['type']}")
+
+    # Stack every point into contiguous arrays, remembering the index of the
+    # first point of each ring, the first ring of each polygon and the first
+    # polygon of each feature
+    rings = [
+        np.asarray(ring, dtype=float)[:, :2] for geom in polygons
+        for polygon in geom for ring in polygon
+    ]
+    ring_offsets = np.cumsum([0] + [len(ring) for ring in rings])
+    polygon_offsets = np.cumsum(
+        [0] + [len(polygon) for geom in polygons for polygon in geom])
+    geom_offsets = np.cumsum([0] + [len(geom) for geom in polygons])
+    points = np.concatenate(rings)
+
+    x2, y2 = transformer.transform(points[:, 0], points[:, 1])
+    points = np.column_stack([y2, x2])
+
+    starts = ring_offsets[polygon_offsets[geom_offsets[:-1]]]
+    bboxes = np.hstack([
+        np.minimum.reduceat(points, starts, axis=0),
+        np.maximum.reduceat(points, starts, axis=0)
+    ])
+    new_rings = [
+        list(map(tuple, points[start:end].tolist()))
+        for start, end in zip(ring_offsets[:-1], ring_offsets[1:])
+    ]
+    new_polygons = [
+        new_rings[start:end]
+        for start, end in zip(polygon_offsets[:-1], polygon_offsets[1:])
+    ]
+    new_geoms = []
+    for geom, start, end in zip(geoms, geom_offsets[:-1], geom_offsets[1:]):
+        if geom["type"] == "Polygon":
+            new_geoms.append(new_polygons[start])
+        else:
+            new_geoms.append(new_polygons[start:end])
+    return new_geoms, bboxes
+
+
 def explode(coords):
     # from https://gis.stackexchange.com/questions/90553/fiona-get-each-feature-extent-bounds
     """Explode a GeoJSON geometry's coordinates object and yield coordinate tuples.
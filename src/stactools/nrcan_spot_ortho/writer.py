@@ -0,0 +1,59 @@
+import os
+
+from pystac import CatalogType, Link, MediaType, RelType
+from pystac.layout import BestPracticesLayoutStrategy
+
+
+class ItemWriter:
+    """
+    Save items as soon as they are added to a catalog, leaving their parents with
+    only a link to each item's file, so that memory use doesn't grow with the
+    number of items
+    writer = ItemWriter(spot_catalog, root_href, catalog_type)
+    writer.add_item(item, year_catalog)
+    writer.finish()
+    """
+    def __init__(self, catalog, root_href, catalog_type):
+        """
+        catalog: the root catalog, either new or read from root_href
+        root_href: the output location of the catalog
+        catalog_type: the pystac.CatalogType to save the catalog as
+        """
+        self.catalog = catalog
+        self.catalog_type = catalog_type
+        self.strategy = BestPracticesLayoutStrategy()
+        # Give a new catalog and its children their final hrefs up front, so
+        # that each item's href and links are known when it is added. A catalog
+        # read from a file already has them.
+        if catalog.get_self_href() is None:
+            catalog.normalize_hrefs(root_href)
+        catalog.catalog_type = catalog_type
+
+    def add_item(self, item, parent):
+        """
+        Add an item to a catalog or collection and save it
+        """
+        # Give the item its href before adding it, so that the root caches it
+        # by href, as add_item would name it, and it can be dropped from that
+        # cache once saved
+        item.set_self_href(
+            self.strategy.get_href(item,
+                                   os.path.dirname(parent.get_self_href())))
+        parent.add_item(item, strategy=self.strategy)
+        include_self_link = self.catalog_type == CatalogType.ABSOLUTE_PUBLISHED
+        item.save_object(include_self_link=include_self_link)
+
+        # Replace the link to the item with a link to its file
+        parent.links.pop()
+        parent.add_link(
+            Link(RelType.ITEM, item.get_self_href(),
+                 media_type=MediaType.JSON))
+        # Drop the item from the root's cache of resolved objects, so that
+        # nothing keeps it in memory
+        item.set_root(None)
+
+    def finish(self):
+        """
+        Save the catalogs and collections. Saved items aren't loaded again.
+        """
+        self.catalog.save(self.catalog_type)
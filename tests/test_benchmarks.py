@@ -0,0 +1,32 @@
+import json
+import os
+from tempfile import TemporaryDirectory
+import unittest
+
+from click.testing import CliRunner
+
+try:
+    from benchmarks.run import main
+except ImportError:  # The benchmarks extra isn't installed
+    main = None
+
+
+@unittest.skipIf(main is None, "moto[server] and pyftpdlib are not installed")
+class BenchmarksTest(unittest.TestCase):
+    def test_smoke(self):
+        with TemporaryDirectory() as tmp_dir:
+            output = os.path.join(tmp_dir, "benchmark.json")
+            result = CliRunner().invoke(main, [
+                "--features", "5", "--cogify-items", "1", "--image-size", "64",
+                "--output", output
+            ])
+            self.assertEqual(result.exit_code, 0, result.output)
+            with open(output) as f:
+                results = json.load(f)["results"]
+
+        convert, cogify = results
+        self.assertEqual(convert["command"], "convert-index")
+        self.assertEqual(convert["stages"]["build"]["items"], 5)
+        self.assertIn("items_per_s", convert["stages"]["write"])
+        self.assertEqual(cogify["command"], "cogify-assets")
+        self.assertEqual(cogify["stages"]["translate"]["count"], 5)
@@ -0,0 +1,380 @@
+from datetime import datetime
+import os
+import shutil
+from tempfile import TemporaryDirectory
+import unittest
+from unittest import mock
+
+import numpy as np
+import pystac
+import rasterio
+from rasterio.transform import from_origin
+
+from stactools.nrcan_spot_ortho.cog import (cogify_catalog, cogify_item,
+                                            cogify_zips, group_bands,
+                                            include_cog_asset, item_cog_projs,
+                                            translate)
+from stactools.nrcan_spot_ortho.journal import CogifyJournal
+from stactools.nrcan_spot_ortho.sources import MirrorSource
+from stactools.nrcan_spot_ortho.stac_templates import stacked_image_types
+from stactools.nrcan_spot_ortho.utils import (RasterMetadataStore, S3Uploader,
+                                              build_stack_vrt)
+from tests.test_utils import write_test_catalog, write_test_zip
+
+m20_paths = [
+    f"/tmp/s5_09537_5435_20070531_m20_{i}_lcc00.tif" for i in [2, 1, 4, 3]
+]
+p10_path = "/tmp/s5_09537_5435_20070531_p10_1_lcc00.tif"
+
+
+class GroupBandsTest(unittest.TestCase):
+    def test_group_bands(self):
+        groups = group_bands(m20_paths + [p10_path], merge_bands=False)
+
+        self.assertEqual(len(groups), 5)
+        self.assertEqual(groups[os.path.basename(p10_path)], [p10_path])
+
+    def test_merge_bands(self):
+        groups = group_bands(m20_paths + [p10_path], merge_bands=True)
+
+        self.assertEqual(
+            groups, {
+                "s5_09537_5435_20070531_m20_lcc00.tif": sorted(m20_paths),
+                os.path.basename(p10_path): [p10_path]
+            })
+
+
+class BuildStackVrtTest(unittest.TestCase):
+    def test_build_stack_vrt(self):
+        with TemporaryDirectory() as tmp_dir:
+            input_paths = []
+            for i in range(1, 5):
+                input_path = os.path.join(tmp_dir, f"band_{i}.tif")
+                with rasterio.open(input_path,
+                                   "w",
+                                   driver="GTiff",
+                                   width=8,
+                                   height=4,
+                                   count=1,
+                                   dtype="uint8",
+                                   crs="EPSG:3979",
+                                   transform=from_origin(0, 0, 20, 20)) as dst:
+                    dst.write(np.full((1, 4, 8), i, dtype="uint8"))
+                input_paths.append(input_path)
+
+            vrt_path = os.path.join(tmp_dir, "stack.vrt")
+            build_stack_vrt(input_paths, vrt_path)
+
+            with rasterio.open(vrt_path) as src:
+                self.assertEqual(src.count, 4)
+                self.assertEqual(src.crs.to_epsg(), 3979)
+                self.assertEqual(src.transform, from_origin(0, 0, 20, 20))
+                self.assertEqual(list(src.read().mean(axis=(1, 2))),
+                                 [1, 2, 3, 4])
+
+
+class TranslateTest(unittest.TestCase):
+    cog_options = {"compress": "zstd", "blocksize": 256, "num_threads": 2}
+
+    def setUp(self):
+        self.tmp_dir = TemporaryDirectory()
+        zip_path = os.path.join(self.tmp_dir.name, "image.zip")
+        write_test_zip(zip_path, ["image.tif"], size=512)
+        self.input_path = f"/vsizip/{zip_path}/image/image.tif"
+        self.output_path = os.path.join(self.tmp_dir.name, "image_cog.tif")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def assert_cog(self):
+        with rasterio.open(self.output_path) as src:
+            self.assertEqual(src.compression.value, "ZSTD")
+            self.assertEqual(src.block_shapes, [(256, 256)])
+            self.assertEqual(src.overviews(1), [2])
+
+    def test_rasterio(self):
+        with mock.patch.object(rasterio, "Env", wraps=rasterio.Env) as env:
+            translate(self.input_path, self.output_path, self.cog_options)
+
+        env.assert_called_once_with(GDAL_NUM_THREADS="2")
+        self.assert_cog()
+
+    @unittest.skipUnless(shutil.which("gdal_translate"),
+                         "gdal_translate is not installed")
+    def test_gdal_translate(self):
+        translate(self.input_path, self.output_path, self.cog_options,
+                  "gdal_translate")
+
+        self.assert_cog()
+
+    def test_gdal_translate_command(self):
+        with mock.patch("stactools.nrcan_spot_ortho.cog.call",
+                        return_value=1) as call:
+            with self.assertRaises(Exception):
+                translate(self.input_path, self.output_path, self.cog_options,
+                          "gdal_translate")
+
+        call.assert_called_once_with([
+            "gdal_translate", "-of", "COG", "-co", "COMPRESS=zstd", "-co",
+            "BLOCKSIZE=256", "-co", "NUM_THREADS=2", "--config",
+            "GDAL_NUM_THREADS", "2", self.input_path, self.output_path
+        ])
+
+    def test_rasterio_failure(self):
+        output_path = os.path.join(self.tmp_dir.name, "missing", "cog.tif")
+        with self.assertRaisesRegex(Exception, "rasterio failed"):
+            translate(self.input_path, output_path)
+
+
+class IncludeCogAssetTest(unittest.TestCase):
+    def test_include_cog_asset(self):
+        with TemporaryDirectory() as tmp_dir:
+            cog_path = os.path.join(tmp_dir,
+                                    p10_path.replace(".tif", "_cog.tif")[5:])
+            with rasterio.open(cog_path,
+                               "w",
+                               driver="GTiff",
+                               width=8,
+                               height=4,
+                               count=1,
+                               dtype="uint8",
+                               crs="EPSG:3979",
+                               transform=from_origin(0, 80, 10, 10)) as dst:
+                dst.write(np.zeros((1, 4, 8), dtype="uint8"))
+
+            metadata_path = os.path.join(tmp_dir, "cog_metadata.jsonl")
+            item = pystac.Item("item", None, None, datetime(2007, 5, 31), {})
+            include_cog_asset(item, cog_path, "lcc00",
+                              RasterMetadataStore(metadata_path))
+            opened = item.assets["pan"].to_dict()
+            self.assertEqual(opened["gsd"], 10)
+            self.assertEqual(opened["proj:bbox"], [0, 40, 80, 80])
+
+            # Later runs describe the COG from the stored metadata alone
+            os.remove(cog_path)
+            item = pystac.Item("item", None, None, datetime(2007, 5, 31), {})
+            include_cog_asset(item, cog_path, "lcc00",
+                              RasterMetadataStore(metadata_path))
+            self.assertEqual(item.assets["pan"].to_dict(), opened)
+
+    def test_other_projections(self):
+        cog_path = "/cogs/s5_09537_5435_20070531_m20_1_utm17_cog.tif"
+        cog_metadata = RasterMetadataStore()
+        cog_metadata.add(
+            cog_path, {
+                "transform": [10, 0, 0, 0, -10, 80],
+                "bbox": [0, 40, 80, 80],
+                "wkt2": "",
+                "gsd": 20
+            })
+        item = pystac.Item("item", None, None, datetime(2007, 5, 31), {})
+        include_cog_asset(item, cog_path, "utm17", cog_metadata)
+
+        self.assertEqual(list(item.assets), ["B1_utm17"])
+        self.assertEqual(item.assets["B1_utm17"].to_dict()["proj:epsg"], 26917)
+
+
+class ItemCogProjsTest(unittest.TestCase):
+    def test_item_cog_projs(self):
+        item = pystac.Item("item", None, None, datetime(2007, 5, 31), {})
+        for key in ["m20_lcc00", "p10_lcc00", "m20_utm17"]:
+            item.add_asset(
+                key, pystac.Asset(f"/{key}.zip", media_type="application/zip"))
+        # COG assets aren't mistaken for zipped imagery
+        item.add_asset("B1_utm18", pystac.Asset("/B1_utm18_cog.tif"))
+
+        self.assertEqual(item_cog_projs(item, ["lcc00"]), ["lcc00"])
+        self.assertEqual(item_cog_projs(item, ["lcc00", "utm"]),
+                         ["lcc00", "utm17"])
+        self.assertEqual(item_cog_projs(item, ["utm18"]), [])
+        self.assertEqual(item_cog_projs(item, "utm17"), ["utm17"])
+
+
+class CogifyZipsTest(unittest.TestCase):
+    def test_journal(self):
+        with TemporaryDirectory() as tmp_dir:
+            os.makedirs(os.path.join(tmp_dir, "image"))
+            write_test_zip(os.path.join(tmp_dir, "image", "a_p10_lcc00.zip"),
+                           ["a_p10_1_lcc00.tif"])
+            cog_directory = os.path.join(tmp_dir, "cogs")
+            os.makedirs(cog_directory)
+            zip_hrefs = [
+                f"http://ftp.geogratis.gc.ca/image/{name}_p10_lcc00.zip"
+                for name in ["a", "missing"]
+            ]
+            journal = CogifyJournal(os.path.join(tmp_dir, "journal.sqlite"))
+
+            cog_paths = cogify_zips(zip_hrefs,
+                                    tmp_dir,
+                                    cog_directory,
+                                    False,
+                                    set(),
+                                    MirrorSource(tmp_dir),
+                                    journal=journal,
+                                    item_id="a")
+
+            self.assertEqual(
+                journal.published_cogs("a", zip_hrefs[0], "bands"), cog_paths)
+            # The zip file isn't published with its bands merged
+            self.assertIsNone(
+                journal.published_cogs("a", zip_hrefs[0], "merged"))
+            # The zip file that wasn't found isn't published
+            self.assertIsNone(
+                journal.published_cogs("a", zip_hrefs[1], "bands"))
+            journal.close()
+
+
+class CogifyCatalogTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = TemporaryDirectory()
+        self.cog_directory = os.path.join(self.tmp_dir.name, "cogs")
+        os.makedirs(self.cog_directory)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def read_items(self, catalog_path):
+        catalog = pystac.read_file(catalog_path)
+        return {item.id: item for item in catalog.get_all_items()}
+
+    def record_saves(self, saved):
+        """Patch Item.save_object to append the ID of each saved item to
+        saved.
+        """
+        save_object = pystac.Item.save_object
+
+        def record_save(item, *args, **kwargs):
+            saved.append(item.id)
+            return save_object(item, *args, **kwargs)
+
+        return mock.patch.object(pystac.Item,
+                                 "save_object",
+                                 autospec=True,
+                                 side_effect=record_save)
+
+    def test_workers(self):
+        spot_ids = [f"S5_0000{i}_0000_20070531" for i in range(4)]
+        catalog_path = write_test_catalog(self.tmp_dir.name,
+                                          spot_ids,
+                                          missing=[spot_ids[2]],
+                                          corrupt=[spot_ids[1]])
+
+        saved = []
+        with self.record_saves(saved):
+            cogify_catalog(catalog_path, self.cog_directory, workers=2)
+
+        # The failed item doesn't stop the others, which are saved in order.
+        # The item whose zip file wasn't found is saved without COGs.
+        self.assertEqual(saved, [spot_ids[0]] + spot_ids[2:])
+        items = self.read_items(catalog_path)
+        self.assertNotIn("B1", items[spot_ids[1]].assets)
+        self.assertNotIn("B1", items[spot_ids[2]].assets)
+        for spot_id in [spot_ids[0], spot_ids[3]]:
+            self.assertTrue(
+                os.path.exists(
+                    items[spot_id].assets["B4"].get_absolute_href()))
+
+    def test_workers_closed_on_error(self):
+        spot_ids = [f"S5_0000{i}_0000_20070531" for i in range(2)]
+        catalog_path = write_test_catalog(self.tmp_dir.name, spot_ids)
+        journal_path = os.path.join(self.tmp_dir.name, "journal.sqlite")
+
+        with mock.patch.object(pystac.Item,
+                               "save_object",
+                               side_effect=OSError("disk full")), \
+                mock.patch.object(S3Uploader, "close") as close_uploader, \
+                mock.patch.object(CogifyJournal, "close") as close_journal:
+            with self.assertRaises(OSError):
+                cogify_catalog(catalog_path,
+                               self.cog_directory,
+                               workers=2,
+                               journal_path=journal_path)
+
+        close_uploader.assert_called_once_with()
+        close_journal.assert_called_once_with()
+
+    def test_new_snapshot_dir(self):
+        catalog_path = write_test_catalog(self.tmp_dir.name,
+                                          ["S5_00000_0000_20070531"])
+        snapshot_dir = os.path.join(self.tmp_dir.name, "snapshots", "run")
+        cogify_catalog(catalog_path,
+                       self.cog_directory,
+                       snapshot_dir=snapshot_dir)
+
+        self.assertEqual(sorted(os.listdir(snapshot_dir)), [
+            "cog_metadata.jsonl", "existing_cog.tif.txt", "existing_tn.jpg.txt"
+        ])
+
+    def test_projections(self):
+        spot_ids = ["S5_00000_0000_20070531", "S5_00001_0000_20070531"]
+        catalog_path = write_test_catalog(self.tmp_dir.name,
+                                          spot_ids,
+                                          projs=["lcc00", "utm17"])
+        journal_path = os.path.join(self.tmp_dir.name, "journal.sqlite")
+        cogify_catalog(catalog_path,
+                       self.cog_directory,
+                       journal_path=journal_path)
+
+        # The journal of the LCC run doesn't stop the UTM COGs being added
+        saved = []
+        with self.record_saves(saved):
+            cogify_catalog(catalog_path,
+                           self.cog_directory,
+                           journal_path=journal_path,
+                           cog_projs=["lcc00", "utm"])
+
+        self.assertEqual(saved, spot_ids)
+        for item in self.read_items(catalog_path).values():
+            for band in range(1, 5):
+                lcc = item.assets[f"B{band}"].to_dict()
+                utm = item.assets[f"B{band}_utm17"].to_dict()
+                self.assertEqual(lcc["proj:epsg"], 3979)
+                self.assertEqual(utm["proj:epsg"], 26917)
+                self.assertTrue(lcc["href"].endswith("_lcc00_cog.tif"))
+                self.assertTrue(utm["href"].endswith("_utm17_cog.tif"))
+
+        # Both projections are done, so a third run skips every item
+        with mock.patch.object(pystac.Item, "save_object") as save:
+            cogify_catalog(catalog_path,
+                           self.cog_directory,
+                           journal_path=journal_path,
+                           cog_projs=["lcc00", "utm"])
+        save.assert_not_called()
+
+    def test_single_projection_string(self):
+        catalog_path = write_test_catalog(self.tmp_dir.name,
+                                          ["S5_00000_0000_20070531"],
+                                          projs=["lcc00", "utm17"])
+        item = next(pystac.read_file(catalog_path).get_all_items())
+        cogify_item(item,
+                    self.cog_directory,
+                    False,
+                    set(),
+                    set(),
+                    cog_projs="utm17")
+
+        self.assertEqual(sorted(k for k in item.assets if k.startswith("B")),
+                         ["B1_utm17", "B2_utm17", "B3_utm17", "B4_utm17"])
+
+    def test_journal_layout(self):
+        spot_ids = ["S5_00000_0000_20070531"]
+        catalog_path = write_test_catalog(self.tmp_dir.name, spot_ids)
+        journal_path = os.path.join(self.tmp_dir.name, "journal.sqlite")
+        cogify_catalog(catalog_path,
+                       self.cog_directory,
+                       journal_path=journal_path)
+
+        # Items journaled with separate bands are COGified again when they are
+        # merged, then skipped
+        for expected in [spot_ids, []]:
+            saved = []
+            with self.record_saves(saved):
+                cogify_catalog(catalog_path,
+                               self.cog_directory,
+                               journal_path=journal_path,
+                               merge_bands=True)
+            self.assertEqual(saved, expected)
+
+        item = self.read_items(catalog_path)[spot_ids[0]]
+        self.assertIn("B1", item.assets)
+        self.assertIn(stacked_image_types["m20"], item.assets)
@@ -43,3 +43,88 @@ class ConvertIndexTest(CliTestCase):
                 item_path = os.path.join(tmp_dir, json)
                 item = pystac.read_file(item_path)
                 item.validate()
+
+    def test_convert_index_workers(self):
+
+        with TemporaryDirectory() as tmp_dir:
+            test_index_path = os.path.join(tmp_dir, 'spot_index_test.shp')
+            write_test_index(test_index_path)
+            write_test_hrefs(os.path.join(tmp_dir, "spot_hrefs_test.json"))
+
+            root_href = os.path.join(tmp_dir, "stac")
+            cmd = [
+                'nrcan-spot-ortho', 'convert-index', test_index_path,
+                root_href, '--workers', '2'
+            ]
+            self.run_command(cmd)
+
+            catalog = pystac.read_file(os.path.join(root_href, "catalog.json"))
+            items = list(catalog.get_all_items())
+            self.assertEqual([item.id for item in items],
+                             ["S5_09537_5435_20070531"])
+            self.assertEqual(items[0].collection_id,
+                             "canada-spot5-orthoimages")
+            self.assertEqual(len(items[0].assets), 7)
+            self.assertEqual(items[0].get_parent().id, "S5_2007")
+
+    def test_convert_index_stream(self):
+
+        with TemporaryDirectory() as tmp_dir:
+            test_index_path = os.path.join(tmp_dir, 'spot_index_test.shp')
+            write_test_index(test_index_path)
+            write_test_hrefs(os.path.join(tmp_dir, "spot_hrefs_test.json"))
+
+            root_href = os.path.join(tmp_dir, "stac")
+            cmd = [
+                'nrcan-spot-ortho', 'convert-index', test_index_path,
+                root_href, '--stream', '-c', 'SELF_CONTAINED'
+            ]
+            self.run_command(cmd)
+
+            catalog = pystac.read_file(os.path.join(root_href, "catalog.json"))
+            items = list(catalog.get_all_items())
+            self.assertEqual([item.id for item in items],
+                             ["S5_09537_5435_20070531"])
+            self.assertEqual(items[0].get_parent().id, "S5_2007")
+            self.assertEqual(len(items[0].assets), 7)
+
+    def test_convert_index_manifest(self):
+
+        with TemporaryDirectory() as tmp_dir:
+            test_index_path = os.path.join(tmp_dir, 'spot_index_test.shp')
+            write_test_index(test_index_path)
+            write_test_hrefs(os.path.join(tmp_dir, "spot_hrefs_test.json"))
+
+            cmd = [
+                'nrcan-spot-ortho', 'convert-index', test_index_path,
+                os.path.join(tmp_dir, "stac"), '--manifest',
+                os.path.join(tmp_dir, "manifest.json")
+            ]
+            # Each object is written once, and not again if unchanged
+            result = self.run_command(cmd)
+            self.assertIn("Wrote 6 STAC objects, 0 were unchanged",
+                          result.output)
+            result = self.run_command(cmd)
+            self.assertIn("Wrote 0 STAC objects, 6 were unchanged",
+                          result.output)
+
+    def test_convert_index_incremental(self):
+
+        with TemporaryDirectory() as tmp_dir:
+            test_index_path = os.path.join(tmp_dir, 'spot_index_test.shp')
+            write_test_index(test_index_path)
+            write_test_hrefs(os.path.join(tmp_dir, "spot_hrefs_test.json"))
+
+            cmd = [
+                'nrcan-spot-ortho', 'convert-index', test_index_path,
+                os.path.join(tmp_dir, "stac"), '--manifest',
+                os.path.join(tmp_dir, "manifest.json")
+            ]
+            self.run_command(cmd)
+            result = self.run_command(cmd + ['--incremental'])
+            self.assertIn("0 items created or updated, 1 unchanged, 0 deleted",
+                          result.output)
+
+            catalog = pystac.read_file(
+                os.path.join(tmp_dir, "stac", "catalog.json"))
+            self.assertEqual(len(list(catalog.get_all_items())), 1)
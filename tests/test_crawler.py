@@ -0,0 +1,54 @@
+from datetime import datetime
+import os
+from tempfile import TemporaryDirectory
+import unittest
+
+import pystac
+
+from stactools.nrcan_spot_ortho.crawler import crawl_items
+from stactools.nrcan_spot_ortho.utils import CustomStacIO
+
+
+def item(item_id):
+    return pystac.Item(item_id, {
+        "type": "Point",
+        "coordinates": [0, 0]
+    }, [0, 0, 0, 0], datetime(2007, 5, 31), {})
+
+
+class CrawlItemsTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = TemporaryDirectory()
+        pystac.StacIO.set_default(CustomStacIO)
+
+        catalog = pystac.Catalog("root", "Root catalog")
+        catalog.add_item(item("root-item"))
+        for i in range(3):
+            child = pystac.Catalog(f"child{i}", "Child")
+            catalog.add_child(child)
+            grandchild = pystac.Catalog(f"grandchild{i}", "Grandchild")
+            child.add_child(grandchild)
+            for j in range(5):
+                child.add_item(item(f"item{i}-{j}"))
+                grandchild.add_item(item(f"item{i}-{j}-deep"))
+        catalog.normalize_and_save(self.tmp_dir.name,
+                                   pystac.CatalogType.SELF_CONTAINED)
+        self.catalog_path = os.path.join(self.tmp_dir.name, "catalog.json")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_crawl_items(self):
+        catalog = pystac.read_file(self.catalog_path)
+        walked = [item.id for _, _, items in catalog.walk() for item in items]
+
+        catalog = pystac.read_file(self.catalog_path)
+        crawled = list(crawl_items(catalog, prefetch=4))
+
+        self.assertEqual([item.id for item in crawled], walked)
+        self.assertEqual(len(crawled), 31)
+        self.assertEqual(CustomStacIO.prefetched, {})
+        # Items are resolved within the catalog, as walk() does
+        for _, _, items in catalog.walk():
+            for walked_item in items:
+                self.assertIn(walked_item, crawled)
@@ -0,0 +1,78 @@
+import os
+from tempfile import TemporaryDirectory
+import time
+import unittest
+from unittest import mock
+
+from stactools.nrcan_spot_ortho.utils import DownloadCache, download_from_ftp
+
+href = ("ftp.geogratis.gc.ca/pub/nrcan_rncan/image/spot/geobase_orthoimages/"
+        "s5_09537_5435_20070531/s5_09537_5435_20070531_m20_lcc00.zip")
+
+
+class DownloadCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = TemporaryDirectory()
+        self.cache = DownloadCache(os.path.join(self.tmp_dir.name, "cache"),
+                                   max_bytes=10)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def write(self, name, data):
+        path = os.path.join(self.tmp_dir.name, name)
+        with open(path, "wb") as f:
+            f.write(data)
+        return path
+
+    def test_least_recently_used_are_evicted(self):
+        keys = [self.cache.key(f"/{name}", 4, "1") for name in "abc"]
+        self.cache.put(keys[0], self.write("a", b"aaaa"))
+        time.sleep(0.01)
+        self.cache.put(keys[1], self.write("b", b"bbbb"))
+        time.sleep(0.01)
+        # Using the oldest file keeps it over the next one
+        out_path = os.path.join(self.tmp_dir.name, "out")
+        self.assertTrue(self.cache.get(keys[0], out_path))
+        time.sleep(0.01)
+        self.cache.put(keys[2], self.write("c", b"cccc"))
+
+        self.assertEqual(sorted(os.listdir(self.cache.directory)),
+                         sorted([keys[0], keys[2]]))
+        with open(out_path, "rb") as f:
+            self.assertEqual(f.read(), b"aaaa")
+
+    def test_download_from_ftp(self):
+        geobase = mock.Mock(ftp_site="ftp.geogratis.gc.ca")
+        geobase.ftp.size.return_value = 3
+        geobase.ftp.voidcmd.return_value = "213 20100101000000"
+        geobase.ftp.retrbinary.side_effect = lambda cmd, write, rest: write(
+            b"zip")
+
+        for name in ["first", "second"]:
+            out_path = os.path.join(self.tmp_dir.name, name)
+            self.assertTrue(
+                download_from_ftp(href, out_path, geobase, self.cache))
+            with open(out_path, "rb") as f:
+                self.assertEqual(f.read(), b"zip")
+
+        # The second download came from the cache
+        self.assertEqual(geobase.ftp.retrbinary.call_count, 1)
+
+        # A dropped session is reconnected for the modification time
+        geobase.ftp.voidcmd.side_effect = [
+            "200 Type set to I",
+            EOFError(), "213 20100101000000"
+        ]
+        self.assertTrue(
+            download_from_ftp(href, os.path.join(self.tmp_dir.name, "again"),
+                              geobase, self.cache))
+        self.assertEqual(geobase.connect.call_count, 1)
+        self.assertEqual(geobase.ftp.retrbinary.call_count, 1)
+        geobase.ftp.voidcmd.side_effect = None
+
+        # A file that changed on the server is downloaded again
+        geobase.ftp.voidcmd.return_value = "213 20200101000000"
+        download_from_ftp(href, os.path.join(self.tmp_dir.name, "third"),
+                          geobase, self.cache)
+        self.assertEqual(geobase.ftp.retrbinary.call_count, 2)
@@ -0,0 +1,187 @@
+import json
+import os
+from tempfile import TemporaryDirectory
+import time
+import unittest
+from ftplib import error_perm, error_temp
+from unittest import mock
+
+from stactools.nrcan_spot_ortho.geobase_ftp import (GeobaseFTPPool,
+                                                    GeobaseSpotFTP,
+                                                    get_listing)
+from stactools.nrcan_spot_ortho.utils import download_from_ftp
+
+spot_location = "/pub/nrcan_rncan/image/spot/geobase_orthoimages"
+recursive_listing = [
+    f"{spot_location}:",
+    "drwxr-xr-x 2 ftp ftp 4096 Jan 01 2010 images",
+    "drwxr-xr-x 2 ftp ftp 4096 Jan 01 2010 s5_09537_5435_20070531",
+    "",
+    f"{spot_location}/images:",
+    "-rw-r--r-- 1 ftp ftp 1234 Jan 01 2010 s5_09537_5435_20070531_tn.jpg",
+    "",
+    f"{spot_location}/s5_09537_5435_20070531:",
+    "-rw-r--r-- 1 ftp ftp 1234 Jan 01 2010 s5_09537_5435_20070531_p10_lcc00.zip",
+    "-rw-r--r-- 1 ftp ftp 1234 Jan 01 2010 s5_09537_5435_20070531_m20_lcc00.zip",
+]
+expected_listing = {
+    "s5_09537_5435_20070531": [
+        f"ftp.geogratis.gc.ca{spot_location}/s5_09537_5435_20070531/"
+        "s5_09537_5435_20070531_m20_lcc00.zip",
+        f"ftp.geogratis.gc.ca{spot_location}/s5_09537_5435_20070531/"
+        "s5_09537_5435_20070531_p10_lcc00.zip",
+    ]
+}
+
+
+@mock.patch("stactools.nrcan_spot_ortho.geobase_ftp.FTP")
+class GeobaseFTPPoolTest(unittest.TestCase):
+    def test_sessions_are_reused(self, ftp):
+        with GeobaseFTPPool(max_connections=2) as pool:
+            with pool.connection() as first:
+                pass
+            with pool.connection() as second:
+                pass
+
+        self.assertIs(first, second)
+        self.assertEqual(ftp.call_count, 1)
+
+    def test_failed_sessions_are_dropped(self, ftp):
+        pool = GeobaseFTPPool()
+        with self.assertRaises(ValueError):
+            with pool.connection():
+                raise ValueError()
+        with pool.connection():
+            pass
+
+        self.assertEqual(ftp.call_count, 2)
+
+    def test_stale_sessions_reconnect(self, ftp):
+        pool = GeobaseFTPPool(max_idle=0)
+        with pool.connection():
+            pass
+        ftp.return_value.voidcmd.side_effect = error_temp()
+        with pool.connection():
+            pass
+
+        self.assertEqual(ftp.call_count, 2)
+
+    @mock.patch.dict(os.environ, {
+        "GEOBASE_FTP_HOST": "127.0.0.1",
+        "GEOBASE_FTP_PORT": "2121"
+    })
+    def test_server_override(self, ftp):
+        geobase = GeobaseSpotFTP()
+
+        ftp.return_value.connect.assert_called_once_with("127.0.0.1", 2121)
+        self.assertEqual(geobase.href("/pub/a.zip"),
+                         "ftp.geogratis.gc.ca/pub/a.zip")
+
+
+class GeobaseListingTest(unittest.TestCase):
+    def test_list_all(self):
+        geobase = GeobaseSpotFTP(connect=False)
+        geobase.ftp = mock.Mock()
+        geobase.ftp.retrlines.side_effect = lambda cmd, callback: [
+            callback(line) for line in recursive_listing
+        ]
+
+        self.assertEqual(geobase.list_all(), expected_listing)
+
+    def test_list_all_without_recursive_list(self):
+        geobase = GeobaseSpotFTP(connect=False)
+        geobase.ftp = mock.Mock()
+        geobase.ftp.retrlines.side_effect = error_perm()
+        spot_id = "s5_09537_5435_20070531"
+        dir_facts = {"type": "dir"}
+        file_facts = {"type": "file"}
+        geobase.ftp.mlsd.side_effect = lambda path: {
+            spot_location: [("images", dir_facts), (spot_id, dir_facts)],
+            f"{spot_location}/images": [],
+            f"{spot_location}/{spot_id}": [
+                (f"{spot_id}_m20_lcc00.zip", file_facts),
+                (f"{spot_id}_p10_lcc00.zip", file_facts),
+            ],
+        }[path]
+
+        self.assertEqual(geobase.list_all(), expected_listing)
+
+    @mock.patch("stactools.nrcan_spot_ortho.geobase_ftp.GeobaseSpotFTP")
+    def test_get_listing_cache(self, geobase):
+        geobase.return_value.list_all.return_value = expected_listing
+        with TemporaryDirectory() as tmp_dir:
+            cache_path = os.path.join(tmp_dir, "listing.json")
+            self.assertEqual(get_listing(cache_path), expected_listing)
+            self.assertEqual(get_listing(cache_path), expected_listing)
+            self.assertEqual(geobase.call_count, 1)
+
+            # An expired cache is refreshed
+            with open(cache_path, "w") as f:
+                json.dump({"created": time.time() - 10, "listing": {}}, f)
+            self.assertEqual(get_listing(cache_path, ttl=5), expected_listing)
+            self.assertEqual(geobase.call_count, 2)
+
+
+class DownloadFromFTPTest(unittest.TestCase):
+    def setUp(self):
+        self.geobase = GeobaseSpotFTP(connect=False)
+        self.geobase.ftp = mock.Mock()
+        self.geobase.ftp.size.return_value = 4
+        self.geobase.connect = mock.Mock()
+        self.geobase.close = mock.Mock()
+        self.href = self.geobase.href(f"{spot_location}/a.zip")
+
+    def test_resume(self):
+        offsets = []
+
+        def retrbinary(cmd, write, rest):
+            offsets.append(rest)
+            if rest is None:
+                write(b"ab")
+                raise EOFError()
+            write(b"cd")
+
+        self.geobase.ftp.retrbinary.side_effect = retrbinary
+        with TemporaryDirectory() as tmp_dir:
+            out_path = os.path.join(tmp_dir, "a.zip")
+            self.assertTrue(
+                download_from_ftp(self.href, out_path, self.geobase))
+            with open(out_path, "rb") as f:
+                self.assertEqual(f.read(), b"abcd")
+
+        self.assertEqual(offsets, [None, 2])
+        self.assertEqual(self.geobase.connect.call_count, 1)
+
+    def test_queries_reconnect(self):
+        # The session dropped before the size query
+        self.geobase.ftp.size.side_effect = [EOFError(), 4]
+        self.geobase.ftp.retrbinary.side_effect = (
+            lambda cmd, write, rest: write(b"abcd"))
+        with TemporaryDirectory() as tmp_dir:
+            self.assertTrue(
+                download_from_ftp(self.href, os.path.join(tmp_dir, "a.zip"),
+                                  self.geobase))
+
+        self.assertEqual(self.geobase.ftp.size.call_count, 2)
+        self.assertEqual(self.geobase.connect.call_count, 1)
+
+    def test_size_is_checked(self):
+        # The transfer ends without an error, but short of the file's size
+        self.geobase.ftp.retrbinary.side_effect = (
+            lambda cmd, write, rest: write(b""))
+        with TemporaryDirectory() as tmp_dir:
+            with self.assertRaises(Exception):
+                download_from_ftp(self.href,
+                                  os.path.join(tmp_dir, "a.zip"),
+                                  self.geobase,
+                                  num_retries=2)
+
+        self.assertEqual(self.geobase.ftp.retrbinary.call_count, 3)
+
+    def test_missing_file(self):
+        self.geobase.ftp.size.side_effect = error_perm()
+        self.geobase.ftp.retrbinary.side_effect = error_perm()
+        with TemporaryDirectory() as tmp_dir:
+            self.assertFalse(
+                download_from_ftp(self.href, os.path.join(tmp_dir, "a.zip"),
+                                  self.geobase))
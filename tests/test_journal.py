@@ -0,0 +1,77 @@
+import os
+import pickle
+from tempfile import TemporaryDirectory
+import unittest
+
+from stactools.nrcan_spot_ortho.journal import CogifyJournal
+
+
+class CogifyJournalTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, "journal.sqlite")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_items(self):
+        journal = CogifyJournal(self.path)
+        journal.set_item("a", "started")
+        journal.set_item("b", "started")
+        journal.set_item("a", "saved")
+        journal.set_item("b", "failed", "no connection")
+        journal.close()
+
+        # A restarted run sees the previous run's progress
+        journal = CogifyJournal(self.path)
+        self.assertEqual(journal.items("saved"), {"a"})
+        self.assertEqual(journal.items("failed"), {"b"})
+        journal.close()
+
+    def test_saved_projs(self):
+        journal = CogifyJournal(self.path)
+        journal.set_item("a", "saved", projs=["lcc00"], layout="bands")
+        journal.set_item("b", "started")
+        journal.set_item("b", "saved", projs=[], layout="bands")
+        journal.set_item("a",
+                         "saved",
+                         projs=["lcc00", "utm17"],
+                         layout="merged")
+        journal.set_item("a", "saved", projs=["utm17"], layout="bands")
+        journal.close()
+
+        journal = CogifyJournal(self.path)
+        self.assertEqual(journal.saved_projs("bands"),
+                         {"a": {"lcc00", "utm17"}})
+        self.assertEqual(journal.saved_projs("merged"),
+                         {"a": {"lcc00", "utm17"}})
+        self.assertEqual(journal.items("saved"), {"a", "b"})
+        journal.close()
+
+    def test_published_cogs(self):
+        journal = CogifyJournal(self.path)
+        zip_href = "ftp/a_m20_lcc00.zip"
+        journal.set_asset("a", zip_href, "downloaded")
+        journal.set_asset("a", "cogs/a_1_cog.tif", "uploaded", zip_href)
+        journal.set_asset("a", "cogs/a_2_cog.tif", "translated", zip_href)
+        self.assertIsNone(journal.published_cogs("a", zip_href))
+
+        # Journals passed to other processes open their own connection
+        journal = pickle.loads(pickle.dumps(journal))
+        journal.set_asset("a", "cogs/a_2_cog.tif", "uploaded", zip_href)
+        journal.set_asset("a", zip_href, "published")
+        self.assertEqual(journal.published_cogs("a", zip_href),
+                         ["cogs/a_1_cog.tif", "cogs/a_2_cog.tif"])
+        self.assertIsNone(journal.published_cogs("b", zip_href))
+
+        # Only the COGs of the layout the zip file was published in count
+        journal.set_asset("a", "cogs/a_cog.tif", "uploaded", zip_href,
+                          "merged")
+        self.assertEqual(journal.published_cogs("a", zip_href),
+                         ["cogs/a_1_cog.tif", "cogs/a_2_cog.tif"])
+        self.assertIsNone(journal.published_cogs("a", zip_href, "merged"))
+        journal.set_asset("a", zip_href, "published", layout="merged")
+        self.assertEqual(journal.published_cogs("a", zip_href, "merged"),
+                         ["cogs/a_cog.tif"])
+        self.assertIsNone(journal.published_cogs("a", zip_href))
+        journal.close()
@@ -0,0 +1,74 @@
+from contextlib import redirect_stdout
+from io import StringIO
+import json
+import os
+from tempfile import TemporaryDirectory
+import unittest
+
+from stactools.nrcan_spot_ortho.metrics import Metrics
+from stactools.nrcan_spot_ortho.pipeline import Stage, run_pipeline
+
+
+class MetricsTest(unittest.TestCase):
+    def test_events(self):
+        with TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "metrics.jsonl")
+            metrics = Metrics(path)
+            hooked = []
+            metrics.add_hook(hooked.append)
+
+            with metrics.timer("download", path="a.zip") as event:
+                event["bytes"] = 2000000
+            with self.assertRaises(ValueError):
+                with metrics.timer("download", path="b.zip"):
+                    raise ValueError("lost connection")
+            metrics.gauge("queue", 3, "translate")
+            metrics.close()
+
+            with open(path) as f:
+                events = [json.loads(line) for line in f]
+
+        self.assertEqual(events, hooked)
+        self.assertEqual([e.get("path") for e in events],
+                         ["a.zip", "b.zip", None])
+        self.assertIn("mb_per_s", events[0])
+        self.assertEqual(events[1]["error"], "lost connection")
+
+        summary = metrics.summary()
+        self.assertEqual(summary["download"]["count"], 2)
+        self.assertEqual(summary["download"]["failed"], 1)
+        self.assertEqual(summary["download"]["bytes"], 2000000)
+        self.assertEqual(summary["translate"], {"max_queue": 3})
+
+    def test_print_summary(self):
+        metrics = Metrics()
+        with metrics.timer("translate") as event:
+            event["bytes"] = 1000000
+        metrics.gauge("queue", 2, "translate")
+        metrics.gauge("queue", 1, "fetch")
+
+        out = StringIO()
+        with redirect_stdout(out):
+            metrics.print_summary()
+        lines = [line.split() for line in out.getvalue().splitlines()]
+
+        # The fetch stage only has a queue, so it has no timing row
+        self.assertIn(["queue", "max", "waiting"], lines)
+        self.assertEqual([line[0] for line in lines if line],
+                         ["stage", "translate", "queue", "fetch"])
+        self.assertEqual(lines[-1], ["fetch", "1"])
+        self.assertEqual(lines[2][1], "1")
+        self.assertEqual(lines[2][-1], "2")
+
+    def test_pipeline_queues(self):
+        metrics = Metrics()
+        stages = [
+            Stage("first", lambda x: [x]),
+            Stage("second", lambda x: [x])
+        ]
+        outputs, _ = run_pipeline(range(10), stages, 2, metrics)
+
+        self.assertEqual(len(outputs), 10)
+        summary = metrics.summary()
+        self.assertLessEqual(summary["first"]["max_queue"], 2)
+        self.assertLessEqual(summary["second"]["max_queue"], 2)
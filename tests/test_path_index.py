@@ -0,0 +1,76 @@
+import os
+from tempfile import TemporaryDirectory
+import unittest
+from unittest import mock
+
+import boto3
+try:
+    from moto import mock_aws
+except ImportError:  # moto < 5
+    from moto import mock_s3 as mock_aws
+
+from stactools.nrcan_spot_ortho.utils import PathIndex, get_existing_paths
+from tests.test_s3_uploader import aws_env
+
+
+class PathIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = TemporaryDirectory()
+        self.cog_dir = os.path.join(self.tmp_dir.name, "cogs")
+        os.makedirs(os.path.join(self.cog_dir, "item"))
+        self.cog_path = os.path.join(self.cog_dir, "item", "a_cog.tif")
+        open(self.cog_path, "w").close()
+        open(os.path.join(self.cog_dir, "item", "a.tif"), "w").close()
+        self.snapshot_path = os.path.join(self.tmp_dir.name, "snapshot.txt")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_snapshot(self):
+        index = PathIndex(self.cog_dir, "_cog.tif", self.snapshot_path)
+        self.assertIn(self.cog_path, index)
+        self.assertEqual(len(index), 1)
+
+        # New files are added to the snapshot, which is read instead of listing
+        # the directory again
+        new_path = os.path.join(self.cog_dir, "item", "b_cog.tif")
+        index.add(new_path)
+        os.remove(self.cog_path)
+        index = PathIndex(self.cog_dir, "_cog.tif", self.snapshot_path)
+        self.assertEqual(set(index), {self.cog_path, new_path})
+
+        index = PathIndex(self.cog_dir,
+                          "_cog.tif",
+                          self.snapshot_path,
+                          refresh=True)
+        self.assertEqual(len(index), 0)
+
+    def test_new_snapshot_directory(self):
+        snapshot_path = os.path.join(self.tmp_dir.name, "snapshots",
+                                     "existing_cog.tif.txt")
+        index = PathIndex(self.cog_dir, "_cog.tif", snapshot_path)
+        index.add(os.path.join(self.cog_dir, "item", "b_cog.tif"))
+
+        index = PathIndex(self.cog_dir, "_cog.tif", snapshot_path)
+        self.assertEqual(len(index), 2)
+
+    def test_snapshot_of_other_directory(self):
+        PathIndex(self.tmp_dir.name, "_cog.tif", self.snapshot_path)
+        open(os.path.join(self.tmp_dir.name, "b_cog.tif"), "w").close()
+        index = PathIndex(self.cog_dir, "_cog.tif", self.snapshot_path)
+
+        self.assertEqual(set(index), {self.cog_path})
+
+
+@mock.patch.dict(os.environ, aws_env)
+@mock_aws
+class ExistingS3PathsTest(unittest.TestCase):
+    def test_prefix(self):
+        s3 = boto3.client("s3")
+        s3.create_bucket(Bucket="spot")
+        for key in ["cogs/a_cog.tif", "cogs/a.tif", "other/b_cog.tif"]:
+            s3.put_object(Bucket="spot", Key=key, Body=b"")
+
+        self.assertEqual(get_existing_paths("s3://spot/cogs", "_cog.tif"),
+                         {"s3://spot/cogs/a_cog.tif"})
+        self.assertEqual(len(get_existing_paths("s3://spot", "_cog.tif")), 2)
@@ -0,0 +1,55 @@
+import threading
+import time
+import unittest
+
+from stactools.nrcan_spot_ortho.pipeline import Stage, run_pipeline
+
+
+class PipelineTest(unittest.TestCase):
+    def test_run_pipeline(self):
+        stages = [
+            Stage("split", lambda x: [x, x + 100], workers=2),
+            Stage("double", lambda x: [x * 2], workers=3),
+        ]
+        outputs, failures = run_pipeline(range(5), stages)
+
+        self.assertEqual(sorted(outputs),
+                         [0, 2, 4, 6, 8, 200, 202, 204, 206, 208])
+        self.assertEqual(failures, [])
+
+    def test_failures_are_isolated(self):
+        def check(x):
+            if x == 3:
+                raise ValueError("bad input")
+            return [x]
+
+        stages = [Stage("check", check), Stage("pass", lambda x: [x])]
+        outputs, failures = run_pipeline(range(5), stages)
+
+        self.assertEqual(sorted(outputs), [0, 1, 2, 4])
+        self.assertEqual(len(failures), 1)
+        self.assertEqual(failures[0][:2], ("check", 3))
+
+    def test_backpressure(self):
+        in_flight = [0]
+        max_in_flight = [0]
+        lock = threading.Lock()
+
+        def produce(x):
+            with lock:
+                in_flight[0] += 1
+                max_in_flight[0] = max(max_in_flight[0], in_flight[0])
+            return [x]
+
+        def consume(x):
+            time.sleep(0.01)
+            with lock:
+                in_flight[0] -= 1
+            return [x]
+
+        stages = [Stage("produce", produce), Stage("consume", consume)]
+        outputs, _ = run_pipeline(range(20), stages, queue_size=2)
+
+        self.assertEqual(len(outputs), 20)
+        # At most queue_size waiting, one being consumed and one being produced
+        self.assertLessEqual(max_in_flight[0], 4)
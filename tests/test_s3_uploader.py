@@ -0,0 +1,73 @@
+import os
+from tempfile import TemporaryDirectory
+import unittest
+from unittest import mock
+from urllib.parse import urlparse
+
+import boto3
+try:
+    from moto import mock_aws
+except ImportError:  # moto < 5
+    from moto import mock_s3 as mock_aws
+
+from stactools.nrcan_spot_ortho.utils import S3Uploader
+
+aws_env = {
+    "AWS_ACCESS_KEY_ID": "testing",
+    "AWS_SECRET_ACCESS_KEY": "testing",
+    "AWS_DEFAULT_REGION": "us-east-1"
+}
+
+
+@mock.patch.dict(os.environ, aws_env)
+@mock_aws
+class S3UploaderTest(unittest.TestCase):
+    def setUp(self):
+        self.s3 = boto3.client("s3")
+        self.s3.create_bucket(Bucket="cogs")
+        self.tmp_dir = TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def write(self, name, size):
+        local_path = os.path.join(self.tmp_dir.name, name)
+        with open(local_path, "wb") as f:
+            f.write(os.urandom(size))
+        return local_path
+
+    def test_multipart_upload(self):
+        local_path = self.write("big_cog.tif", 12 * 1024 * 1024)
+        uploader = S3Uploader(chunk_size=5 * 1024 * 1024, max_concurrency=2)
+        uploader.upload(urlparse("s3://cogs/a/big_cog.tif"), local_path)
+
+        head = self.s3.head_object(Bucket="cogs", Key="a/big_cog.tif")
+        self.assertEqual(head["ContentLength"], 12 * 1024 * 1024)
+        # Multipart uploads have an ETag suffixed with the number of parts
+        self.assertTrue(head["ETag"].endswith('-3"'))
+
+    def test_background_uploads(self):
+        uploader = S3Uploader(max_pending=2)
+        local_paths = [self.write(f"cog_{i}.tif", 1024) for i in range(5)]
+        for local_path in local_paths:
+            uploader.submit(
+                urlparse(f"s3://cogs/{os.path.basename(local_path)}"),
+                local_path,
+                remove=True)
+        uploader.close()
+
+        keys = [
+            obj["Key"]
+            for obj in self.s3.list_objects_v2(Bucket="cogs")["Contents"]
+        ]
+        self.assertEqual(sorted(keys), [f"cog_{i}.tif" for i in range(5)])
+        self.assertFalse(any(os.path.exists(p) for p in local_paths))
+
+    def test_upload_errors(self):
+        uploader = S3Uploader()
+        local_path = self.write("cog.tif", 1024)
+        future = uploader.submit(urlparse("s3://missing-bucket/cog.tif"),
+                                 local_path)
+
+        with self.assertRaises(Exception):
+            future.result()
@@ -0,0 +1,101 @@
+import os
+from tempfile import TemporaryDirectory
+import unittest
+from unittest import mock
+
+from urllib3.exceptions import ProtocolError
+
+from stactools.nrcan_spot_ortho.sources import (FTPSource, HTTPSource,
+                                                MirrorSource, open_source)
+
+spot_location = "/pub/nrcan_rncan/image/spot/geobase_orthoimages"
+spot_id = "s5_09537_5435_20070531"
+zip_href = (f"http://ftp.geogratis.gc.ca{spot_location}/{spot_id}/"
+            f"{spot_id}_m20_lcc00.zip")
+
+
+class MirrorSourceTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = TemporaryDirectory()
+        self.root = self.tmp_dir.name
+        image_dir = os.path.join(self.root, spot_location[1:], spot_id)
+        os.makedirs(image_dir)
+        self.zip_path = os.path.join(image_dir, f"{spot_id}_m20_lcc00.zip")
+        with open(self.zip_path, "wb") as f:
+            f.write(b"zip")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_mirror(self):
+        source = open_source(self.root)
+
+        self.assertIsInstance(source, MirrorSource)
+        self.assertEqual(source.local_path(zip_href), self.zip_path)
+        self.assertIsNone(source.local_path(zip_href.replace("m20", "p10")))
+        self.assertEqual(source.list_contents(spot_id.upper()),
+                         [zip_href[len("http://"):]])
+
+        out_path = os.path.join(self.root, "out.zip")
+        self.assertTrue(source.fetch(zip_href, out_path))
+        with open(out_path, "rb") as f:
+            self.assertEqual(f.read(), b"zip")
+
+    def test_local_hrefs(self):
+        source = open_source("ftp")
+
+        self.assertIsInstance(source, FTPSource)
+        self.assertEqual(source.local_path(f"file://{self.zip_path}"),
+                         self.zip_path)
+        self.assertIsNone(source.local_path(zip_href))
+
+        # Missing local files aren't read in place, nor found
+        missing_path = os.path.join(self.root, "missing.zip")
+        self.assertIsNone(source.local_path(missing_path))
+        self.assertFalse(
+            source.fetch(missing_path, os.path.join(self.root, "out.zip")))
+
+    def test_unknown_source(self):
+        with self.assertRaises(Exception):
+            open_source(os.path.join(self.root, "missing"))
+
+
+class HTTPSourceTest(unittest.TestCase):
+    def response(self, status, chunks, error=None):
+        def stream(chunk_size):
+            yield from chunks
+            if error is not None:
+                raise error
+
+        response = mock.Mock(status=status)
+        response.stream.side_effect = stream
+        return response
+
+    def test_resume(self):
+        source = HTTPSource()
+        source.http = mock.Mock()
+        source.http.request.side_effect = [
+            self.response(200, [b"abc"], ProtocolError("dropped")),
+            self.response(206, [b"def"]),
+        ]
+
+        with TemporaryDirectory() as tmp_dir:
+            out_path = os.path.join(tmp_dir, "out.zip")
+            self.assertTrue(source.fetch(zip_href, out_path))
+            with open(out_path, "rb") as f:
+                self.assertEqual(f.read(), b"abcdef")
+
+        headers = [
+            kwargs["headers"]
+            for _, _, kwargs in source.http.request.mock_calls
+        ]
+        self.assertEqual(headers, [{}, {"Range": "bytes=3-"}])
+
+    def test_missing(self):
+        source = HTTPSource()
+        source.http = mock.Mock()
+        source.http.request.return_value = self.response(404, [])
+
+        with TemporaryDirectory() as tmp_dir:
+            self.assertFalse(
+                source.fetch(zip_href, os.path.join(tmp_dir, "out.zip")))
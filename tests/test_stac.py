@@ -0,0 +1,99 @@
+import os
+from tempfile import TemporaryDirectory
+import unittest
+import warnings
+
+import fiona
+import pystac
+
+from stactools.nrcan_spot_ortho.stac import _iter_items, build_items
+from stactools.nrcan_spot_ortho.stac_templates import build_root_catalog
+from tests.test_utils import crs, hrefs, schema, src0, write_test_hrefs
+
+
+def write_index(index_path, names):
+    """Write an index shapefile with a copy of the test feature per name."""
+    with fiona.open(index_path,
+                    mode='w',
+                    driver='ESRI Shapefile',
+                    schema=schema,
+                    crs=crs) as output:
+        for i, name in enumerate(names):
+            output.write({**src0, 'id': str(i), 'properties': {'NAME': name}})
+
+
+class IterItemsTest(unittest.TestCase):
+    def test_range(self):
+        names = [f"S5_0953{i}_5435_20070531" for i in range(5)]
+        with TemporaryDirectory() as tmp_dir:
+            index_path = os.path.join(tmp_dir, "index.shp")
+            write_index(index_path, names)
+            write_test_hrefs(os.path.join(tmp_dir, "spot_hrefs_test.json"))
+
+            with warnings.catch_warnings():
+                warnings.simplefilter("error", UserWarning)
+                items = list(
+                    _iter_items(index_path, 1, 4, True, None, batch_size=2))
+
+        self.assertEqual([item.id for item in items], names[1:4])
+        self.assertEqual(len(items[0].assets), len(hrefs["hrefs"]) + 1)
+
+
+class BuildItemsTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = TemporaryDirectory()
+        self.root_href = os.path.join(self.tmp_dir.name, "stac")
+        write_test_hrefs(
+            os.path.join(self.tmp_dir.name, "spot_hrefs_test.json"))
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def build(self, index_name, names, incremental=False):
+        index_path = os.path.join(self.tmp_dir.name, index_name)
+        write_index(index_path, names)
+        if incremental:
+            spot_catalog = pystac.read_file(
+                os.path.join(self.root_href, "catalog.json"))
+        else:
+            spot_catalog = build_root_catalog()
+        build_items(index_path,
+                    spot_catalog,
+                    True,
+                    self.root_href,
+                    pystac.CatalogType.SELF_CONTAINED,
+                    incremental=incremental)
+
+    def year_catalogs(self):
+        """The year catalogs of the saved catalog, with their item IDs."""
+        catalog = pystac.read_file(os.path.join(self.root_href,
+                                                "catalog.json"))
+        ortho_catalog = catalog.get_child("canada-spot-orthoimages")
+        return sorted((child.id, sorted(item.id for item in child.get_items()))
+                      for collection in ortho_catalog.get_children()
+                      for child in collection.get_children())
+
+    def test_year_catalogs(self):
+        # Year catalogs are created mid-run, then reused by later items
+        self.build("index.shp", [
+            "S5_00001_5435_20070531", "S4_00002_5435_20070601",
+            "S5_00003_5435_20080531", "S5_00004_5435_20070701"
+        ])
+        self.assertEqual(self.year_catalogs(), [
+            ("S4_2007", ["S4_00002_5435_20070601"]),
+            ("S5_2007", ["S5_00001_5435_20070531", "S5_00004_5435_20070701"]),
+            ("S5_2008", ["S5_00003_5435_20080531"]),
+        ])
+
+        # An incremental run reuses the year catalogs read from the catalog,
+        # adds new ones once, and deletes the ones left empty
+        self.build("index2.shp", [
+            "S5_00001_5435_20070531", "S5_00005_5435_20090531",
+            "S5_00006_5435_20090601", "S4_00002_5435_20070601"
+        ],
+                   incremental=True)
+        self.assertEqual(self.year_catalogs(), [
+            ("S4_2007", ["S4_00002_5435_20070601"]),
+            ("S5_2007", ["S5_00001_5435_20070531"]),
+            ("S5_2009", ["S5_00005_5435_20090531", "S5_00006_5435_20090601"]),
+        ])
@@ -0,0 +1,60 @@
+import os
+from tempfile import TemporaryDirectory
+import unittest
+from unittest import mock
+
+import boto3
+try:
+    from moto import mock_aws
+except ImportError:  # moto < 5
+    from moto import mock_s3 as mock_aws
+import pystac
+
+from stactools.nrcan_spot_ortho.utils import (CustomStacIO, WriteManifest,
+                                              _s3_client, batch_writes)
+from tests.test_s3_uploader import aws_env
+
+
+@mock.patch.dict(os.environ, aws_env)
+@mock_aws
+class CustomStacIOTest(unittest.TestCase):
+    def setUp(self):
+        # Clients made outside of the mock would reach the real S3
+        _s3_client.clear()
+        self.s3 = boto3.client("s3")
+        self.s3.create_bucket(Bucket="stac")
+        pystac.StacIO.set_default(CustomStacIO)
+
+        self.catalog = pystac.Catalog("root", "Root catalog")
+        for i in range(20):
+            self.catalog.add_child(pystac.Catalog(f"child{i}", "Child"))
+        self.catalog.normalize_hrefs("s3://stac/catalog")
+
+    def tearDown(self):
+        _s3_client.clear()
+
+    def test_batch_writes(self):
+        with TemporaryDirectory() as tmp_dir:
+            manifest = WriteManifest(os.path.join(tmp_dir, "manifest.json"))
+            CustomStacIO.manifest = manifest
+            try:
+                with batch_writes(max_pending=4):
+                    self.catalog.save(pystac.CatalogType.ABSOLUTE_PUBLISHED)
+            finally:
+                CustomStacIO.manifest = None
+
+        keys = [
+            obj["Key"]
+            for obj in self.s3.list_objects_v2(Bucket="stac")["Contents"]
+        ]
+        self.assertEqual(len(keys), 21)
+        self.assertEqual(manifest.written, 21)
+
+        catalog = pystac.read_file("s3://stac/catalog/catalog.json")
+        self.assertEqual(len(list(catalog.get_children())), 20)
+
+    def test_failed_writes_raise(self):
+        self.s3.delete_bucket(Bucket="stac")
+        with self.assertRaises(Exception):
+            with batch_writes():
+                self.catalog.save(pystac.CatalogType.ABSOLUTE_PUBLISHED)
@@ -0,0 +1,70 @@
+import unittest
+
+from pyproj import CRS, Transformer
+
+from stactools.nrcan_spot_ortho.utils import (bbox, transform_geom,
+                                              transform_geoms)
+from tests.test_utils import crs, src0
+
+
+class TransformGeomsTest(unittest.TestCase):
+    def test_transform_geoms(self):
+        transformer = Transformer.from_crs(CRS(crs), CRS("WGS84"))
+        polygon = src0["geometry"]["coordinates"]
+        with_hole = [
+            [(0, 0), (0, 100000), (100000, 100000), (0, 0)],
+            [(10, 10), (10, 20), (20, 20), (10, 10)],
+        ]
+        geoms = [polygon, with_hole, polygon]
+
+        new_geoms, bboxes = transform_geoms(transformer, [{
+            "type": "Polygon",
+            "coordinates": geom
+        } for geom in geoms])
+
+        self.assertEqual(bboxes.shape, (3, 4))
+        for geom, new_geom, geom_bbox in zip(geoms, new_geoms, bboxes):
+            expected = transform_geom(transformer, geom)
+            self.assertEqual(new_geom, expected)
+            feature = {"geometry": {"coordinates": expected}}
+            self.assertEqual(tuple(geom_bbox), bbox(feature))
+
+    def test_multipolygon(self):
+        transformer = Transformer.from_crs(CRS(crs), CRS("WGS84"))
+        polygon = src0["geometry"]["coordinates"]
+        other = [[(0, 0), (0, 100000), (100000, 100000), (0, 0)]]
+        geoms = [{
+            "type": "MultiPolygon",
+            "coordinates": [polygon, other]
+        }, {
+            "type": "Polygon",
+            "coordinates": polygon
+        }]
+
+        new_geoms, bboxes = transform_geoms(transformer, geoms)
+
+        self.assertEqual(bboxes.shape, (2, 4))
+        expected = [
+            transform_geom(transformer, polygon),
+            transform_geom(transformer, other)
+        ]
+        self.assertEqual(new_geoms[0], expected)
+        self.assertEqual(new_geoms[1], expected[0])
+        feature = {"geometry": {"coordinates": expected}}
+        self.assertEqual(tuple(bboxes[0]), bbox(feature))
+        feature = {"geometry": {"coordinates": expected[0]}}
+        self.assertEqual(tuple(bboxes[1]), bbox(feature))
+
+    def test_unsupported_geometry(self):
+        transformer = Transformer.from_crs(CRS(crs), CRS("WGS84"))
+        with self.assertRaises(ValueError):
+            transform_geoms(transformer, [{
+                "type": "Point",
+                "coordinates": (0, 0)
+            }])
+
+    def test_no_geoms(self):
+        transformer = Transformer.from_crs(CRS(crs), CRS("WGS84"))
+        new_geoms, bboxes = transform_geoms(transformer, [])
+        self.assertEqual(new_geoms, [])
+        self.assertEqual(len(bboxes), 0)
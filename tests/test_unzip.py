@@ -0,0 +1,30 @@
+import os
+from tempfile import TemporaryDirectory
+import unittest
+import zipfile
+
+from stactools.nrcan_spot_ortho.utils import unzip, zip_members
+
+
+class UnzipTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = TemporaryDirectory()
+        self.zip_path = os.path.join(self.tmp_dir.name, "image.zip")
+        with zipfile.ZipFile(self.zip_path, "w") as zfile:
+            zfile.writestr("image/image_1.tif", b"1" * 1000)
+            zfile.writestr("image/image.txt", b"text")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_unzip(self):
+        out_paths = unzip(self.zip_path, self.tmp_dir.name, chunk_size=64)
+
+        self.assertEqual(out_paths,
+                         [os.path.join(self.tmp_dir.name, "image_1.tif")])
+        with open(out_paths[0], "rb") as f:
+            self.assertEqual(f.read(), b"1" * 1000)
+
+    def test_zip_members(self):
+        self.assertEqual(zip_members(self.zip_path),
+                         [f"/vsizip/{self.zip_path}/image/image_1.tif"])
@@ -1,6 +1,14 @@
 from collections import OrderedDict
+from datetime import datetime
 import fiona
 import json
+import os
+from zipfile import ZipFile
+
+import numpy as np
+import pystac
+import rasterio
+from rasterio.transform import from_origin
 
 # Test cases, file names to keys and values that should exist.
 schema = {
@@ -61,3 +69,70 @@ def write_test_index(test_index_path):
 def write_test_hrefs(test_hrefs_path):
     with open(test_hrefs_path, 'w') as f:
         json.dump(hrefs, f)
+
+
+def write_test_zip(zip_path, tif_names, size=64):
+    """Write zipped single-band GeoTIFFs, laid out as in Geobase zip files."""
+    with ZipFile(zip_path, 'w') as zfile:
+        for value, tif_name in enumerate(tif_names):
+            tif_path = os.path.join(os.path.dirname(zip_path), tif_name)
+            with rasterio.open(tif_path,
+                               'w',
+                               driver='GTiff',
+                               width=size,
+                               height=size,
+                               count=1,
+                               dtype='uint8',
+                               crs='EPSG:3979',
+                               transform=from_origin(0, 0, 20, 20)) as dst:
+                dst.write(np.full((1, size, size), value, dtype='uint8'))
+            zfile.write(tif_path, f"{tif_name[:-4]}/{tif_name}")
+            os.remove(tif_path)
+
+
+def write_test_catalog(root,
+                       spot_ids,
+                       projs=("lcc00", ),
+                       missing=(),
+                       corrupt=()):
+    """Write a catalog of SPOT items whose zipped m20 imagery, in each of
+    projs, and thumbnail are local files under root.
+
+    The zip files of the items in missing aren't written, so that they aren't
+    found, and those of the items in corrupt aren't zip files, so that
+    COGifying them fails.
+
+    Returns:
+        str: The path of the catalog.
+    """
+    data_dir = os.path.join(root, "data")
+    os.makedirs(data_dir)
+    catalog = pystac.Catalog("test", "Test catalog")
+    for spot_id in spot_ids:
+        base = spot_id.lower()
+        item = pystac.Item(spot_id, src0['geometry'], [0, 0, 1, 1],
+                           datetime(2007, 5, 31), {})
+        for proj in projs:
+            zip_path = os.path.join(data_dir, f"{base}_m20_{proj}.zip")
+            if spot_id in corrupt:
+                with open(zip_path, 'wb') as f:
+                    f.write(b"not a zip")
+            elif spot_id not in missing:
+                write_test_zip(
+                    zip_path,
+                    [f"{base}_m20_{i}_{proj}.tif" for i in range(1, 5)])
+            item.add_asset(
+                f"m20_{proj}",
+                pystac.Asset(zip_path,
+                             media_type="application/zip",
+                             roles=['data']))
+        tn_path = os.path.join(data_dir, f"{base}_tn.jpg")
+        with open(tn_path, 'wb') as f:
+            f.write(b"\xff\xd8\xff\xd9")
+        item.add_asset("thumbnail",
+                       pystac.Asset(tn_path, media_type=pystac.MediaType.JPEG))
+        catalog.add_item(item)
+
+    catalog.normalize_hrefs(os.path.join(root, "stac"))
+    catalog.save(pystac.CatalogType.ABSOLUTE_PUBLISHED)
+    return catalog.get_self_href()
@@ -0,0 +1,41 @@
+from datetime import datetime
+import gc
+import os
+from tempfile import TemporaryDirectory
+import unittest
+import weakref
+
+import pystac
+
+from stactools.nrcan_spot_ortho.writer import ItemWriter
+from tests.test_utils import src0
+
+
+class ItemWriterTest(unittest.TestCase):
+    def test_items_are_released(self):
+        with TemporaryDirectory() as tmp_dir:
+            catalog = pystac.Catalog("test", "Test catalog")
+            collection = pystac.Collection(
+                "collection", "Test collection",
+                pystac.Extent(pystac.SpatialExtent([[0, 0, 1, 1]]),
+                              pystac.TemporalExtent([[None, None]])))
+            catalog.add_child(collection)
+            writer = ItemWriter(catalog, tmp_dir,
+                                pystac.CatalogType.SELF_CONTAINED)
+
+            refs = []
+            for i in range(3):
+                item = pystac.Item(f"item{i}", src0["geometry"], [0, 0, 1, 1],
+                                   datetime(2007, 5, 31), {})
+                writer.add_item(item, collection)
+                refs.append(weakref.ref(item))
+            del item
+            gc.collect()
+
+            self.assertEqual([ref() for ref in refs], [None] * 3)
+            writer.finish()
+
+            catalog = pystac.read_file(os.path.join(tmp_dir, "catalog.json"))
+            self.assertEqual(
+                sorted(item.id for item in catalog.get_all_items()),
+                ["item0", "item1", "item2"])